@@ -0,0 +1,144 @@
+"""
+Tests for the arrays module.
+"""
+
+
+import os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import arrays
+from wiggelen.index import INDEX_SUFFIX, clear_cache
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if file.endswith(INDEX_SUFFIX):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+def expand(blocks):
+    """
+    Create a walker from blocks of arrays.
+    """
+    item = lambda x: x.item() if hasattr(x, 'item') else x
+    return [(region, item(position) + i, item(value))
+            for region, positions, spans, values in blocks
+            for position, span, value in zip(positions, spans, values)
+            for i in range(span)]
+
+
+class TestArrays(object):
+    """
+    Tests for the arrays module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
+    def _compare(self, filename, **kwargs):
+        expected = list(wiggelen.walk(open_(filename), **kwargs))
+        walker = expand(arrays.walk_arrays(open_(filename), **kwargs))
+        assert_equal(walker, expected)
+        assert_equal([type(v) for _, _, v in walker],
+                     [type(v) for _, _, v in expected])
+
+    def test_walk_arrays(self):
+        """
+        Walk over blocks of a track with multiple regions.
+        """
+        self._compare('b.wig')
+
+    def test_walk_arrays_fixed_step(self):
+        """
+        Walk over blocks of fixed step tracks.
+        """
+        self._compare('fixedstep.wig')
+        self._compare('fixedstep-without-step.wig')
+
+    def test_walk_arrays_complex(self):
+        """
+        Walk over blocks of a complex track.
+        """
+        self._compare('complex.wig')
+
+    def test_walk_arrays_index(self):
+        """
+        Walk over blocks of a track in order of the index.
+        """
+        self._compare('a.wig', force_index=True)
+        self._compare('b.wig', force_index=True)
+
+    def test_walk_arrays_chunks(self):
+        """
+        Walk over small blocks of a track.
+        """
+        expected = list(wiggelen.walk(open_('complex.wig')))
+        blocks = list(arrays.walk_arrays(open_('complex.wig'), chunk_size=64))
+        assert_true(len(blocks) > 1)
+        assert_equal(expand(blocks), expected)
+
+    def test_walk_arrays_python(self):
+        """
+        Walk over blocks of a track without NumPy.
+        """
+        numpy, arrays.numpy = arrays.numpy, None
+        try:
+            self._compare('b.wig')
+            self._compare('fixedstep.wig', force_index=True)
+        finally:
+            arrays.numpy = numpy
+
+    def test_walk_arrays_parse_error(self):
+        """
+        Walk over blocks of a malformed track.
+        """
+        track = StringIO('variableStep chrom=a\n1 5\n2 x\n')
+        assert_raises(wiggelen.ParseError, list, arrays.walk_arrays(track))
+
+    def test_walk_arrays_bedgraph(self):
+        """
+        Walk over blocks of a track in the bedGraph format.
+        """
+        # Integer and float values are mixed in the blocks, so we only
+        # compare the values and not their types.
+        expected = list(wiggelen.walk(open_('query.wig')))
+        assert_equal(expand(arrays.walk_arrays(open_('query.bedgraph'))),
+                     expected)
+        assert_equal(expand(arrays.walk_arrays(open_('query.bedgraph'),
+                                               force_index=True,
+                                               chunk_size=64)),
+                     expected)
+
+    def test_walk_arrays_regions(self):
+        """
+        Walk over blocks of some regions of a track.
+        """
+        self._compare('complex.wig', force_index=True, regions=['MT', '1'])
+        self._compare('complex.wig', force_index=True, regions=['13', 'A'])
+        remove_indices()
+        assert_raises(wiggelen.ReadError, arrays.walk_arrays,
+                      open_('complex.wig'), regions=['MT'])
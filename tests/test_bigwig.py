@@ -0,0 +1,334 @@
+"""
+Tests for the bigwig module.
+"""
+
+
+from io import BytesIO
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import bigwig
+from wiggelen.distance import distance
+from wiggelen.index import clear_cache, index
+from wiggelen.merge import merge
+from wiggelen.query import query
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def header(data):
+    """
+    Unpack the header of a bigWig track.
+    """
+    fields = struct.unpack('<IHHQQQHHQQIQ', data[:64])
+    return dict(zip(('magic', 'version', 'zoom_levels', 'chrom_tree_offset',
+                     'data_offset', 'index_offset', 'field_count',
+                     'defined_field_count', 'autosql_offset',
+                     'summary_offset', 'uncompress_buf_size',
+                     'extension_offset'), fields))
+
+
+def chroms(data):
+    """
+    Unpack the chromosome tree of a bigWig track.
+    """
+    return chrom_tree(data, header(data)['chrom_tree_offset'])
+
+
+def chrom_tree(data, offset):
+    """
+    Unpack a chromosome B+ tree at `offset`.
+    """
+    _, _, key_size, _, _, _ = struct.unpack(
+        '<IIIIQQ', data[offset:offset + 32])
+    result = {}
+
+    def node(offset):
+        leaf, _, count = struct.unpack('<BBH', data[offset:offset + 4])
+        offset += 4
+        for _ in range(count):
+            value = data[offset + key_size:offset + key_size + 8]
+            if leaf:
+                key = data[offset:offset + key_size].rstrip(b'\0')
+                result[key.decode('ascii')] = struct.unpack('<II', value)
+            else:
+                node(struct.unpack('<Q', value)[0])
+            offset += key_size + 8
+
+    node(offset + 32)
+    return result
+
+
+def records(data):
+    """
+    Unpack all bedGraph records of a bigWig track, using the leaves of the
+    R-tree index.
+    """
+    names = dict((chrom_id, name)
+                 for name, (chrom_id, _) in chroms(data).items())
+    offset = header(data)['index_offset'] + 48
+    result = []
+
+    def node(offset):
+        leaf, _, count = struct.unpack('<BBH', data[offset:offset + 4])
+        for i in range(count):
+            if leaf:
+                item = struct.unpack('<IIIIQQ', data[offset + 4 + 32 * i:
+                                                     offset + 36 + 32 * i])
+                block = zlib.decompress(data[item[4]:item[4] + item[5]])
+                chrom_id = struct.unpack('<I', block[:4])[0]
+                n = struct.unpack('<H', block[22:24])[0]
+                for j in range(n):
+                    start, end, value = struct.unpack(
+                        '<IIf', block[24 + 12 * j:36 + 12 * j])
+                    result.append((names[chrom_id], start + 1, end, value))
+            else:
+                item = struct.unpack('<IIIIQ', data[offset + 4 + 24 * i:
+                                                    offset + 28 + 24 * i])
+                node(item[4])
+
+    node(offset)
+    return result
+
+
+class TestBigwig(object):
+    """
+    Tests for the bigwig module.
+    """
+    @classmethod
+    def setup_class(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        clear_cache()
+        shutil.rmtree(cls.temp_dir)
+
+    def teardown(self):
+        clear_cache()
+
+    def _copy(self, filename):
+        path = os.path.join(self.temp_dir, filename)
+        shutil.copy(os.path.join(DATA_DIR, filename), path)
+        return path
+
+    def _convert(self, filename):
+        path = os.path.join(self.temp_dir, filename + '.bw')
+        with open(path, 'wb') as track:
+            bigwig.write_bigwig(wiggelen.walk(open_(filename)), track)
+        return path
+
+    def _write(self, walker, **kwargs):
+        track = BytesIO()
+        bigwig.write_bigwig(walker, track, **kwargs)
+        return track.getvalue()
+
+    def test_write(self):
+        """
+        Write a bigWig track.
+        """
+        data = self._write(wiggelen.walk(open_('b.wig')))
+        assert_equal(header(data)['magic'], bigwig.BIGWIG_MAGIC)
+        assert_equal(header(data)['version'], 4)
+        assert_equal(struct.unpack('<I', data[-4:])[0], bigwig.BIGWIG_MAGIC)
+        assert_equal(sorted(chroms(data)), ['1', '13', 'MT'])
+        assert_equal(records(data),
+                     [(r, p, p, v) for r, p, v in
+                      wiggelen.walk(open_('b.wig'))])
+
+    def test_write_runs(self):
+        """
+        Write a bigWig track from runs, combining adjacent runs with the same
+        value.
+        """
+        walker = [('chr2', 1, 4, 2), ('chr2', 5, 5, 2), ('chr2', 7, 9, 3.5),
+                  ('chr1', 3, 3, 1), ('chr1', 4, 10, 0)]
+        data = self._write(walker, runs=True, sizes={'chr1': 100})
+        assert_equal(records(data),
+                     [('chr2', 1, 5, 2), ('chr2', 7, 9, 3.5),
+                      ('chr1', 3, 3, 1), ('chr1', 4, 10, 0)])
+        assert_equal(chroms(data), {'chr1': (1, 100), 'chr2': (0, 9)})
+        offset = header(data)['summary_offset']
+        assert_equal(struct.unpack('<Qdddd', data[offset:offset + 40]),
+                     (16, 0, 3.5, 2 * 5 + 3.5 * 3 + 1,
+                      4 * 5 + 3.5 ** 2 * 3 + 1))
+
+    def test_write_many(self):
+        """
+        Write a bigWig track with many blocks and zoom levels.
+        """
+        walker = [('chr1', p, p, p % 7) for p in range(1, 300000, 3)]
+        data = self._write(walker, runs=True)
+        assert_equal(records(data), walker)
+        assert header(data)['zoom_levels'] > 0
+
+    def test_write_many_regions(self):
+        """
+        Write a bigWig track with more regions than fit in one node of the
+        chromosome tree.
+        """
+        walker = [('scaffold%d' % i, 1, 1, i)
+                  for i in range(bigwig.BLOCK_SIZE * 2 + 2)]
+        data = self._write(walker, runs=True)
+        regions = dict((region, i) for i, (region, _, _, _)
+                       in enumerate(walker))
+        assert_equal(chroms(data),
+                     dict((region, (i, 1)) for region, i in regions.items()))
+        path = os.path.join(self.temp_dir, 'many_regions.bw')
+        with open(path, 'wb') as track:
+            track.write(data)
+        assert_equal(list(wiggelen.walk(open(path, 'rb'), runs=True,
+                                        regions=['scaffold3',
+                                                 'scaffold513'])),
+                     [('scaffold3', 1, 1, 3), ('scaffold513', 1, 1, 513)])
+
+    def test_chrom_tree(self):
+        """
+        Chromosome tree with more chromosomes than fit in two levels of
+        nodes.
+        """
+        sizes = dict(('scaffold%d' % i, i + 1) for i in range(70000))
+        tree = bigwig._chrom_tree([(name, i, size) for i, (name, size)
+                                   in enumerate(sorted(sizes.items()))], 100)
+        result = chrom_tree(b'\0' * 100 + tree, 100)
+        assert_equal(dict((name, size) for name, (_, size) in result.items()),
+                     sizes)
+
+    def test_write_empty(self):
+        """
+        Write an empty bigWig track.
+        """
+        data = self._write([])
+        assert_equal(header(data)['zoom_levels'], 0)
+        assert_equal(chroms(data), {})
+        assert_equal(records(data), [])
+
+    def test_write_not_consecutive(self):
+        """
+        Write a bigWig track where a region is not consecutive.
+        """
+        walker = [('chr1', 1, 1, 1), ('chr2', 1, 1, 2), ('chr1', 5, 5, 3)]
+        assert_raises(ValueError, self._write, walker, runs=True)
+
+    def test_write_unsorted(self):
+        """
+        Write a bigWig track where positions are not increasing.
+        """
+        walker = [('chr1', 5, 5, 1), ('chr1', 3, 3, 2)]
+        assert_raises(ValueError, self._write, walker, runs=True)
+
+    def test_write_beyond_size(self):
+        """
+        Write a bigWig track with data beyond the size of its region.
+        """
+        walker = [('chr1', 5, 10, 1)]
+        assert_raises(ValueError, self._write, walker, runs=True,
+                      sizes={'chr1': 8})
+
+    def test_is_bigwig(self):
+        """
+        Detect tracks in the bigWig format.
+        """
+        assert bigwig.is_bigwig(open_('sections.bw'))
+        assert bigwig.is_bigwig(open_('sections.bw', 'rb'))
+        assert not bigwig.is_bigwig(open_('b.wig'))
+        assert not bigwig.is_bigwig(BytesIO(b''))
+
+    def test_walk(self):
+        """
+        Walk over a bigWig track with all types of records.
+        """
+        assert_equal(list(wiggelen.walk(open_('sections.bw'), runs=True)),
+                     [('chr1', 1, 5, 1.0), ('chr1', 11, 15, 2.5),
+                      ('chr1', 21, 40, 3.0), ('chr1', 101, 110, 4.0),
+                      ('chr1', 201, 210, 5.5), ('chr1', 301, 310, 6.0),
+                      ('chr2', 51, 52, 7.0), ('chr2', 56, 57, 8.0),
+                      ('chr2', 61, 62, 9.0), ('chr2', 66, 67, 10.0),
+                      ('chrM', 1, 1, 0.5), ('chrM', 2, 2, 0.25),
+                      ('chrM', 3, 3, 0.75)])
+
+    def test_walk_regions(self):
+        """
+        Walk over some regions of a bigWig track.
+        """
+        assert_equal(list(wiggelen.walk(open_('sections.bw'),
+                                        regions=['chrM', 'chrX', 'chr2'])),
+                     [('chrM', 1, 0.5), ('chrM', 2, 0.25), ('chrM', 3, 0.75),
+                      ('chr2', 51, 7.0), ('chr2', 52, 7.0), ('chr2', 56, 8.0),
+                      ('chr2', 57, 8.0), ('chr2', 61, 9.0), ('chr2', 62, 9.0),
+                      ('chr2', 66, 10.0), ('chr2', 67, 10.0)])
+
+    def test_query(self):
+        """
+        Query a range in a region of a bigWig track.
+        """
+        assert_equal(list(query(open_('sections.bw'), 'chr1', 4, 22,
+                                runs=True)),
+                     [('chr1', 4, 5, 1.0), ('chr1', 11, 15, 2.5),
+                      ('chr1', 21, 22, 3.0)])
+        assert_equal(list(query(open_('sections.bw'), 'chr1', 6, 10)), [])
+        assert_equal(list(query(open_('sections.bw'), 'chrX', 1, 10)), [])
+
+    def test_roundtrip(self):
+        """
+        Write and read a bigWig track with many blocks.
+        """
+        path = os.path.join(self.temp_dir, 'many.bw')
+        walker = [('chr%d' % (p % 3), p, p, p % 7)
+                  for p in range(1, 300000, 3)]
+        walker.sort()
+        with open(path, 'wb') as track:
+            bigwig.write_bigwig(walker, track, runs=True)
+        assert_equal(list(wiggelen.walk(open(path), runs=True)), walker)
+        assert_equal(list(query(open(path), 'chr1', 1000, 1010)),
+                     [('chr1', p, p % 7) for p in range(1000, 1011, 3)])
+
+    def test_index(self):
+        """
+        Index a bigWig track.
+        """
+        idx, _ = index(open(self._convert('b.wig')), force=True)
+        expected, _ = index(open(self._copy('b.wig')), force=True)
+        # Regions without data are not in the bigWig track.
+        assert_equal(sorted(idx), sorted(r for r in expected
+                                         if expected[r]['count']))
+        for region in idx:
+            for field in 'sum', 'min', 'max', 'posmin', 'count':
+                assert_equal(idx[region][field], expected[region][field])
+
+    def test_merge(self):
+        """
+        Merge a bigWig track with a wiggle track.
+        """
+        walkers = [wiggelen.walk(open(self._copy('b.wig')), force_index=True),
+                   wiggelen.walk(open(self._convert('b.wig')),
+                                 force_index=True)]
+        assert_equal(list(merge(*walkers)),
+                     [(r, p, 2 * v) for r, p, v in
+                      wiggelen.walk(open(self._copy('b.wig')))])
+
+    def test_distance(self):
+        """
+        Distance between a bigWig track and a wiggle track.
+        """
+        tracks = [open(self._copy('a.wig')), open(self._copy('b.wig'))]
+        expected = distance(*tracks)
+        clear_cache()
+        tracks = [open(self._convert('a.wig')), open(self._convert('b.wig'))]
+        result = distance(*tracks)
+        for comparison in expected:
+            assert_almost_equal(result[comparison], expected[comparison])
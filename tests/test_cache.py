@@ -0,0 +1,126 @@
+"""
+Tests for the cache module.
+"""
+
+
+import os
+
+from nose import SkipTest
+from nose.tools import *
+
+import wiggelen
+from wiggelen import arrays, cache
+from wiggelen.cache import CACHE_SUFFIX, read_cache, write_cache
+from wiggelen.index import INDEX_SUFFIX, clear_cache
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index and cache files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if file.endswith(INDEX_SUFFIX) or file.endswith(CACHE_SUFFIX):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+class TestCache(object):
+    """
+    Tests for the cache module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
+    def _compare(self, filename, **kwargs):
+        expected = list(wiggelen.walk(open_(filename), **kwargs))
+        assert_not_equal(write_cache(open_(filename)), None)
+        walker = list(wiggelen.walk(open_(filename), **kwargs))
+        assert_equal(walker, expected)
+        assert_equal([type(v) for v in walker[-1]],
+                     [type(v) for v in expected[-1]])
+
+    def test_walk_cache(self):
+        """
+        Walk over a cached track.
+        """
+        if cache.numpy is None:
+            raise SkipTest
+        self._compare('b.wig')
+        self._compare('fixedstep.wig')
+        self._compare('fixedstep-without-step.wig', runs=True)
+        self._compare('complex.wig')
+
+    def test_walk_cache_index(self):
+        """
+        Walk over a cached track in order of the index.
+        """
+        if cache.numpy is None:
+            raise SkipTest
+        self._compare('a.wig', force_index=True)
+        self._compare('b.wig', force_index=True)
+
+    def test_walk_arrays_cache(self):
+        """
+        Walk over blocks of a cached track.
+        """
+        if cache.numpy is None:
+            raise SkipTest
+        write_cache(open_('b.wig'))
+        blocks = list(arrays.walk_arrays(open_('b.wig')))
+        assert_equal([region for region, _, _, _ in blocks],
+                     ['MT', '1', '13'])
+        assert_equal(list(blocks[0][1]), [2, 3, 4, 5, 7, 8, 9])
+
+    def test_invalidate_cache(self):
+        """
+        Ignore the cache if the track was modified.
+        """
+        if cache.numpy is None:
+            raise SkipTest
+        write_cache(open_('c.wig'))
+        assert_not_equal(read_cache(open_('c.wig')), None)
+        stat = os.stat(os.path.join(DATA_DIR, 'c.wig'))
+        os.utime(os.path.join(DATA_DIR, 'c.wig'),
+                 (stat.st_atime, stat.st_mtime + 10))
+        try:
+            assert_equal(read_cache(open_('c.wig')), None)
+        finally:
+            os.utime(os.path.join(DATA_DIR, 'c.wig'),
+                     (stat.st_atime, stat.st_mtime))
+
+    def test_corrupt_cache(self):
+        """
+        Ignore the cache if it is truncated or corrupt.
+        """
+        if cache.numpy is None:
+            raise SkipTest
+        expected = list(wiggelen.walk(open_('b.wig')))
+        filename = write_cache(open_('b.wig'))
+        with open(filename, 'rb') as f:
+            data = f.read()
+        table = data.rindex(b'size=')
+        for corrupt in (data[:len(data) // 2],
+                        data[:-8] + b'\xff' * 8,
+                        data[:table] + b'size\n' + data[table + 4:],
+                        data.replace(b'count=7', b'count=700'),
+                        data.replace(b'type=', b'type=x'),
+                        b''):
+            with open(filename, 'wb') as f:
+                f.write(corrupt)
+            assert_equal(read_cache(open_('b.wig')), None)
+            assert_equal(list(wiggelen.walk(open_('b.wig'))), expected)
@@ -0,0 +1,235 @@
+"""
+Tests for the compress module.
+"""
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import arrays, compress, query
+from wiggelen.index import INDEX_SUFFIX, clear_cache, index
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index and checkpoint files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+        query.clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if (file.endswith(INDEX_SUFFIX) or
+            file.endswith(query.CHECKPOINT_SUFFIX)):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+class TestCompress(object):
+    """
+    Tests for the compress module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+        cls.temp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def teardown(self):
+        remove_indices()
+
+    def _write(self, walker, filename, threads=1):
+        path = os.path.join(self.temp_dir, filename)
+        writer = compress.BgzfWriter(open(path, 'wb'), threads=threads)
+        wiggelen.write(iter(walker), track=writer)
+        writer.close()
+        return path
+
+    def test_detect(self):
+        """
+        Detect gzip and BGZF compressed tracks.
+        """
+        assert compress.is_gzip(open_('b.wig.gz'))
+        assert not compress.is_bgzf(open_('b.wig.gz'))
+        assert compress.is_gzip(open_('query.wig.gz'))
+        assert compress.is_bgzf(open_('query.wig.gz'))
+        assert not compress.is_gzip(open_('b.wig'))
+        assert not compress.is_bgzf(open_('b.wig'))
+        assert_equal(compress.decompress(open_('b.wig')).name,
+                     os.path.join(DATA_DIR, 'b.wig'))
+
+    def test_walk_gzip(self):
+        """
+        Walk over a gzip compressed track.
+        """
+        assert_equal(list(wiggelen.walk(open_('b.wig.gz'))),
+                     list(wiggelen.walk(open_('b.wig'))))
+
+    def test_walk_gzip_regions(self):
+        """
+        Walk over some regions of a gzip compressed track.
+        """
+        assert_equal(list(wiggelen.walk(open_('b.wig.gz'),
+                                        regions=['MT', '1'],
+                                        force_index=True)),
+                     list(wiggelen.walk(open_('b.wig'), regions=['MT', '1'],
+                                        force_index=True)))
+
+    def test_walk_pipe(self):
+        """
+        Walk over tracks read from a pipe that cannot seek.
+        """
+        env = dict(os.environ,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(
+                       os.path.abspath(__file__))))
+        script = ('import sys, wiggelen\n'
+                  'for item in wiggelen.walk(sys.stdin):\n'
+                  '    sys.stdout.write(repr(item) + "\\n")\n')
+        for filename, expected in (('b.wig.gz', 'b.wig'),
+                                   ('query.wig.gz', 'query.wig'),
+                                   ('b.wig', 'b.wig')):
+            process = subprocess.Popen([sys.executable, '-c', script],
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, env=env)
+            output = process.communicate(
+                open_(filename, 'rb').read())[0].decode('ascii')
+            assert_equal(process.returncode, 0)
+            assert_equal(output.splitlines(),
+                         [repr(item) for item in wiggelen.walk(
+                             StringIO(open_(expected).read()))])
+
+    def test_walk_bgzf(self):
+        """
+        Walk over a BGZF compressed track.
+        """
+        assert_equal(list(wiggelen.walk(open_('query.wig.gz'), runs=True)),
+                     list(wiggelen.walk(open_('query.wig'), runs=True)))
+
+    def test_index_bgzf(self):
+        """
+        Index a BGZF compressed track with virtual offsets.
+        """
+        idx, _ = index(open_('query.wig.gz'), force=True)
+        expected, _ = index(open_('query.wig'), force=True)
+        assert_equal(sorted(idx), sorted(expected))
+        for region in idx:
+            for field in 'sum', 'min', 'max', 'posmin', 'count':
+                assert_equal(idx[region][field], expected[region][field])
+        # The second region does not start in the first block.
+        assert idx['2']['start'] >> 16 > 0
+        track = compress.decompress(open_('query.wig.gz'))
+        track.seek(idx['2']['start'])
+        assert_equal(track.readline(),
+                     'fixedStep chrom=2 start=10 step=3 span=2\n')
+
+    def test_walk_index_bgzf(self):
+        """
+        Index a BGZF compressed track during a walk.
+        """
+        list(wiggelen.walk(open_('query.wig.gz'), force_index=True))
+        idx, _ = index(open_('query.wig.gz'))
+        remove_indices()
+        expected, _ = index(open_('query.wig.gz'), force=True)
+        assert_equal(idx, expected)
+
+    def test_walk_bgzf_regions(self):
+        """
+        Walk over some regions of a BGZF compressed track.
+        """
+        assert_equal(list(wiggelen.walk(open_('query.wig.gz'),
+                                        regions=['2', '1'],
+                                        force_index=True)),
+                     list(wiggelen.walk(open_('query.wig'),
+                                        regions=['2', '1'],
+                                        force_index=True)))
+
+    def test_query_bgzf(self):
+        """
+        Query ranges in a BGZF compressed track using checkpoints.
+        """
+        query.checkpoints(open_('query.wig.gz'), force=True, interval=32)
+        for region, start, end in [('1', 1, 200), ('1', 10, 20),
+                                   ('1', 58, 66), ('2', 1, 20),
+                                   ('2', 50, 91), ('2', 225, 400)]:
+            assert_equal(list(query.query(open_('query.wig.gz'), region,
+                                          start, end, force_index=True)),
+                         [(r, p, v) for r, p, v in
+                          wiggelen.walk(open_('query.wig'))
+                          if r == region and start <= p <= end])
+
+    def test_walk_arrays_bgzf(self):
+        """
+        Walk over blocks of a BGZF compressed track.
+        """
+        blocks = arrays.walk_arrays(open_('query.wig.gz'), force_index=True,
+                                    chunk_size=64)
+        assert_equal([(region, position, position + span - 1, value)
+                      for region, positions, spans, values in blocks
+                      for position, span, value in zip(positions, spans,
+                                                       values)],
+                     list(wiggelen.walk(open_('query.wig'), runs=True,
+                                        force_index=True)))
+
+    def test_read(self):
+        """
+        Read and seek in a BGZF compressed track.
+        """
+        track = compress.decompress(open_('query.wig.gz'))
+        lines = open_('query.wig').read()
+        assert_equal(track.read(10), lines[:10])
+        offset = track.tell()
+        assert_equal(track.read(), lines[10:])
+        assert_equal(track.read(), '')
+        track.seek(offset)
+        assert_equal(''.join(track), lines[10:])
+
+    def test_write_bgzf(self):
+        """
+        Write a BGZF compressed track with many blocks and its index.
+        """
+        walker = [('chr%d' % r, p, (p * r) % 101) for r in range(1, 4)
+                  for p in range(1, 60000, 3)]
+        path = self._write(walker, 'many.wig.gz')
+        assert compress.is_bgzf(open(path))
+        data = open(path, 'rb').read()
+        assert data.endswith(compress._compress_block(b''))
+        assert_equal(list(wiggelen.walk(open(path))), walker)
+        # The index is written along with the track.
+        assert os.path.exists(path + INDEX_SUFFIX)
+        clear_cache()
+        assert_equal(list(wiggelen.walk(open(path), regions=['chr3', 'chr1'])),
+                     [item for item in walker if item[0] == 'chr3'] +
+                     [item for item in walker if item[0] == 'chr1'])
+
+    def test_write_bgzf_threads(self):
+        """
+        Write a BGZF compressed track in parallel threads.
+        """
+        walker = [('chr1', p, p % 13) for p in range(1, 200000, 2)]
+        path = self._write(walker, 'single.wig.gz')
+        path_threads = self._write(walker, 'threads.wig.gz', threads=4)
+        assert_equal(open(path_threads, 'rb').read(), open(path, 'rb').read())
+        # The indices only differ in the modification time of the tracks.
+        assert_equal(open(path_threads + INDEX_SUFFIX).readlines()[1:],
+                     open(path + INDEX_SUFFIX).readlines()[1:])
@@ -4,11 +4,17 @@ Tests for the distance module.
 
 
 import os
+import shutil
+import tempfile
 
+from nose import SkipTest
 from nose.tools import *
 
-from wiggelen.distance import distance
-from wiggelen.index import INDEX_SUFFIX, clear_cache
+import wiggelen
+from wiggelen import distance as distance_
+from wiggelen import query
+from wiggelen.distance import distance, metrics
+from wiggelen.index import INDEX_SUFFIX, ReadError, clear_cache
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -23,12 +29,14 @@ def open_(filename, mode='r'):
 
 def remove_indices(keep_cache=False):
     """
-    Cleanup any index files for the test data.
+    Cleanup any index and checkpoint files for the test data.
     """
     if not keep_cache:
         clear_cache()
+        query.clear_cache()
     for file in os.listdir(DATA_DIR):
-        if file.endswith(INDEX_SUFFIX):
+        if (file.endswith(INDEX_SUFFIX) or
+            file.endswith(query.CHECKPOINT_SUFFIX)):
             os.unlink(os.path.join(DATA_DIR, file))
 
 
@@ -60,3 +68,234 @@ class TestDistance(object):
         track_b = open_('b.wig')
         assert_equal('%.3f' % distance(track_a, track_b, threshold=600)[1, 0],
                      '0.925')
+
+    def test_distance_vectorized(self):
+        """
+        Vectorized distance on many tracks is the same as the distance
+        computed per position.
+        """
+        if distance_.numpy is None:
+            raise SkipTest
+        filenames = ['a.wig', 'b.wig', 'c.wig', 'complex.wig',
+                     'fixedstep.wig', 'query.bedgraph']
+        for metric in sorted(metrics):
+            for threshold in None, 600:
+                options = dict(metric=metrics[metric], threshold=threshold)
+                expected = distance(*[open_(f) for f in filenames],
+                                    vectorized=False, **options)
+                result = distance(*[open_(f) for f in filenames], **options)
+                assert_equal(sorted(result), sorted(expected))
+                for comparison in expected:
+                    assert_almost_equal(result[comparison],
+                                        expected[comparison])
+
+    def test_distance_vectorized_chunks(self):
+        """
+        Vectorized distance with tracks decoded in small blocks.
+        """
+        if distance_.numpy is None:
+            raise SkipTest
+        filenames = ['a.wig', 'b.wig', 'complex.wig', 'fixedstep.wig']
+        expected = distance(*[open_(f) for f in filenames], vectorized=False)
+        walk_arrays = distance_.walk_arrays
+        vector_size = distance_._VECTOR_SIZE
+        distance_.walk_arrays = lambda track, **kwargs: walk_arrays(
+            track, chunk_size=64, **kwargs)
+        distance_._VECTOR_SIZE = 50
+        try:
+            result = distance(*[open_(f) for f in filenames])
+        finally:
+            distance_.walk_arrays = walk_arrays
+            distance_._VECTOR_SIZE = vector_size
+        for comparison in expected:
+            assert_almost_equal(result[comparison], expected[comparison])
+
+    def test_distance_parallel(self):
+        """
+        Distance calculated in parallel processes.
+        """
+        filenames = ['a.wig', 'b.wig', 'c.wig', 'complex.wig']
+        for vectorized in True, False:
+            expected = distance(*[open_(f) for f in filenames],
+                                vectorized=vectorized)
+            for jobs in 2, 20:
+                result = distance(*[open_(f) for f in filenames],
+                                  vectorized=vectorized, jobs=jobs)
+                assert_equal(sorted(result), sorted(expected))
+                for comparison in expected:
+                    assert_almost_equal(result[comparison],
+                                        expected[comparison])
+
+    def test_distance_per_region(self):
+        """
+        Distance per region is the distance between the tracks restricted to
+        that region.
+        """
+        filenames = ['a.wig', 'b.wig', 'c.wig']
+        result = distance(*[open_(f) for f in filenames], per_region=True)
+        assert_equal(sorted(result['13']), [(1, 0), (2, 1)])
+        assert_equal(distance(*[open_(f) for f in filenames], per_region=True,
+                              jobs=2), result)
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tracks = []
+            for filename in filenames:
+                path = os.path.join(temp_dir, filename)
+                with open(path, 'w') as track:
+                    wiggelen.write(wiggelen.walk(open_(filename),
+                                                 force_index=True,
+                                                 regions=['MT']),
+                                   track=track)
+                tracks.append(open(path))
+            expected = distance(*tracks)
+        finally:
+            shutil.rmtree(temp_dir)
+        assert_equal(sorted(result['MT']), sorted(expected))
+        for comparison in expected:
+            assert_almost_equal(result['MT'][comparison],
+                                expected[comparison])
+
+    def test_distance_state(self):
+        """
+        Reuse the calculated pairs of tracks in a distance state file after
+        adding tracks.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for filename in 'a.wig', 'b.wig', 'c.wig':
+                shutil.copy(os.path.join(DATA_DIR, filename), temp_dir)
+            tracks = lambda filenames: [open(os.path.join(temp_dir, f))
+                                        for f in filenames]
+            state = os.path.join(temp_dir, 'distances')
+            distance(*tracks(['a.wig', 'b.wig']), state=state)
+
+            # Calculated pairs are read from the state file.
+            with open(state) as f:
+                lines = f.readlines()
+            with open(state, 'w') as f:
+                f.writelines(line.replace('total=', 'total=1').replace(
+                    'count=', 'count=1') for line in lines)
+
+            expected = distance(*tracks(['c.wig', 'b.wig', 'a.wig']))
+            result = distance(*tracks(['c.wig', 'b.wig', 'a.wig']),
+                              state=state)
+            assert_equal(sorted(result), sorted(expected))
+            assert result[2, 1] != expected[2, 1]
+            for comparison in (1, 0), (2, 0):
+                assert_almost_equal(result[comparison],
+                                    expected[comparison])
+            assert_equal(distance(*tracks(['c.wig', 'b.wig', 'a.wig']),
+                                  state=state), result)
+
+            # Pairs with a changed track are calculated again.
+            with open(os.path.join(temp_dir, 'b.wig'), 'a') as f:
+                f.write('variableStep chrom=Z\n1 5\n')
+            expected = distance(*tracks(['c.wig', 'b.wig', 'a.wig']))
+            result = distance(*tracks(['c.wig', 'b.wig', 'a.wig']),
+                              state=state)
+            for comparison in expected:
+                assert_almost_equal(result[comparison],
+                                    expected[comparison])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_distance_state_names(self):
+        """
+        Use a distance state file with separators in the track names.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filenames = 'a,size=1.wig', 'b=c,d.wig'
+            for source, filename in zip(('a.wig', 'b.wig'), filenames):
+                shutil.copy(os.path.join(DATA_DIR, source),
+                            os.path.join(temp_dir, filename))
+            tracks = lambda: [open(os.path.join(temp_dir, f))
+                              for f in filenames]
+            state = os.path.join(temp_dir, 'distances')
+            expected = distance(*tracks(), state=state)
+
+            with open(state) as f:
+                lines = f.readlines()
+            with open(state, 'w') as f:
+                f.writelines(line.replace('total=', 'total=1')
+                             for line in lines)
+            assert distance(*tracks(), state=state) != expected
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_distance_state_invalid(self):
+        """
+        Do not discard a distance state file that cannot be used.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tracks = lambda: [open_('a.wig'), open_('b.wig')]
+            state = os.path.join(temp_dir, 'distances')
+            with open(state, 'w') as f:
+                f.write('metric=a,threshold\n')
+            assert_raises(ReadError, distance, *tracks(), state=state)
+            with open(state) as f:
+                assert_equal(f.read(), 'metric=a,threshold\n')
+
+            os.remove(state)
+            distance(*tracks(), state=state)
+            with open(state) as f:
+                lines = f.readlines()
+            assert_raises(ReadError, distance, *tracks(), state=state,
+                          metric=metrics['b'])
+            assert_raises(ReadError, distance, *tracks(), state=state,
+                          threshold=0.5)
+            with open(state) as f:
+                assert_equal(f.readlines(), lines)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_distance_sample(self):
+        """
+        Approximate distance in a sample of windows.
+        """
+        filenames = ['a.wig', 'b.wig', 'c.wig', 'complex.wig']
+        for vectorized in True, False:
+            expected = distance(*[open_(f) for f in filenames],
+                                vectorized=vectorized)
+
+            # Sampling all windows is exact.
+            result, errors = distance(*[open_(f) for f in filenames],
+                                      vectorized=vectorized, sample=1,
+                                      sample_window=10)
+            assert_equal(sorted(result), sorted(expected))
+            for comparison in expected:
+                assert_almost_equal(result[comparison], expected[comparison])
+                assert_equal(errors[comparison], 0)
+
+            result, errors = distance(*[open_(f) for f in filenames],
+                                      vectorized=vectorized, sample=2,
+                                      sample_window=10)
+            assert_equal(sorted(errors), sorted(result))
+            assert_equal(distance(*[open_(f) for f in filenames],
+                                  vectorized=vectorized, sample=2,
+                                  sample_window=10, jobs=2),
+                         (result, errors))
+
+    def test_distance_sample_per_region(self):
+        """
+        Approximate distance per region in a sample of windows.
+        """
+        filenames = ['a.wig', 'b.wig', 'c.wig']
+        expected = distance(*[open_(f) for f in filenames], per_region=True)
+        result, errors = distance(*[open_(f) for f in filenames],
+                                  per_region=True, sample=1, sample_window=10)
+        assert_equal(sorted(result), sorted(expected))
+        for region in expected:
+            assert_equal(sorted(result[region]), sorted(expected[region]))
+            for comparison in expected[region]:
+                assert_almost_equal(result[region][comparison],
+                                    expected[region][comparison])
+
+    def test_distance_sample_state(self):
+        """
+        A distance state file cannot be used with sampling.
+        """
+        assert_raises(ValueError, distance, open_('a.wig'), open_('b.wig'),
+                      sample=2, state='distances')
@@ -0,0 +1,190 @@
+"""
+Tests for the fields module.
+"""
+
+
+from __future__ import division
+
+import os
+import random
+import shutil
+import tempfile
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import fields
+from wiggelen.index import clear_cache, index, read_index
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def exact_quantile(values, q):
+    """
+    Quantile of a list of values, interpolated between the closest ranks.
+    """
+    values = sorted(values)
+    rank = q * (len(values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class TestFields(object):
+    """
+    Tests for the fields module.
+    """
+    @classmethod
+    def setup_class(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        clear_cache()
+        shutil.rmtree(cls.temp_dir)
+
+    def teardown(self):
+        clear_cache()
+
+    def _copy(self, filename):
+        path = os.path.join(self.temp_dir, filename)
+        shutil.copy(os.path.join(DATA_DIR, filename), path)
+        clear_cache()
+        return path
+
+    def test_moments(self):
+        """
+        Mean and variance of values with spans.
+        """
+        moments = fields.Moments()
+        moments.add(2, 3)
+        moments.add(4)
+        moments.add(8, 2)
+        values = [2, 2, 2, 4, 8, 8]
+        mean = sum(values) / len(values)
+        assert_equal(moments.count, 6)
+        assert_almost_equal(moments.mean, mean)
+        assert_almost_equal(moments.variance,
+                            sum((v - mean) ** 2 for v in values) / 6)
+
+    def test_moments_merge(self):
+        """
+        Merge mean and variance of two sets of values.
+        """
+        values = [random.uniform(0, 100) for _ in range(1000)]
+        left, right, expected = (fields.Moments(), fields.Moments(),
+                                 fields.Moments())
+        for value in values[:300]:
+            left.add(value)
+        for value in values[300:]:
+            right.add(value)
+        for value in values:
+            expected.add(value)
+        left.merge(right)
+        assert_equal(left.count, expected.count)
+        assert_almost_equal(left.mean, expected.mean)
+        assert_almost_equal(left.variance, expected.variance)
+        left.merge(fields.Moments())
+        assert_almost_equal(left.mean, expected.mean)
+
+    def test_quantiles(self):
+        """
+        Approximate quantiles of many values, in two merged sketches.
+        """
+        random.seed(1)
+        values = [random.gauss(50, 10) for _ in range(20000)]
+        left, right = fields.QuantileSketch(), fields.QuantileSketch()
+        for value in values[:5000]:
+            left.add(value)
+        for value in values[5000:]:
+            right.add(value)
+        left.merge(right)
+        assert_equal(left.count, 20000)
+        assert len(left.centroids) <= 2 * fields.COMPRESSION
+        for q in 0.01, 0.1, 0.5, 0.9, 0.99:
+            assert_almost_equal(left.quantile(q), exact_quantile(values, q),
+                                delta=0.5)
+
+    def test_quantiles_exact(self):
+        """
+        Quantiles of values with few distinct values are exact.
+        """
+        sketch = fields.QuantileSketch()
+        for value in range(1000):
+            sketch.add(value % 5, 10)
+        assert_equal(len(sketch.centroids), 5)
+        assert_equal(sketch.quantile(0.5), 2)
+        assert_equal(fields.QuantileSketch().quantile(0.5), None)
+
+    def test_histogram(self):
+        """
+        Histogram with values outside the bins.
+        """
+        histogram = fields.Histogram(0, 10, 5)
+        for value in -1, 0, 1.9, 2, 9.99, 10, 12:
+            histogram.add(value)
+        histogram.add(5, 3)
+        assert_equal(histogram.counts, [1, 2, 1, 3, 0, 1, 2])
+        assert_equal(histogram.edges, [0, 2, 4, 6, 8, 10])
+        histogram.merge(histogram)
+        assert_equal(histogram.counts, [2, 4, 2, 6, 0, 2, 4])
+        assert_raises(ValueError, histogram.merge, fields.Histogram(0, 10, 4))
+
+    def test_serialize(self):
+        """
+        Serialize statistics without commas and equal signs.
+        """
+        statistics = [fields.Moments(), fields.QuantileSketch(),
+                      fields.Histogram(-1, 1, 4)]
+        for value in -0.5, 0.25, 0.25, 3:
+            for s in statistics:
+                s.add(value, 2)
+        for s in statistics:
+            text = str(s)
+            assert ',' not in text and '=' not in text
+            assert_equal(str(type(s).parse(text)), text)
+
+    def test_index(self):
+        """
+        Statistics in the index of a track.
+        """
+        path = self._copy('a.wig')
+        custom = [fields.moments(), fields.quantiles(),
+                  fields.histogram(0, 1000, 10)]
+        idx, _ = index(open(path), force=True, fields=custom)
+        values = [v for r, _, v in wiggelen.walk(open(path)) if r == 'MT']
+        mean = sum(values) / len(values)
+        assert_almost_equal(idx['MT']['moments'].mean, mean)
+        assert_almost_equal(idx['MT']['moments'].variance,
+                            sum((v - mean) ** 2 for v in values) /
+                            len(values))
+        assert_equal(idx['MT']['quantiles'].quantile(0.5),
+                     exact_quantile(values, 0.5))
+        assert_equal(idx['MT']['histogram'].counts,
+                     [0, 0, 0, 0, 0, 0, 5, 5, 0, 0, 0, 0])
+        assert_equal(idx['_all']['moments'].count, idx['_all']['count'])
+        clear_cache()
+        stored = read_index(open(path), fields=custom)
+        for region in idx:
+            for field in custom:
+                assert_equal(str(stored[region][field.name]),
+                             str(idx[region][field.name]))
+
+    def test_index_parallel(self):
+        """
+        Statistics in the index of a track, built in parallel processes.
+        """
+        custom = [fields.moments(), fields.quantiles(),
+                  fields.histogram(0, 1000, 10)]
+        expected, _ = index(open(self._copy('a.wig')), force=True,
+                            fields=custom)
+        idx, _ = index(open(self._copy('a.wig')), force=True, fields=custom,
+                       jobs=2)
+        for field in custom[1:]:
+            assert_equal(str(idx['_all'][field.name]),
+                         str(expected['_all'][field.name]))
+        assert_almost_equal(idx['_all']['moments'].mean,
+                            expected['_all']['moments'].mean)
+        assert_almost_equal(idx['_all']['moments'].variance,
+                            expected['_all']['moments'].variance)
@@ -0,0 +1,238 @@
+"""
+Tests for the index module.
+"""
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from wiggelen import index as indexing
+from wiggelen.index import (INDEX_SUFFIX, Field, clear_cache, index,
+                            read_index)
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def values(idx, names):
+    """
+    Values of some fields for all regions in the index.
+    """
+    return dict((region, [summary.get(name) for name in names])
+                for region, summary in idx.items())
+
+
+def fields():
+    """
+    Custom index fields with merge functions.
+    """
+    return [Field('runs', int, 0, lambda acc, value, span: acc + 1,
+                  lambda acc, other: acc + other),
+            Field('top', float, 0, lambda acc, value, span: max(acc, value),
+                  max)]
+
+
+def failing(name):
+    """
+    Custom index field that fails if it is computed.
+    """
+    def func(acc, value, span):
+        raise AssertionError('Field %s is computed' % name)
+    return Field(name, int, 0, func)
+
+
+class TestIndex(object):
+    """
+    Tests for the index module.
+    """
+    @classmethod
+    def setup_class(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        clear_cache()
+        shutil.rmtree(cls.temp_dir)
+
+    def teardown(self):
+        clear_cache()
+
+    def _copy(self, filename):
+        path = os.path.join(self.temp_dir, filename)
+        shutil.copy(os.path.join(DATA_DIR, filename), path)
+        if os.path.exists(path + INDEX_SUFFIX):
+            os.unlink(path + INDEX_SUFFIX)
+        clear_cache()
+        return path
+
+    def test_signature(self):
+        """
+        Store the signature of the track in the index.
+        """
+        path = self._copy('b.wig')
+        index(open(path), force=True)
+        signature = dict(d.split('=') for d in
+                         open(path + INDEX_SUFFIX).readline().split(','))
+        assert_equal(sorted(signature), ['checksum', 'mtime', 'size'])
+        assert_equal(int(signature['size']), os.path.getsize(path))
+
+    def test_stale(self):
+        """
+        Do not use an index after the track has changed.
+        """
+        path = self._copy('b.wig')
+        idx, _ = index(open(path), force=True)
+        with open(path, 'a') as track:
+            track.write('variableStep chrom=X\n1 7\n')
+        assert_equal(read_index(open(path)), None)
+        clear_cache()
+        assert_equal(read_index(open(path)), None)
+        idx, _ = index(open(path), force=True)
+        assert_equal(idx['X']['sum'], 7)
+
+    def test_stale_same_size(self):
+        """
+        Do not use an index after the track has changed, even if its size is
+        the same.
+        """
+        path = self._copy('b.wig')
+        index(open(path), force=True)
+        data = open(path).read()
+        with open(path, 'w') as track:
+            track.write(data.replace('392', '393'))
+        os.utime(path, (1, 1))
+        assert_equal(read_index(open(path)), None)
+
+    def test_stale_same_size_past_head(self):
+        """
+        Do not use an index after the track has changed beyond its first
+        block, even if its size is the same.
+        """
+        path = os.path.join(self.temp_dir, 'long.wig')
+        with open(path, 'w') as track:
+            track.write('variableStep chrom=1\n')
+            track.writelines('%d 5\n' % p for p in range(1, 20001))
+        chunk_size = indexing.CHECKSUM_CHUNK_SIZE
+        indexing.CHECKSUM_CHUNK_SIZE = 1000
+        try:
+            idx, _ = index(open(path), force=True)
+            os.utime(path, (1, 1))
+            clear_cache()
+            assert_equal(values(read_index(open(path)), ['sum']),
+                         values(idx, ['sum']))
+            data = open(path).read()
+            with open(path, 'w') as track:
+                track.write(data[:-2] + '6\n')
+            os.utime(path, (2, 2))
+            assert_equal(read_index(open(path)), None)
+            clear_cache()
+            assert_equal(read_index(open(path)), None)
+        finally:
+            indexing.CHECKSUM_CHUNK_SIZE = chunk_size
+
+    def test_touched(self):
+        """
+        Use an index after only the modification time of the track has
+        changed.
+        """
+        path = self._copy('b.wig')
+        idx, _ = index(open(path), force=True)
+        os.utime(path, (1, 1))
+        assert_equal(read_index(open(path)), idx)
+        clear_cache()
+        assert_equal(values(read_index(open(path)), ['start', 'count']),
+                     values(idx, ['start', 'count']))
+
+    def test_without_signature(self):
+        """
+        Do not use an index without signature.
+        """
+        path = self._copy('b.wig')
+        index(open(path), force=True)
+        lines = open(path + INDEX_SUFFIX).readlines()
+        with open(path + INDEX_SUFFIX, 'w') as f:
+            f.writelines(lines[1:])
+        clear_cache()
+        assert_equal(read_index(open(path)), None)
+
+    def test_add_fields(self):
+        """
+        Add only the missing custom fields to an index.
+        """
+        path = self._copy('b.wig')
+        expected, _ = index(open(path), force=True,
+                            fields=fields() + [Field('zero', int, 0,
+                                                     lambda acc, v, s: 0)])
+        os.unlink(path + INDEX_SUFFIX)
+        clear_cache()
+        index(open(path), force=True,
+              fields=[Field('zero', int, 0, lambda acc, v, s: 0)])
+        clear_cache()
+        idx, _ = index(open(path), force=True,
+                       fields=fields() + [failing('zero')])
+        assert_equal(values(idx, ['runs', 'top', 'zero', 'count']),
+                     values(expected, ['runs', 'top', 'zero', 'count']))
+        assert_equal(idx['_all']['runs'], 21)
+        assert_equal(idx['MT']['top'], 479)
+
+    def test_add_fields_parallel(self):
+        """
+        Add missing custom fields to an index in parallel processes.
+        """
+        path = self._copy('b.wig')
+        expected, _ = index(open(path), force=True, fields=fields())
+        os.unlink(path + INDEX_SUFFIX)
+        clear_cache()
+        index(open(path), force=True)
+        idx, _ = index(open(path), force=True, fields=fields(), jobs=2)
+        assert_equal(values(idx, ['runs', 'top']),
+                     values(expected, ['runs', 'top']))
+
+    def test_add_zoom_levels(self):
+        """
+        Add only the missing zoom levels to an index.
+        """
+        path = self._copy('query.wig')
+        expected, _ = index(open(path), force=True, zoom_levels=[10, 50])
+        os.unlink(path + INDEX_SUFFIX)
+        clear_cache()
+        index(open(path), force=True, zoom_levels=[10])
+        idx, _ = index(open(path), force=True, zoom_levels=[10, 50])
+        assert_equal(idx, expected)
+        clear_cache()
+        idx = read_index(open(path), zoom_levels=[10, 50])
+        assert_equal(values(idx, ['zoom']), values(expected, ['zoom']))
+
+    def test_index_parallel(self):
+        """
+        Build an index in parallel processes.
+        """
+        for filename in 'b.wig', 'fixedstep.wig', 'complex.wig':
+            path = self._copy(filename)
+            expected, _ = index(open(path), force=True, fields=fields(),
+                                zoom_levels=[10])
+            path = self._copy(filename)
+            idx, _ = index(open(path), force=True, fields=fields(),
+                           zoom_levels=[10], jobs=2)
+            assert_equal(sorted(idx), sorted(expected))
+            for region in idx:
+                assert_almost_equal(idx[region].pop('sum'),
+                                    expected[region].pop('sum'))
+            assert_equal(idx, expected)
+
+    def test_index_parallel_one_process(self):
+        """
+        Build an index in one process if it cannot be done in parallel.
+        """
+        path = self._copy('query.bedgraph')
+        expected, _ = index(open(path), force=True)
+        path = self._copy('query.bedgraph')
+        assert_equal(index(open(path), force=True, jobs=2)[0], expected)
+        # Custom field without merge function.
+        path = self._copy('b.wig')
+        field = Field('runs', int, 0, lambda acc, value, span: acc + 1)
+        idx, _ = index(open(path), force=True, fields=[field], jobs=2)
+        assert_equal(idx['_all']['runs'], 21)
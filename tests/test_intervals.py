@@ -3,15 +3,52 @@ Tests for the intervals module.
 """
 
 
+import os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from nose.tools import *
 
-from wiggelen.intervals import coverage
+import wiggelen
+from wiggelen.index import Field
+from wiggelen.intervals import coverage, extract, read, summarize
+from wiggelen.index import INDEX_SUFFIX, clear_cache
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if file.endswith(INDEX_SUFFIX):
+            os.unlink(os.path.join(DATA_DIR, file))
 
 
 class TestIntervals(object):
     """
     Tests for the intervals module.
     """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
     def test_coverage(self):
         """
         Simple interval coverage on one region.
@@ -30,6 +67,15 @@ class TestIntervals(object):
         expected = [('a', 1, 2), ('a', 4, 5), ('b', 6, 8), ('b', 12, 12)]
         assert_equal(list(coverage(orig)), expected)
 
+    def test_coverage_runs(self):
+        """
+        Interval coverage on runs.
+        """
+        orig = [('a', 1, 3, 5), ('a', 4, 4, 4), ('a', 6, 9, 5),
+                ('b', 10, 12, 4)]
+        expected = [('a', 1, 4), ('a', 6, 9), ('b', 10, 12)]
+        assert_equal(list(coverage(orig, runs=True)), expected)
+
     def test_coverage_empty(self):
         """
         Interval coverage on empty walker.
@@ -37,3 +83,111 @@ class TestIntervals(object):
         orig = []
         expected = []
         assert_equal(list(coverage(orig)), expected)
+
+    def test_read(self):
+        """
+        Read intervals from a BED track.
+        """
+        bed = ['track name=targets\n', 'MT\t0\t3\n', '1\t9\t12\tx\n']
+        assert_equal(read(bed), [('MT', 1, 3), ('1', 10, 12)])
+
+    def _extract(self, filename, intervals, **kwargs):
+        walker = list(wiggelen.walk(open_(filename)))
+        expected = [((region, begin, end),
+                     [(r, p, v) for r, p, v in walker
+                      if r == region and begin <= p <= end])
+                    for region, begin, end in intervals]
+        result = list(extract(open_(filename), intervals, **kwargs))
+        assert_equal(sorted(result), sorted(expected))
+        return result
+
+    def test_extract(self):
+        """
+        Extract values in intervals.
+        """
+        intervals = [('MT', 2, 3), ('1', 9, 12), ('X', 1, 10), ('1', 1, 3),
+                     ('13', 4, 8), ('1', 2, 2), ('13', 1, 1)]
+        result = self._extract('b.wig', intervals)
+        assert_equal([interval for interval, _ in result],
+                     [('MT', 2, 3), ('1', 1, 3), ('1', 2, 2), ('1', 9, 12),
+                      ('13', 1, 1), ('13', 4, 8), ('X', 1, 10)])
+
+    def test_extract_index(self):
+        """
+        Extract values in intervals using an index.
+        """
+        intervals = [('MT', 2, 3), ('1', 9, 12), ('X', 1, 10), ('1', 1, 3),
+                     ('13', 4, 8), ('1', 2, 2), ('13', 1, 1)]
+        result = self._extract('b.wig', intervals, force_index=True)
+        assert_equal([interval for interval, _ in result],
+                     [('1', 1, 3), ('1', 2, 2), ('1', 9, 12), ('13', 1, 1),
+                      ('13', 4, 8), ('MT', 2, 3), ('X', 1, 10)])
+
+    def test_extract_overlapping(self):
+        """
+        Extract values in overlapping intervals.
+        """
+        intervals = [('1', 1, 100), ('1', 5, 20), ('1', 6, 7), ('1', 30, 70),
+                     ('1', 58, 66), ('1', 64, 64), ('2', 10, 30),
+                     ('2', 25, 300), ('2', 220, 222)]
+        self._extract('query.wig', intervals)
+        self._extract('query.wig', intervals, force_index=True)
+
+    def test_extract_runs(self):
+        """
+        Extract runs in intervals.
+        """
+        result = list(extract(open_('query.wig'), [('1', 58, 62)],
+                              runs=True))
+        assert_equal(result, [(('1', 58, 62), [('1', 59, 59, 7),
+                                               ('1', 61, 62, 8.7)])])
+
+    def test_extract_empty(self):
+        """
+        Write the values extracted from intervals without data.
+        """
+        for force_index in False, True:
+            result = extract(open_('query.wig'),
+                             [('1', 500, 600), ('Z', 1, 10)],
+                             force_index=force_index, runs=True)
+            track = StringIO()
+            wiggelen.write((item for _, items in result for item in items),
+                           track=track, runs=True)
+            assert_equal(track.getvalue(), 'track type=wiggle_0\n')
+
+    def test_summarize(self):
+        """
+        Summarize values in intervals.
+        """
+        intervals = [('1', 1, 100), ('1', 5, 20), ('1', 58, 62),
+                     ('1', 500, 600), ('2', 10, 30), ('Z', 1, 10)]
+        walker = wiggelen.walk(open_('query.wig'))
+        result = list(summarize(walker, intervals))
+        extracted = dict(extract(open_('query.wig'), intervals))
+        assert_equal([interval for interval, _ in result], intervals)
+        for interval, summary in result:
+            values = [v for _, _, v in extracted[interval]]
+            assert_equal(summary['count'], len(values))
+            assert_equal(summary['covered'], len([v for v in values if v]))
+            assert_almost_equal(summary['sum'], sum(values))
+            if values:
+                assert_equal(summary['min'], min(values))
+                assert_equal(summary['max'], max(values))
+                assert_almost_equal(summary['mean'],
+                                    sum(values) / float(len(values)))
+            else:
+                assert_equal(summary['min'], None)
+                assert_equal(summary['max'], None)
+                assert_equal(summary['mean'], None)
+
+    def test_summarize_runs(self):
+        """
+        Summarize runs in intervals, with a custom field.
+        """
+        walker = [('1', 1, 4, 2), ('1', 6, 10, 0), ('1', 11, 11, 5)]
+        fields = [Field('runs', int, 0, lambda acc, value, span: acc + 1)]
+        result = list(summarize(walker, [('1', 3, 11)], runs=True,
+                                fields=fields))
+        assert_equal(result, [(('1', 3, 11),
+                               {'sum': 9, 'min': 0, 'max': 5, 'count': 8,
+                                'covered': 3, 'mean': 9 / 8.0, 'runs': 3})])
@@ -0,0 +1,138 @@
+"""
+Tests for the merge module.
+"""
+
+
+import os
+import random
+import shutil
+import tempfile
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen.merge import merge, mergers, write_merge
+from wiggelen import wiggle
+from wiggelen.index import INDEX_SUFFIX, clear_cache
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if file.endswith(INDEX_SUFFIX):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+class TestMerge(object):
+    """
+    Tests for the merge module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
+    def test_merge(self):
+        """
+        Merge two tracks.
+        """
+        walkers = [wiggelen.walk(open_(track), force_index=True)
+                   for track in ('b.wig', 'c.wig')]
+        merged = [(r, p, v) for r, p, v in merge(*walkers) if r == 'MT']
+        assert_equal(merged, [('MT', 1, 364.0),
+                              ('MT', 2, 392.0),
+                              ('MT', 3, 408.0),
+                              ('MT', 4, 420.0),
+                              ('MT', 5, 452.0),
+                              ('MT', 6, 435.0),
+                              ('MT', 7, 466.0),
+                              ('MT', 8, 474.0),
+                              ('MT', 9, 479.0),
+                              ('MT', 10, 485.0)])
+
+    def _write_merge(self, filenames, open_=open_, **options):
+        walkers = [wiggelen.walk(open_(track), force_index=True, runs=True)
+                   for track in filenames]
+        expected = StringIO()
+        wiggelen.write(merge(*walkers, runs=True, **options), track=expected,
+                       runs=True)
+
+        track = StringIO()
+        write_merge([open_(filename) for filename in filenames], track=track,
+                    **options)
+        assert_equal(track.getvalue(), expected.getvalue())
+
+    def test_write_merge(self):
+        """
+        Merge tracks region by region.
+        """
+        self._write_merge(['a.wig', 'b.wig', 'c.wig'])
+        self._write_merge(['a.wig', 'fixedstep.wig'],
+                          merger=mergers['count'])
+
+    def test_write_merge_parallel(self):
+        """
+        Merge tracks region by region in parallel.
+        """
+        self._write_merge(['a.wig', 'b.wig', 'c.wig'], jobs=2)
+        self._write_merge(['complex.wig', 'b.wig'], merger=mergers['max'],
+                          jobs=3)
+
+    def test_write_merge_bedgraph(self):
+        """
+        Merge tracks region by region in the bedGraph format.
+        """
+        expected = StringIO()
+        wiggelen.write_bedgraph(merge(*[wiggelen.walk(open_(filename),
+                                                      force_index=True)
+                                        for filename in ('a.wig', 'b.wig')]),
+                                track=expected)
+        track = StringIO()
+        write_merge([open_('a.wig'), open_('b.wig')], track=track, jobs=2,
+                    bedgraph=True)
+        assert_equal(track.getvalue(), expected.getvalue())
+
+    def test_write_merge_large(self):
+        """
+        Merge tracks region by region with more runs per region than are
+        encoded at once.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filenames = []
+            for i in range(3):
+                filename = os.path.join(temp_dir, 'track%d.wig' % i)
+                generator = random.Random(i)
+                with open(filename, 'w') as track:
+                    for region in 'A', 'B', 'C':
+                        track.write('variableStep chrom=%s\n' % region)
+                        position = 0
+                        for _ in range(int(wiggle._COMPACT_CHUNK * 1.7)):
+                            position += generator.choice([1, 1, 1, 2, 5])
+                            track.write('%d %d\n' % (
+                                position, generator.choice([3, 3, 7, 9])))
+                filenames.append(filename)
+            self._write_merge(filenames, open_=open)
+            self._write_merge(filenames, open_=open, jobs=2)
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,38 @@
+"""
+Tests for the order module.
+"""
+
+
+from nose.tools import *
+
+from wiggelen.order import natural_key, order_key, read_order
+
+
+class TestOrder(object):
+    """
+    Tests for the order module.
+    """
+    def test_natural_key(self):
+        """
+        Natural order of regions.
+        """
+        regions = ['chr10', 'chr2', 'chrX', 'chr1', 'chr1_random', 'MT', '3']
+        assert_equal(sorted(regions, key=natural_key),
+                     ['3', 'MT', 'chr1', 'chr1_random', 'chr2', 'chr10',
+                      'chrX'])
+
+    def test_order_key(self):
+        """
+        Order of regions as listed.
+        """
+        regions = ['chr10', 'chr2', 'chrX', 'chr1']
+        assert_equal(sorted(regions, key=order_key(['chrX', 'chr1'])),
+                     ['chrX', 'chr1', 'chr10', 'chr2'])
+
+    def test_read_order(self):
+        """
+        Read order of regions from chromosome sizes.
+        """
+        sizes = ['chr1\t249250621\n', 'chr2\t243199373\n', '\n',
+                 'chrM\t16571\n']
+        assert_equal(read_order(sizes), ['chr1', 'chr2', 'chrM'])
@@ -0,0 +1,155 @@
+"""
+Tests for the query module.
+"""
+
+
+import os
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import query
+from wiggelen.index import INDEX_SUFFIX, clear_cache
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index and checkpoint files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+        query.clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if (file.endswith(INDEX_SUFFIX) or
+            file.endswith(query.CHECKPOINT_SUFFIX)):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+class TestQuery(object):
+    """
+    Tests for the query module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
+    def _compare(self, filename, region, start, end):
+        expected = [(r, p, v) for r, p, v in wiggelen.walk(open_(filename))
+                    if r == region and start <= p <= end]
+        result = list(query.query(open_(filename), region, start, end,
+                                  force_index=True))
+        assert_equal(result, expected)
+
+    def test_query(self):
+        """
+        Query a range in a region.
+        """
+        self._compare('b.wig', '13', 3, 7)
+        self._compare('b.wig', 'MT', 1, 100)
+        self._compare('b.wig', 'X', 1, 100)
+        self._compare('b.wig', '1', 6, 6)
+
+    def test_query_checkpoints(self):
+        """
+        Query ranges using many checkpoints.
+        """
+        query.checkpoints(open_('query.wig'), force=True, interval=32)
+        for region, start, end in [('1', 1, 200), ('1', 10, 20),
+                                   ('1', 58, 66), ('1', 100, 101),
+                                   ('2', 1, 20), ('2', 50, 91),
+                                   ('2', 90, 210), ('2', 225, 400)]:
+            self._compare('query.wig', region, start, end)
+
+    def test_query_stale_checkpoints(self):
+        """
+        Do not use checkpoints after the track has changed.
+        """
+        path = os.path.join(DATA_DIR, 'stale.wig')
+        with open(path, 'w') as track:
+            track.write(open_('query.wig').read())
+        query.checkpoints(open(path), force=True, interval=32)
+        assert query.read_checkpoints(open(path)) is not None
+        with open(path, 'w') as track:
+            track.write('variableStep chrom=1\n1 2\n')
+        os.utime(path, (1, 1))
+        assert_equal(query.read_checkpoints(open(path)), None)
+        query.clear_cache()
+        assert_equal(query.read_checkpoints(open(path)), None)
+        assert_equal(list(query.query(open(path), '1', 1, 10,
+                                      force_index=True)), [('1', 1, 2)])
+        os.unlink(path)
+
+    def test_query_runs(self):
+        """
+        Query a range of runs.
+        """
+        query.checkpoints(open_('query.wig'), force=True, interval=32)
+        result = list(query.query(open_('query.wig'), '2', 12, 20,
+                                  force_index=True, runs=True))
+        assert_equal(result, [('2', 13, 14, 1),
+                              ('2', 16, 17, 4),
+                              ('2', 19, 20, 9)])
+
+    def test_query_bedgraph(self):
+        """
+        Query ranges in a track in the bedGraph format.
+        """
+        query.checkpoints(open_('query.bedgraph'), force=True, interval=32)
+        for region, start, end in [('1', 1, 200), ('1', 10, 20),
+                                   ('1', 58, 66), ('2', 50, 91),
+                                   ('2', 225, 400)]:
+            self._compare('query.bedgraph', region, start, end)
+        result = list(query.query(open_('query.bedgraph'), '2', 12, 20,
+                                  runs=True))
+        assert_equal(result, [('2', 13, 14, 1),
+                              ('2', 16, 17, 4),
+                              ('2', 19, 20, 9)])
+
+    def test_query_empty(self):
+        """
+        Query a range without data and an unknown region, and write the
+        results.
+        """
+        for region, start, end in ('13', 1000, 2000), ('Z', 1, 10):
+            track = StringIO()
+            wiggelen.write(query.query(open_('b.wig'), region, start, end,
+                                       force_index=True, runs=True),
+                           track=track, runs=True)
+            assert_equal(track.getvalue(), 'track type=wiggle_0\n')
+
+    def test_regions(self):
+        """
+        List the regions in a track.
+        """
+        with open_('b.wig') as track:
+            expected = sorted(set(line.split('chrom=')[1].split()[0]
+                                  for line in track if 'chrom=' in line))
+        assert_equal(query.regions(open_('b.wig'), force_index=True),
+                     expected)
+        assert_equal(query.regions(open_('sections.bw')),
+                     ['chr1', 'chr2', 'chrM'])
+
+    def test_query_without_index(self):
+        """
+        Query a track without index.
+        """
+        assert_raises(wiggelen.ReadError, list,
+                      query.query(open_('b.wig'), '1', 1, 10))
@@ -3,13 +3,20 @@ Tests for the wiggle module.
 """
 
 
+import io
 import os
 from itertools import chain
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from nose.tools import *
 
 import wiggelen
-from wiggelen.index import INDEX_SUFFIX, clear_cache
+from wiggelen import index as indexing, wiggle
+from wiggelen.index import INDEX_SUFFIX, clear_cache, index
+from wiggelen.order import natural_key, order_key
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -124,6 +131,16 @@ class TestWiggle(object):
             assert_equal(expected, item)
         assert_raises(StopIteration, next, walker)
 
+    def test_walk_runs(self):
+        """
+        Walk over runs in a fixed step wiggle track.
+        """
+        c = [('chr8', 1, 2, 11),
+             ('chr8', 6, 7, 33),
+             ('chr8', 11, 12, 44)]
+        walker = wiggelen.walk(open_('fixedstep.wig'), runs=True)
+        assert_equal(list(walker), c)
+
     def test_walk_single_region(self):
         """
         Walk over a track with a single region.
@@ -170,6 +187,40 @@ class TestWiggle(object):
             assert_equal(expected, item)
         assert_raises(StopIteration, next, walker)
 
+    def test_sort_order(self):
+        """
+        Walk over a track with multiple regions and index in a given order.
+        """
+        values = [(2, 392.0),
+                  (3, 408.0),
+                  (4, 420.0),
+                  (5, 452.0),
+                  (7, 466.0),
+                  (8, 474.0),
+                  (9, 479.0)]
+        b = [(r, p, v) for r in ('MT', '13', '1') for (p, v) in values]
+        walker = wiggelen.walk(open_('b.wig'), force_index=True,
+                               order=order_key(['MT', '13']))
+        for expected, item in zip(b, walker):
+            assert_equal(expected, item)
+        assert_raises(StopIteration, next, walker)
+
+    def test_walk_regions(self):
+        """
+        Walk over some regions in a track.
+        """
+        values = [(2, 392.0),
+                  (3, 408.0),
+                  (4, 420.0),
+                  (5, 452.0),
+                  (7, 466.0),
+                  (8, 474.0),
+                  (9, 479.0)]
+        b = [(r, p, v) for r in ('13', 'MT') for (p, v) in values]
+        walker = wiggelen.walk(open_('b.wig'), force_index=True,
+                               regions=['13', 'X', 'MT'])
+        assert_equal(list(walker), b)
+
     def test_store_index(self):
         """
         Walk over a track after the index has been made.
@@ -219,6 +270,88 @@ class TestWiggle(object):
             assert_equal(expected, item)
         assert_raises(StopIteration, next, walker)
 
+    def test_sort_index_one_pass(self):
+        """
+        Walk over a track with multiple regions and index, building the index
+        during the walk without spooling regions.
+        """
+        spool = wiggle._Spool
+        wiggle._Spool = None
+        try:
+            walker = wiggelen.walk(open_('b.wig'), force_index=True)
+            assert_equal([item[0] for item in walker],
+                         ['1'] * 7 + ['13'] * 7 + ['MT'] * 7)
+        finally:
+            wiggle._Spool = spool
+        idx, _ = index(open_('b.wig'))
+        remove_indices()
+        expected, _ = index(open_('b.wig'), force=True)
+        assert_equal(idx, expected)
+
+    def test_sort_index_one_pass_spool(self):
+        """
+        Walk over a track that cannot be scanned for regions, spooling the
+        regions that are not yet due.
+        """
+        spool_chunk = wiggle._SPOOL_CHUNK
+        wiggle._SPOOL_CHUNK = 2
+        try:
+            walker = wiggelen.walk(StringIO(open_('b.wig').read()),
+                                   force_index=True)
+            assert_equal([item[0] for item in walker],
+                         ['1'] * 7 + ['13'] * 7 + ['MT'] * 7)
+        finally:
+            wiggle._SPOOL_CHUNK = spool_chunk
+
+    def test_walk_index_non_ascii(self):
+        """
+        Walk over a track with non-ASCII characters and write the index built
+        during the walk.
+        """
+        filename = os.path.join(DATA_DIR, 'non_ascii.wig')
+        with io.open(filename, 'w', encoding='utf-8') as track:
+            track.write(u'track type=wiggle_0 name="caf\xe9 \xe9\xe9\xe9"\n'
+                        u'variableStep chrom=2\n1 5\n'
+                        u'variableStep chrom=1\n3 4\n')
+        open_utf8 = lambda: io.open(filename, encoding='utf-8')
+        try:
+            for force_index in True, False:
+                indexing.INDEX_ON_WALK = not force_index
+                try:
+                    walker = wiggelen.walk(open_utf8(),
+                                           force_index=force_index)
+                    assert_equal(sorted(walker), [('1', 3, 4), ('2', 1, 5)])
+                finally:
+                    indexing.INDEX_ON_WALK = False
+                idx, _ = index(open_utf8())
+                remove_indices()
+                expected, _ = index(open_utf8(), force=True)
+                assert_equal(idx, expected)
+                assert_equal(list(wiggelen.walk(open_utf8(), regions=['2'])),
+                             [('2', 1, 5)])
+                remove_indices()
+        finally:
+            os.unlink(filename)
+
+    def test_walk_index_on_walk(self):
+        """
+        Walk over a track and write the index built during the walk.
+        """
+        walker = wiggelen.walk(open_('b.wig'))
+        assert_equal(list(walker), list(wiggelen.walk(open_('b.wig'))))
+        assert_equal(index(open_('b.wig'))[0], None)
+        indexing.INDEX_ON_WALK = True
+        try:
+            walker = wiggelen.walk(open_('b.wig'))
+            assert_equal([item[0] for item in walker],
+                         ['MT'] * 7 + ['1'] * 7 + ['13'] * 7)
+        finally:
+            indexing.INDEX_ON_WALK = False
+        idx, _ = index(open_('b.wig'))
+        remove_indices()
+        expected, _ = index(open_('b.wig'), force=True)
+        assert_equal(idx, expected)
+
     def test_walk_complex(self):
         """
         Walk over a complex track.
@@ -278,3 +411,258 @@ class TestWiggle(object):
                     ('a', 13, None),
                     ('a', 14, 14)]
         assert_equal(list(wiggelen.fill(walker, only_edges=True)), expected)
+
+    def test_zip(self):
+        """
+        Test zipping walkers.
+        """
+        a = sparse('a', [1, 3, 4])
+        b = sparse('a', [2, 3])
+        c = chain(sparse('a', [4]), sparse('b', [1]))
+        expected = [('a', 1, [1, None, None]),
+                    ('a', 2, [None, 2, None]),
+                    ('a', 3, [3, 3, None]),
+                    ('a', 4, [4, None, 4]),
+                    ('b', 1, [None, None, 1])]
+        assert_equal(list(wiggelen.zip_(a, b, c)), expected)
+
+    def test_zip_many(self):
+        """
+        Test zipping many walkers.
+        """
+        walkers = [sparse('a', range(i % 7, 100, i % 5 + 1))
+                   for i in range(50)]
+        zipped = list(wiggelen.zip_(*walkers))
+        assert_equal([p for _, p, _ in zipped], list(range(100)))
+        for _, position, values in zipped:
+            assert_equal(values, [position if position >= i % 7 and
+                                  (position - i % 7) % (i % 5 + 1) == 0
+                                  else None for i in range(50)])
+
+    def test_zip_incompatible(self):
+        """
+        Test zipping walkers with incompatible region orders.
+        """
+        a = chain(sparse('a', [1]), sparse('b', [1]))
+        b = chain(sparse('b', [2]), sparse('a', [2]))
+        assert_raises(Exception, list, wiggelen.zip_(a, b))
+
+    def test_zip_order(self):
+        """
+        Test zipping walkers with a region order.
+        """
+        a = chain(sparse('2', [1]), sparse('10', [1]))
+        b = chain(sparse('2', [2]), sparse('10', [2]))
+        expected = [('2', 1, [1, None]),
+                    ('2', 2, [None, 2]),
+                    ('10', 1, [1, None]),
+                    ('10', 2, [None, 2])]
+        assert_equal(list(wiggelen.zip_(a, b, order=natural_key)), expected)
+
+    def test_zip_order_incompatible(self):
+        """
+        Test zipping walkers with an incompatible region order.
+        """
+        a = chain(sparse('2', [1]), sparse('10', [1]))
+        b = chain(sparse('2', [2]), sparse('10', [2]))
+        assert_raises(wiggelen.OrderError, list, wiggelen.zip_(a, b))
+
+    def test_zip_runs(self):
+        """
+        Test zipping walkers over runs.
+        """
+        a = [('a', 1, 5, 1), ('a', 8, 8, 2), ('b', 1, 2, 3)]
+        b = [('a', 3, 9, 4), ('b', 2, 2, 5)]
+        expected = [('a', 1, 2, [1, None]),
+                    ('a', 3, 5, [1, 4]),
+                    ('a', 6, 7, [None, 4]),
+                    ('a', 8, 8, [2, 4]),
+                    ('a', 9, 9, [None, 4]),
+                    ('b', 1, 1, [3, None]),
+                    ('b', 2, 2, [3, 5])]
+        assert_equal(list(wiggelen.zip_(iter(a), iter(b), runs=True)),
+                     expected)
+
+    def test_zip_runs_positions(self):
+        """
+        Test zipping walkers over runs against zipping walkers over
+        positions.
+        """
+        a = [('a', 1, 5, 1), ('a', 8, 8, 2), ('b', 1, 2, 3)]
+        b = [('a', 3, 9, 4), ('b', 2, 2, 5)]
+        expand = lambda runs: ((r, p, v) for r, s, e, v in runs
+                               for p in range(s, e + 1))
+        expected = list(wiggelen.zip_(expand(a), expand(b)))
+        assert_equal(list(expand(wiggelen.zip_(iter(a), iter(b), runs=True))),
+                     expected)
+
+    def test_fill_runs(self):
+        """
+        Test filling undefined positions with runs.
+        """
+        walker = iter([('a', 3, 4, 1), ('a', 8, 8, 2), ('b', 5, 6, 3)])
+        expected = [('a', 1, 2, 0),
+                    ('a', 3, 4, 1),
+                    ('a', 5, 7, 0),
+                    ('a', 8, 8, 2),
+                    ('a', 9, 10, 0),
+                    ('b', 5, 6, 3)]
+        assert_equal(list(wiggelen.fill(walker, regions={'a': (1, 10)},
+                                        filler=0, runs=True)),
+                     expected)
+
+    def test_fill_runs_only_edges(self):
+        """
+        Test filling edges of undefined positions with runs.
+        """
+        walker = iter([('a', 3, 3, 3), ('a', 5, 6, 5), ('a', 14, 14, 14)])
+        expected = [('a', 3, 3, 3),
+                    ('a', 4, 4, None),
+                    ('a', 5, 6, 5),
+                    ('a', 7, 7, None),
+                    ('a', 13, 13, None),
+                    ('a', 14, 14, 14)]
+        assert_equal(list(wiggelen.fill(walker, only_edges=True, runs=True)),
+                     expected)
+
+    def test_write_runs(self):
+        """
+        Test writing runs and reading them back.
+        """
+        runs = [('a', 1, 1, 3), ('a', 2, 4, 5), ('a', 8, 10, 2),
+                ('b', 5, 5, 1)]
+        track = StringIO()
+        wiggelen.write(iter(runs), track=track, runs=True)
+        track.seek(0)
+        assert_equal(list(wiggelen.walk(track, runs=True)), runs)
+
+    def test_write_compact_roundtrip(self):
+        """
+        Test writing tracks compactly and reading them back.
+        """
+        for filename in 'a.wig', 'b.wig', 'c.wig', 'fixedstep.wig':
+            walker = list(wiggelen.walk(open_(filename)))
+            track = StringIO()
+            wiggelen.write(iter(walker), track=track)
+            track.seek(0)
+            assert_equal(list(wiggelen.walk(track)), walker)
+
+    def test_write_compact_fixed_step(self):
+        """
+        Test writing positions with a constant step using fixedStep.
+        """
+        walker = [('a', p, p * 3) for p in range(10, 500, 7)]
+        track = StringIO()
+        wiggelen.write(iter(walker), track=track)
+        lines = track.getvalue().splitlines()
+        assert_equal(lines[1], 'fixedStep chrom=a start=10 step=7')
+        assert_equal(lines[2:], [str(v) for _, _, v in walker])
+
+    def test_write_compact_span(self):
+        """
+        Test writing stretches of positions with the same value using span.
+        """
+        walker = [('a', p, 1 if p <= 600 else 2) for p in range(1, 1001)]
+        track = StringIO()
+        wiggelen.write(iter(walker), track=track)
+        assert_equal(track.getvalue().splitlines(),
+                     ['track type=wiggle_0',
+                      'variableStep chrom=a span=600', '1 1',
+                      'variableStep chrom=a span=400', '601 2'])
+        track.seek(0)
+        assert_equal(list(wiggelen.walk(track)), walker)
+
+    def test_write_compact_regions(self):
+        """
+        Test walking over some regions of a compactly written track, using its
+        index.
+        """
+        walker = list(wiggelen.walk(open_('b.wig')))
+        with open_('compact.wig', 'w') as track:
+            wiggelen.write(iter(walker), track=track)
+        clear_cache()
+        track = open_('compact.wig')
+        assert_equal(list(wiggelen.walk(track, regions=['MT', '13'])),
+                     [item for item in walker if item[0] == 'MT'] +
+                     [item for item in walker if item[0] == '13'])
+        track.close()
+        os.unlink(os.path.join(DATA_DIR, 'compact.wig'))
+
+    def test_write_not_compact(self):
+        """
+        Test writing every position as a variableStep line.
+        """
+        walker = [('a', p, 1) for p in range(1, 101)]
+        track = StringIO()
+        wiggelen.write(iter(walker), track=track, compact=False)
+        assert_equal(track.getvalue().splitlines(),
+                     ['track type=wiggle_0', 'variableStep chrom=a'] +
+                     ['%d 1' % p for p in range(1, 101)])
+
+    def test_write_empty(self):
+        """
+        Test writing an empty track and reading it back using its index.
+        """
+        with open_('written_empty.wig', 'w') as track:
+            wiggelen.write(iter([]), track=track)
+        clear_cache()
+        track = open_('written_empty.wig')
+        assert_equal(track.read(), 'track type=wiggle_0\n')
+        assert_equal(index(track)[0]['_all']['count'], 0)
+        assert_equal(list(wiggelen.walk(track, force_index=True)), [])
+        track.close()
+        os.unlink(os.path.join(DATA_DIR, 'written_empty.wig'))
+
+    def test_walk_bedgraph(self):
+        """
+        Test walking over a track in the bedGraph format.
+        """
+        track = StringIO('track type=bedGraph\n'
+                         'chr1\t0\t3\t1.5\n'
+                         'chr1\t5\t6\t2\n'
+                         '# A comment.\n'
+                         'chrX\t9\t10\t3\n')
+        assert_equal(list(wiggelen.walk(track, runs=True)),
+                     [('chr1', 1, 3, 1.5), ('chr1', 6, 6, 2),
+                      ('chrX', 10, 10, 3)])
+
+    def test_walk_bedgraph_detect(self):
+        """
+        Test walking over a track in the bedGraph format without track line
+        and with numeric regions.
+        """
+        assert_equal(list(wiggelen.walk(open_('query.bedgraph'))),
+                     list(wiggelen.walk(open_('query.wig'))))
+
+    def test_walk_bedgraph_regions(self):
+        """
+        Test walking over some regions of a track in the bedGraph format.
+        """
+        assert_equal(list(wiggelen.walk(open_('query.bedgraph'),
+                                        regions=['2', '1'],
+                                        force_index=True)),
+                     list(wiggelen.walk(open_('query.wig'), regions=['2', '1'],
+                                        force_index=True)))
+
+    def test_walk_bedgraph_parse_error(self):
+        """
+        Test walking over a malformed track in the bedGraph format.
+        """
+        track = StringIO('track type=bedGraph\nchr1\t5\t3\t1\n')
+        assert_raises(wiggelen.ParseError, list, wiggelen.walk(track))
+        track = StringIO('chr1\t0\t3\t1\nchr1\t3\t1\n')
+        assert_raises(wiggelen.ParseError, list, wiggelen.walk(track))
+
+    def test_write_bedgraph(self):
+        """
+        Test writing a track in the bedGraph format and reading it back.
+        """
+        walker = [('a', 1, 3), ('a', 2, 3), ('a', 3, 3), ('a', 8, 1.5),
+                  ('b', 5, 1)]
+        track = StringIO()
+        wiggelen.write_bedgraph(iter(walker), track=track, name='x')
+        assert_equal(track.getvalue().splitlines()[:4],
+                     ['track type=bedGraph name="x"',
+                      'a\t0\t3\t3', 'a\t7\t8\t1.5', 'b\t4\t5\t1'])
+        track.seek(0)
+        assert_equal(list(wiggelen.walk(track)), walker)
@@ -0,0 +1,136 @@
+"""
+Tests for the zoom module.
+"""
+
+
+import os
+
+from nose.tools import *
+
+import wiggelen
+from wiggelen import query, zoom
+from wiggelen.index import INDEX_SUFFIX, clear_cache, index, read_index
+from wiggelen.intervals import summarize
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def open_(filename, mode='r'):
+    """
+    Open a file from the test data.
+    """
+    return open(os.path.join(DATA_DIR, filename), mode)
+
+
+def remove_indices(keep_cache=False):
+    """
+    Cleanup any index and checkpoint files for the test data.
+    """
+    if not keep_cache:
+        clear_cache()
+        query.clear_cache()
+    for file in os.listdir(DATA_DIR):
+        if (file.endswith(INDEX_SUFFIX) or
+            file.endswith(query.CHECKPOINT_SUFFIX)):
+            os.unlink(os.path.join(DATA_DIR, file))
+
+
+class TestZoom(object):
+    """
+    Tests for the zoom module.
+    """
+    @classmethod
+    def setup_class(cls):
+        remove_indices()
+
+    def teardown(self):
+        remove_indices()
+
+    def _exact(self, filename, region, bins):
+        walker = wiggelen.walk(open_(filename))
+        return [summary for _, summary in
+                summarize(walker, [(region, b, e) for b, e in bins])]
+
+    def test_index_zoom(self):
+        """
+        Zoom levels in the index.
+        """
+        idx, _ = index(open_('query.wig'), force=True, zoom_levels=[10, 50])
+        assert_equal(sorted(idx['_all']['zoom']), [10, 50])
+        assert_equal(sorted(idx['1']['zoom'][50]), [0, 1, 2])
+        for level in 10, 50:
+            bins = sorted(idx['1']['zoom'][level].items())
+            expected = self._exact('query.wig', '1',
+                                   [(b * level + 1, (b + 1) * level)
+                                    for b, _ in bins])
+            for (_, summary), exact in zip(bins, expected):
+                assert_almost_equal(summary[0], exact['sum'])
+                assert_equal(summary[1:], [exact['min'], exact['max'],
+                                           exact['count']])
+        clear_cache()
+        assert_equal(read_index(open_('query.wig'), zoom_levels=[10]), idx)
+        assert_equal(read_index(open_('query.wig'), zoom_levels=[10, 20]),
+                     None)
+
+    def test_index_zoom_rebuild(self):
+        """
+        Rebuild an index without zoom levels.
+        """
+        idx, _ = index(open_('query.wig'), force=True)
+        assert 'zoom' not in idx['_all']
+        idx, _ = index(open_('query.wig'), force=True, zoom_levels=[10])
+        assert_equal(sorted(idx['_all']['zoom']), [10])
+
+    def test_summarize_zoom(self):
+        """
+        Summarize bins from a zoom level.
+        """
+        index(open_('query.wig'), force=True, zoom_levels=[10])
+        result = zoom.summarize(open_('query.wig'), '1', 1, 100, bins=5)
+        assert_equal([(b, e) for b, e, _ in result],
+                     [(1, 20), (21, 40), (41, 60), (61, 80), (81, 100)])
+        expected = self._exact('query.wig', '1',
+                               [(b, e) for b, e, _ in result])
+        for (_, _, summary), exact in zip(result, expected):
+            for field in 'sum', 'mean', 'min', 'max', 'count':
+                assert_almost_equal(summary[field], exact[field])
+
+    def test_summarize_zoom_unaligned(self):
+        """
+        Summarize bins that are not aligned with the zoom level.
+        """
+        index(open_('query.wig'), force=True, zoom_levels=[10])
+        result = zoom.summarize(open_('query.wig'), '1', 6, 35, bins=2)
+        assert_equal([(b, e) for b, e, _ in result], [(6, 20), (21, 35)])
+        assert_almost_equal(result[0][2]['sum'], 41 / 2.0 + 38)
+        assert_almost_equal(result[0][2]['count'], 5 / 2.0 + 5)
+        assert_equal(result[0][2]['min'], 0)
+        assert_equal(result[0][2]['max'], 16)
+
+    def test_summarize_exact(self):
+        """
+        Summarize bins smaller than any zoom level.
+        """
+        index(open_('query.wig'), force=True, zoom_levels=[1000])
+        result = zoom.summarize(open_('query.wig'), '1', 50, 80, bins=4,
+                                force_index=True)
+        expected = self._exact('query.wig', '1',
+                               [(b, e) for b, e, _ in result])
+        for (_, _, summary), exact in zip(result, expected):
+            del exact['covered']
+            assert_equal(sorted(summary), sorted(exact))
+            for field in summary:
+                assert_almost_equal(summary[field], exact[field])
+
+    def test_walk_bins(self):
+        """
+        Walk over mean values per bin.
+        """
+        index(open_('query.wig'), force=True, zoom_levels=[10])
+        result = list(zoom.walk_bins(open_('query.wig'), bins=2))
+        assert_equal([(r, p) for r, p, _ in result],
+                     [('1', 30), ('1', 90), ('2', 58), ('2', 173)])
+        expected = self._exact('query.wig', '1', [(1, 60), (61, 120)])
+        assert_almost_equal(result[0][2], expected[0]['mean'])
+        assert_almost_equal(result[1][2], expected[1]['mean'])
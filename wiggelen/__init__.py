@@ -13,7 +13,8 @@ as GC percent, probability scores, read depth, and transcriptome data.
 
 
 from .parse import ParseError
-from .wiggle import ReadError, walk, zip_, fill, write
+from .wiggle import (ReadError, OrderError, walk, zip_, fill, write,
+                     write_bedgraph)
 
 
 # We follow a versioning scheme compatible with setuptools [1] where the
@@ -0,0 +1,288 @@
+"""
+Decode wiggle tracks into blocks of arrays.
+
+Instead of parsing a wiggle track line by line, the data lines are decoded in
+bulk into arrays of positions, spans, and values. If the track has an index,
+the byte range of each region is read in one go.
+
+.. note:: This module uses :mod:`numpy` if it is installed, in which case the
+    positions and spans are arrays of type `int64` and the values are arrays
+    of type `int64` (if the block has only integer values) or `float64`.
+    Otherwise, we fall back to parsing line by line and the arrays are plain
+    lists. Tracks in the bedGraph format are always parsed line by line.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import itertools
+import re
+import sys
+
+from .parse import LineType, Mode, create_state, parse
+from .index import ReadError, index
+from .compress import decompress
+
+# Bulk decoding only if NumPy is installed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Maximum number of bytes to decode at once.
+CHUNK_SIZE = 1 << 24
+
+
+# Any line that is not a data line (region definitions, comments, empty
+# lines, etcetera).
+_NON_DATA = re.compile(r'^(?![0-9.]).*(\n|$)', re.M)
+
+
+def _read_chunks(track, start=None, stop=None, chunk_size=CHUNK_SIZE):
+    # Read the track in chunks of whole lines, up to byte offset `stop`.
+    if stop is not None and getattr(track, 'virtual', False):
+        # We cannot compute with virtual offsets, so we compare them after
+        # every line instead.
+        while track.tell() < stop:
+            lines = []
+            size = 0
+            while size < chunk_size and track.tell() < stop:
+                line = track.readline()
+                if not line:
+                    return
+                lines.append(line)
+                size += len(line)
+            yield ''.join(lines)
+        return
+
+    position = start or 0
+    while stop is None or position < stop:
+        size = chunk_size if stop is None else min(chunk_size, stop - position)
+        chunk = track.read(size)
+        if not chunk:
+            break
+        if not chunk.endswith('\n') and (stop is None or
+                                         position + len(chunk) < stop):
+            chunk += track.readline()
+        position += len(chunk)
+        yield chunk
+
+
+def _concatenate(arrays):
+    if len(arrays) == 1:
+        return arrays[0]
+    if numpy is not None:
+        return numpy.concatenate(arrays)
+    return list(itertools.chain.from_iterable(arrays))
+
+
+def _values(numbers, data):
+    # Like the parse function, we have integer values if there is no '.' in
+    # the data lines.
+    if '.' in data:
+        return numbers
+    return numbers.astype(numpy.int64)
+
+
+def _decode_data(data, state):
+    # Decode a chunk of data lines into arrays of positions, spans, and
+    # values. The state dictionary is modified as with the parse function.
+    lines = data.count('\n') + (not data.endswith('\n'))
+
+    numbers = None
+    if numpy is not None:
+        try:
+            numbers = numpy.fromiter(map(float, data.split()), numpy.float64)
+        except ValueError:
+            # Malformed data is parsed line by line below.
+            pass
+
+    if numbers is not None:
+        if state['mode'] == Mode.VARIABLE and len(numbers) == 2 * lines:
+            positions = numbers[0::2].astype(numpy.int64)
+            if (positions == numbers[0::2]).all():
+                return (positions,
+                        numpy.repeat(numpy.int64(state['span']), lines),
+                        _values(numbers[1::2], data))
+
+        if state['mode'] == Mode.FIXED and len(numbers) == lines:
+            positions = (state['start'] +
+                         state['step'] * numpy.arange(lines,
+                                                      dtype=numpy.int64))
+            state['start'] += state['step'] * lines
+            return (positions,
+                    numpy.repeat(numpy.int64(state['span']), lines),
+                    _values(numbers, data))
+
+    # Fall back to parsing line by line. This also gives us a sensible
+    # exception in case of malformed data.
+    positions, spans, values = [], [], []
+    for line in data.splitlines(True):
+        _, item = parse(line, state)
+        positions.append(item.position)
+        spans.append(item.span)
+        values.append(item.value)
+
+    return _arrays(positions, spans, values)
+
+
+def _arrays(positions, spans, values):
+    if numpy is not None:
+        return (numpy.array(positions, dtype=numpy.int64),
+                numpy.array(spans, dtype=numpy.int64),
+                numpy.array(values))
+    return positions, spans, values
+
+
+def _is_bedgraph(text, state):
+    # Check if the first line of the chunk that is not a comment or track
+    # definition line is a bedGraph line, without modifying the state.
+    state = dict(state)
+    offset = 0
+    while offset < len(text):
+        end = text.find('\n', offset) + 1 or len(text)
+        line_type, _ = parse(text[offset:end], state)
+        if line_type != LineType.NONE:
+            break
+        offset = end
+    return state['mode'] == Mode.BEDGRAPH
+
+
+def _decode_lines(text, state, region=None):
+    # Decode a chunk of lines by parsing them one by one into a list of
+    # (region, positions, spans, values) blocks and return it together with
+    # the current region.
+    blocks = []
+    positions, spans, values = [], [], []
+
+    for line in text.splitlines(True):
+        line_type, data = parse(line, state)
+        if line_type & LineType.REGION and state['region'] != region:
+            if positions:
+                blocks.append((region,) + _arrays(positions, spans, values))
+                positions, spans, values = [], [], []
+            region = state['region']
+        if line_type & LineType.DATA:
+            positions.append(data.position)
+            spans.append(data.span)
+            values.append(data.value)
+
+    if positions:
+        blocks.append((region,) + _arrays(positions, spans, values))
+
+    return blocks, region
+
+
+def _decode(text, state, region=None):
+    # Decode a chunk of lines into a list of (region, positions, spans,
+    # values) blocks and return it together with the current region.
+    if state['mode'] == Mode.BEDGRAPH or (state['region'] is None and
+                                          _is_bedgraph(text, state)):
+        return _decode_lines(text, state, region)
+
+    blocks = []
+    offset = 0
+
+    for match in _NON_DATA.finditer(text):
+        if match.start() == match.end():
+            continue
+        if match.start() > offset:
+            blocks.append((region,) + _decode_data(text[offset:match.start()],
+                                                   state))
+        line_type, data = parse(match.group(), state)
+        if line_type & LineType.REGION:
+            region = state['region']
+        offset = match.end()
+
+    if offset < len(text):
+        blocks.append((region,) + _decode_data(text[offset:], state))
+
+    return blocks, region
+
+
+def walk_arrays(track=sys.stdin, force_index=False, chunk_size=CHUNK_SIZE,
+                regions=None):
+    """
+    Walk over the track and yield (region, positions, spans, values) tuples
+    per block of data.
+
+    Regions are walked in the same order as with :func:`wiggelen.walk`. A
+    region can be split over more than one consecutive block, in which case
+    each block contains at most `chunk_size` bytes of the track.
+
+    If a valid cache exists for the track (see :mod:`wiggelen.cache`), its
+    blocks are used instead of decoding the track.
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg force_index: Force creating an index if it does not yet exist.
+    :type force_index: bool
+    :arg chunk_size: Maximum number of bytes to decode at once.
+    :type chunk_size: int
+    :arg regions: Walk only these regions, in this order. This requires an
+        index.
+    :type regions: list(str)
+
+    :return: Tuples of (region, positions, spans, values) per block.
+    :rtype: generator(str, array(int), array(int), array(float))
+
+    Example::
+
+        >>> for x in walk_arrays(open('a.wig')):
+        ...     x
+        ...
+        ('18', array([7, 8]), array([1, 1]), array([ 29.,  49.]))
+        ('MT', array([1, 2]), array([1, 1]), array([ 20.,  36.]))
+    """
+    track = decompress(track)
+    idx, _ = index(track, force=force_index)
+
+    # Import here to prevent a circular import.
+    from .cache import read_cache
+    blocks = read_cache(track)
+
+    if regions is not None:
+        if idx is None:
+            raise ReadError('Could not walk regions (needs index)')
+        regions = [r for r in regions if r in idx and r != '_all']
+    elif idx is not None:
+        regions = sorted(r for r in idx if r != '_all')
+
+    if blocks is not None:
+        if regions is not None:
+            blocks_by_region = {}
+            for block in blocks:
+                blocks_by_region.setdefault(block[0], []).append(block)
+            blocks = [block for r in regions
+                      for block in blocks_by_region.get(r, [])]
+        return iter(blocks)
+
+    if regions is None:
+        ranges = [(None, None)]
+    else:
+        ranges = [(idx[r]['start'], idx[r]['stop']) for r in regions]
+
+    return _walk_ranges(track, ranges, chunk_size=chunk_size)
+
+
+def _walk_ranges(track, ranges, chunk_size=CHUNK_SIZE):
+    # Walk over blocks in the given list of (start, stop) byte ranges, where
+    # `None` means the current position and the end of the track.
+    for start, stop in ranges:
+        if start is not None:
+            track.seek(start)
+
+        state = create_state()
+        region = None
+
+        for chunk in _read_chunks(track, start, stop, chunk_size):
+            blocks, region = _decode(chunk, state, region)
+            for r, group in itertools.groupby(blocks, lambda b: b[0]):
+                group = list(group)
+                yield (r,
+                       _concatenate([b[1] for b in group]),
+                       _concatenate([b[2] for b in group]),
+                       _concatenate([b[3] for b in group]))
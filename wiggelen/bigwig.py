@@ -0,0 +1,591 @@
+"""
+Read and write wiggle tracks in the bigWig format.
+
+The bigWig format [#]_ is a compressed, indexed binary format for dense
+continuous data. Its data is stored in zlib compressed blocks of records, an
+R-tree index gives random access to these blocks, and summaries at several
+zoom levels allow for fast visualization of large regions. This module does
+not depend on the UCSC tools.
+
+We write the data as bedGraph records, where consecutive positions with the
+same value are combined in one record. Since the bigWig format stores values
+as 32-bit floats, some precision may be lost.
+
+The bigWig format requires the size of every region. If these are not given,
+the end of the last record in the region is used.
+
+Reading bigWig tracks is transparent: :func:`wiggelen.walk`,
+:func:`wiggelen.index.index`, and :func:`wiggelen.query.query` detect bigWig
+tracks and use the chromosome tree and R-tree index of the track to read the
+requested regions. Records of all types (bedGraph, variableStep, and
+fixedStep) can be read.
+
+.. [#] Kent, W.J., Zweig, A.S., Barber, G., Hinrichs, A.S., Karolchik, D.
+   BigWig and BigBed: enabling browsing of large distributed datasets.
+   Bioinformatics, 26(17):2204-7, 2010.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+
+
+#: Magic number identifying bigWig files.
+BIGWIG_MAGIC = 0x888ffc26
+
+#: Magic number identifying the chromosome B+ tree.
+BPT_MAGIC = 0x78ca8c91
+
+#: Magic number identifying R-tree indices.
+CIRTREE_MAGIC = 0x2468ace0
+
+#: Maximum number of records per data block.
+ITEMS_PER_SLOT = 1024
+
+#: Maximum number of children per R-tree node.
+BLOCK_SIZE = 256
+
+#: Candidate zoom levels (bin widths). Zoom levels that do not reduce the
+#: number of records by at least half are not written.
+ZOOM_LEVELS = [40 * 4 ** i for i in range(10)]
+
+
+# Section types for bedGraph, variableStep, and fixedStep records.
+_BEDGRAPH, _VARIABLE_STEP, _FIXED_STEP = 1, 2, 3
+
+
+class _BlockWriter(object):
+    # Write records in zlib compressed blocks to a temporary file and keep
+    # track of the blocks in a list of (chrom_id, start, chrom_id, end,
+    # offset, size) tuples, where offsets are relative to the start of the
+    # temporary file.
+    def __init__(self, pack_header, pack_record):
+        self.file = tempfile.TemporaryFile()
+        self.pack_header = pack_header
+        self.pack_record = pack_record
+        self.blocks = []
+        self.records = []
+        self.count = 0
+        self.size = 0
+        self.max_size = 0
+
+    def add(self, chrom_id, start, end, *data):
+        if self.records and (self.records[0][0] != chrom_id or
+                             len(self.records) >= ITEMS_PER_SLOT):
+            self.flush()
+        self.records.append((chrom_id, start, end) + data)
+        self.count += 1
+
+    def flush(self):
+        if not self.records:
+            return
+        chrom_id = self.records[0][0]
+        start = self.records[0][1]
+        end = max(record[2] for record in self.records)
+        data = self.pack_header(self.records) + b''.join(
+            self.pack_record(record) for record in self.records)
+        compressed = zlib.compress(data)
+        self.file.write(compressed)
+        self.blocks.append((chrom_id, start, chrom_id, end, self.size,
+                            len(compressed)))
+        self.size += len(compressed)
+        self.max_size = max(len(data), self.max_size)
+        self.records = []
+
+
+def _data_writer():
+    # Block writer for bedGraph sections.
+    def pack_header(records):
+        return struct.pack('<IIIIIBBH', records[0][0], records[0][1],
+                           max(record[2] for record in records), 0, 0,
+                           _BEDGRAPH, 0, len(records))
+
+    def pack_record(record):
+        return struct.pack('<IIf', record[1], record[2], record[3])
+
+    return _BlockWriter(pack_header, pack_record)
+
+
+def _zoom_writer():
+    # Block writer for zoom level summaries.
+    def pack_header(records):
+        return b''
+
+    def pack_record(record):
+        return struct.pack('<IIIIffff', *record)
+
+    return _BlockWriter(pack_header, pack_record)
+
+
+class _Zoom(object):
+    # Summarize records in bins of a fixed width.
+    def __init__(self, level):
+        self.level = level
+        self.writer = _zoom_writer()
+        self.bin = None
+
+    def add(self, chrom_id, start, end, value):
+        # Records are zero-based and half-open.
+        while start < end:
+            b = start // self.level
+            stop = min(end, (b + 1) * self.level)
+            count = stop - start
+            if self.bin is None or self.bin[:2] != [chrom_id, b]:
+                self.flush()
+                self.bin = [chrom_id, b, start, stop, 0, value, value, 0, 0]
+            self.bin[3] = stop
+            self.bin[4] += count
+            self.bin[5] = min(value, self.bin[5])
+            self.bin[6] = max(value, self.bin[6])
+            self.bin[7] += value * count
+            self.bin[8] += value * value * count
+            start = stop
+
+    def flush(self):
+        if self.bin is not None:
+            self.writer.add(self.bin[0], *self.bin[2:])
+            self.bin = None
+
+
+def _compact(walker):
+    # Combine adjacent runs with the same value.
+    run = None
+    for region, start, end, value in walker:
+        if value is None:
+            continue
+        if (run is not None and region == run[0] and start == run[2] + 1 and
+            value == run[3]):
+            run = region, run[1], end, value
+            continue
+        if run is not None:
+            yield run
+        run = region, start, end, value
+    if run is not None:
+        yield run
+
+
+def _size(region, last, sizes):
+    # Size of a region with data up to position `last`.
+    size = sizes.get(region, last)
+    if size < last:
+        raise ValueError('Region %s has data beyond its size' % region)
+    return size
+
+
+def _chrom_tree(chroms, offset):
+    # Serialize a B+ tree for the list of (name, chrom_id, size) tuples.
+    # Argument `offset` is the position of the tree in the file.
+    chroms = sorted((name.encode('ascii'), chrom_id, size)
+                    for name, chrom_id, size in chroms)
+    key_size = max([len(name) for name, _, _ in chroms] + [1])
+    block_size = max(min(len(chroms), BLOCK_SIZE), 1)
+    header = struct.pack('<IIIIQQ', BPT_MAGIC, block_size, key_size, 8,
+                         len(chroms), 0)
+
+    # Group the chromosomes in nodes, level by level up to a single root
+    # node. The keys of a non-leaf node are the first keys of its children.
+    levels = [[chroms[i:i + block_size]
+               for i in range(0, len(chroms), block_size)] or [[]]]
+    keys = [node[0][0] for node in levels[0] if node]
+    while len(levels[0]) > 1:
+        levels.insert(0, [keys[i:i + block_size]
+                          for i in range(0, len(keys), block_size)])
+        keys = [node[0] for node in levels[0]]
+
+    # Offsets of all nodes, from the root to the leaves. Items in leaf and
+    # non-leaf nodes have the same size.
+    offset += len(header)
+    offsets = []
+    for nodes in levels:
+        offsets.append([])
+        for node in nodes:
+            offsets[-1].append(offset)
+            offset += 4 + (key_size + 8) * len(node)
+
+    data = [header]
+    for depth, nodes in enumerate(levels):
+        leaf = depth == len(levels) - 1
+        children = iter(offsets[depth + 1]) if not leaf else None
+        for node in nodes:
+            data.append(struct.pack('<BBH', leaf, 0, len(node)))
+            for item in node:
+                if leaf:
+                    name, chrom_id, size = item
+                    data.append(name.ljust(key_size, b'\0') +
+                                struct.pack('<II', chrom_id, size))
+                else:
+                    data.append(item.ljust(key_size, b'\0') +
+                                struct.pack('<Q', next(children)))
+    return b''.join(data)
+
+
+def _cir_tree(blocks, offset, end_offset):
+    # Serialize an R-tree index for the list of (start_chrom_id, start,
+    # end_chrom_id, end, offset, size) blocks. Argument `offset` is the
+    # position of the index in the file.
+    header = struct.pack(
+        '<IIQIIIIQII', CIRTREE_MAGIC, BLOCK_SIZE, len(blocks),
+        blocks[0][0] if blocks else 0, blocks[0][1] if blocks else 0,
+        max(b[2:4] for b in blocks)[0] if blocks else 0,
+        max(b[2:4] for b in blocks)[1] if blocks else 0,
+        end_offset, ITEMS_PER_SLOT, 0)
+
+    # Group the blocks in nodes, level by level up to a single root node.
+    levels = [[blocks[i:i + BLOCK_SIZE]
+               for i in range(0, len(blocks), BLOCK_SIZE)] or [[]]]
+    while len(levels[0]) > 1:
+        nodes = [(node[0][0], node[0][1], max(b[2:4] for b in node)[0],
+                  max(b[2:4] for b in node)[1])
+                 for node in levels[0]]
+        levels.insert(0, [nodes[i:i + BLOCK_SIZE]
+                          for i in range(0, len(nodes), BLOCK_SIZE)])
+
+    # Offsets of all nodes, from the root to the leaves.
+    offset += len(header)
+    offsets = []
+    for depth, nodes in enumerate(levels):
+        item_size = 32 if depth == len(levels) - 1 else 24
+        offsets.append([])
+        for node in nodes:
+            offsets[-1].append(offset)
+            offset += 4 + item_size * len(node)
+
+    data = [header]
+    for depth, nodes in enumerate(levels):
+        leaf = depth == len(levels) - 1
+        children = iter(offsets[depth + 1]) if not leaf else None
+        for node in nodes:
+            data.append(struct.pack('<BBH', leaf, 0, len(node)))
+            for item in node:
+                if leaf:
+                    data.append(struct.pack('<IIIIQQ', *item))
+                else:
+                    data.append(struct.pack('<IIIIQ',
+                                            *(item + (next(children),))))
+    return b''.join(data)
+
+
+def _copy(source, track):
+    source.seek(0)
+    shutil.copyfileobj(source, track)
+    source.close()
+
+
+def write_bigwig(walker, track=sys.stdout, runs=False, sizes=None):
+    """
+    Write items from a walker to a bigWig track.
+
+    The track is written sequentially, so it need not be seekable. All
+    regions in the walker must be consecutive and positions in a region must
+    be increasing, otherwise a `ValueError` is raised.
+
+    :arg walker: Tuples of (region, position, value) per defined position.
+    :type walker: generator(str, int, _)
+    :arg track: Writable file handle opened in binary mode.
+    :type track: file
+    :arg runs: The walker yields tuples of (region, start, end, value) per
+        run.
+    :type runs: bool
+    :arg sizes: Dictionary with regions as keys and region sizes as values
+        (e.g., read from a ``chrom.sizes`` file). Regions without size get
+        the last position with data as size, so a genome browser does not
+        show the rest of the region.
+    :type sizes: dict(str, int)
+
+    .. note:: Values of `None` are discarded.
+
+    Example::
+
+        >>> with open('a.bw', 'wb') as track:
+        ...     write_bigwig(walk(open('a.wig')), track)
+    """
+    sizes = sizes or {}
+
+    if not runs:
+        walker = ((region, position, position, value)
+                  for region, position, value in walker)
+
+    data = _data_writer()
+    zooms = [_Zoom(level) for level in ZOOM_LEVELS]
+
+    chroms = []
+    seen = set()
+    region = chrom_id = None
+    summary = [0, None, None, 0, 0]
+
+    for region_, start, end, value in _compact(walker):
+        if region_ != region:
+            for zoom in zooms:
+                zoom.flush()
+            if region is not None:
+                chroms.append((region, chrom_id, _size(region, last, sizes)))
+            if region_ in seen:
+                raise ValueError('Region %s is not consecutive' % region_)
+            seen.add(region_)
+            region = region_
+            chrom_id = len(chroms)
+        elif start <= last:
+            raise ValueError('Positions in region %s are not increasing'
+                             % region)
+        last = end
+        data.add(chrom_id, start - 1, end, value)
+        for zoom in zooms:
+            zoom.add(chrom_id, start - 1, end, value)
+        count = end - start + 1
+        summary[0] += count
+        summary[1] = value if summary[1] is None else min(value, summary[1])
+        summary[2] = value if summary[2] is None else max(value, summary[2])
+        summary[3] += value * count
+        summary[4] += value * value * count
+
+    if region is not None:
+        chroms.append((region, chrom_id, _size(region, last, sizes)))
+
+    data.flush()
+    for zoom in zooms:
+        zoom.flush()
+        zoom.writer.flush()
+
+    # Only keep zoom levels reducing the number of records by at least half.
+    for zoom in zooms:
+        if not 0 < 2 * zoom.writer.count <= data.count:
+            zoom.writer.file.close()
+    zooms = [zoom for zoom in zooms
+             if 0 < 2 * zoom.writer.count <= data.count]
+
+    # Layout of the file.
+    summary_offset = 64 + 24 * len(zooms)
+    chrom_tree_offset = summary_offset + 40
+    chrom_tree = _chrom_tree(chroms, chrom_tree_offset)
+    data_offset = chrom_tree_offset + len(chrom_tree)
+    blocks = [block[:4] + (data_offset + 8 + block[4], block[5])
+              for block in data.blocks]
+    index_offset = data_offset + 8 + data.size
+    index = _cir_tree(blocks, index_offset, index_offset)
+
+    zoom_headers = []
+    zoom_indices = []
+    offset = index_offset + len(index)
+    for zoom in zooms:
+        blocks = [block[:4] + (offset + 4 + block[4], block[5])
+                  for block in zoom.writer.blocks]
+        zoom_index_offset = offset + 4 + zoom.writer.size
+        zoom_indices.append(_cir_tree(blocks, zoom_index_offset,
+                                      zoom_index_offset))
+        zoom_headers.append(struct.pack('<IIQQ', zoom.level, 0, offset,
+                                        zoom_index_offset))
+        offset = zoom_index_offset + len(zoom_indices[-1])
+
+    track.write(struct.pack(
+        '<IHHQQQHHQQIQ', BIGWIG_MAGIC, 4, len(zooms), chrom_tree_offset,
+        data_offset, index_offset, 0, 0, 0, summary_offset,
+        max([data.max_size] + [zoom.writer.max_size for zoom in zooms]), 0))
+    for zoom_header in zoom_headers:
+        track.write(zoom_header)
+    track.write(struct.pack('<Qdddd', summary[0], summary[1] or 0,
+                            summary[2] or 0, summary[3], summary[4]))
+    track.write(chrom_tree)
+    track.write(struct.pack('<Q', len(data.blocks)))
+    _copy(data.file, track)
+    track.write(index)
+    for zoom, zoom_index in zip(zooms, zoom_indices):
+        track.write(struct.pack('<I', zoom.writer.count))
+        _copy(zoom.writer.file, track)
+        track.write(zoom_index)
+    track.write(struct.pack('<I', BIGWIG_MAGIC))
+
+
+# Binary file object for a track.
+def _binary(track):
+    # Python 3 compatibility.
+    return getattr(track, 'buffer', track)
+
+
+def is_bigwig(track):
+    """
+    Check if a track is in the bigWig format.
+
+    The track must provide random access, otherwise it is assumed not to be
+    in the bigWig format.
+
+    :arg track: Track.
+    :type track: file
+
+    :return: Whether or not `track` is in the bigWig format.
+    :rtype: bool
+    """
+    data = _binary(track)
+    try:
+        position = data.tell()
+        data.seek(0)
+        magic = data.read(4)
+        data.seek(position)
+    except (AttributeError, IOError, ValueError):
+        return False
+    if not isinstance(magic, bytes) or len(magic) != 4:
+        return False
+    return BIGWIG_MAGIC in (struct.unpack('<I', magic)[0],
+                            struct.unpack('>I', magic)[0])
+
+
+class _Reader(object):
+    # Random access to the data in a bigWig track.
+    def __init__(self, track):
+        self.data = _binary(track)
+        self.data.seek(0)
+        magic = self.data.read(4)
+        self.endian = ('<' if struct.unpack('<I', magic)[0] == BIGWIG_MAGIC
+                       else '>')
+        (_, _, _, chrom_tree_offset, _, self.index_offset, _, _, _, _,
+         self.uncompress_buf_size, _) = self.unpack('IHHQQQHHQQIQ', 0)
+        self.chroms = {}
+        key_size = self.unpack('IIII', chrom_tree_offset)[2]
+        self._read_chroms(chrom_tree_offset + 32, key_size)
+
+    def unpack(self, format, offset):
+        format = struct.Struct(self.endian + format)
+        self.data.seek(offset)
+        return format.unpack(self.data.read(format.size))
+
+    def _read_chroms(self, offset, key_size):
+        # Walk the chromosome B+ tree, storing (chrom_id, size) per region.
+        leaf, _, count = self.unpack('BBH', offset)
+        item = struct.Struct('%s%ds%s' % (self.endian, key_size,
+                                          'II' if leaf else 'Q'))
+        self.data.seek(offset + 4)
+        items = [item.unpack(self.data.read(item.size))
+                 for _ in range(count)]
+        for values in items:
+            if leaf:
+                name = values[0].rstrip(b'\0')
+                # Python 3 compatibility.
+                if not isinstance(name, str):
+                    name = name.decode('ascii')
+                self.chroms[name] = values[1:]
+            else:
+                self._read_chroms(values[1], key_size)
+
+    def _find_blocks(self, offset, chrom_id, start, end):
+        # Walk the R-tree and yield (offset, size) for every block with data
+        # overlapping `start` to `end` (zero-based, half-open) in the region.
+        leaf, _, count = self.unpack('BBH', offset)
+        item = struct.Struct(self.endian + ('IIIIQQ' if leaf else 'IIIIQ'))
+        self.data.seek(offset + 4)
+        items = [item.unpack(self.data.read(item.size))
+                 for _ in range(count)]
+        for values in items:
+            if ((values[0], values[1]) < (chrom_id, end) and
+                (values[2], values[3]) > (chrom_id, start)):
+                if leaf:
+                    yield values[4:]
+                else:
+                    for block in self._find_blocks(values[4], chrom_id,
+                                                   start, end):
+                        yield block
+
+    def _read_block(self, offset, size):
+        # Yield (start, end, value) per record in the block (zero-based,
+        # half-open).
+        self.data.seek(offset)
+        block = self.data.read(size)
+        if self.uncompress_buf_size:
+            block = zlib.decompress(block)
+        (_, chrom_start, _, step, span, type_, _,
+         count) = struct.unpack(self.endian + 'IIIIIBBH', block[:24])
+        if type_ == _BEDGRAPH:
+            values = struct.unpack(self.endian + 'IIf' * count, block[24:])
+            for i in range(0, 3 * count, 3):
+                yield values[i:i + 3]
+        elif type_ == _VARIABLE_STEP:
+            values = struct.unpack(self.endian + 'If' * count, block[24:])
+            for i in range(0, 2 * count, 2):
+                yield values[i], values[i] + span, values[i + 1]
+        elif type_ == _FIXED_STEP:
+            values = struct.unpack(self.endian + 'f' * count, block[24:])
+            for i in range(count):
+                yield (chrom_start + i * step, chrom_start + i * step + span,
+                       values[i])
+
+    def query(self, region, start=None, end=None):
+        # Yield (region, start, end, value) per run from `start` to `end`
+        # (one-based, both including) in the region.
+        if region not in self.chroms:
+            return
+        chrom_id, size = self.chroms[region]
+        first = 0 if start is None else start - 1
+        last = size if end is None else end
+        for offset, size in self._find_blocks(self.index_offset + 48,
+                                              chrom_id, first, last):
+            for run_start, run_end, value in self._read_block(offset, size):
+                run_start, run_end = max(run_start, first), min(run_end, last)
+                if run_start < run_end:
+                    yield region, run_start + 1, run_end, value
+
+
+def _positions(walker, runs=False):
+    if runs:
+        return walker
+    return ((region, position, value)
+            for region, start, end, value in walker
+            for position in range(start, end + 1))
+
+
+def walk_bigwig(track, runs=False, regions=None, order=None):
+    """
+    Walk over the track and yield (region, position, value) tuples.
+
+    This is used by :func:`wiggelen.walk` for tracks in the bigWig format.
+
+    :arg track: Track in the bigWig format.
+    :type track: file
+    :arg runs: Yield tuples of (region, start, end, value) per run instead of
+        per position.
+    :type runs: bool
+    :arg regions: Walk only over these regions, in this order.
+    :type regions: list(str)
+    :arg order: Key function defining the order of regions (regions are
+        ordered alphabetically by default).
+    :type order: function(str -> _)
+
+    :return: Tuples of (region, position, value) per defined position, or
+        tuples of (region, start, end, value) per run if `runs` is `True`.
+    :rtype: generator(str, int, float)
+    """
+    reader = _Reader(track)
+    if regions is None:
+        regions = sorted(reader.chroms, key=order)
+    return _positions((run for region in regions
+                       for run in reader.query(region)), runs=runs)
+
+
+def query_bigwig(track, region, start, end, runs=False):
+    """
+    Walk over the positions from `start` to `end` (both including) in a
+    region of the track.
+
+    This is used by :func:`wiggelen.query.query` for tracks in the bigWig
+    format.
+
+    :arg track: Track in the bigWig format.
+    :type track: file
+    :arg region: Region to query.
+    :type region: str
+    :arg start: First position to query.
+    :type start: int
+    :arg end: Last position to query.
+    :type end: int
+    :arg runs: Yield tuples of (region, start, end, value) per run instead of
+        per position. Runs are clipped to the queried positions.
+    :type runs: bool
+
+    :return: Tuples of (region, position, value) per defined position.
+    :rtype: generator(str, int, float)
+    """
+    return _positions(_Reader(track).query(region, start, end), runs=runs)
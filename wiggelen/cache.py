@@ -0,0 +1,159 @@
+"""
+Cache decoded wiggle tracks in a binary file for fast repeated reading.
+
+The cache is written to a file next to the wiggle track file (in case this is
+a regular file) and contains the blocks of arrays as produced by
+:func:`wiggelen.arrays.walk_arrays`. Positions and spans are stored as 64-bit
+integers and values as 64-bit integers or floats, all in little-endian byte
+order. Reading the cache maps these arrays in memory, so no parsing is needed
+at all.
+
+The arrays are followed by a table of contents using a serialization similar
+to that of the index, and finally the byte offset of this table as a 64-bit
+integer. The first line of the table records the size and modification time
+of the wiggle track, and the cache is ignored if these no longer match::
+
+    size=12453,mtime=1399110213.0
+    region=1,offset=0,count=643,type=i8
+    region=MT,offset=15432,count=143,type=f8
+
+.. note:: This module depends on the :mod:`numpy` package. If it is not
+    installed, a cache is never written or read.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import os
+import struct
+import sys
+
+from .arrays import _walk_ranges
+from .index import ReadError, _stat
+from .compress import decompress
+
+# Caching only if NumPy is installed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Whether or not caches are used when reading wiggle tracks.
+USE_CACHE = True
+
+#: Suffix used for cache files.
+CACHE_SUFFIX = '.cache'
+
+
+# Try to create a filename for the cache file.
+def _cache_filename(track=sys.stdin):
+    filename = getattr(track, 'name', None)
+    if filename is not None and not filename.startswith('<'):
+        return filename + CACHE_SUFFIX
+
+
+def write_cache(track=sys.stdin):
+    """
+    Try to write the cache for a wiggle track to a file and return its
+    filename.
+
+    :arg track: Wiggle track.
+    :type track: file
+
+    :return: Filename for the written cache, or `None` if the cache could not
+        be written.
+    :rtype: str
+    """
+    filename = _cache_filename(track)
+    stat = _stat(track)
+
+    if numpy is None or filename is None or stat is None:
+        return
+
+    track = decompress(track)
+
+    try:
+        track.seek(0)
+    except (AttributeError, IOError):
+        raise ReadError('Could not cache track (needs random access)')
+
+    table = ['size=%d,mtime=%r' % stat]
+    offset = 0
+
+    try:
+        with open(filename, 'wb') as f:
+            for region, positions, spans, values in _walk_ranges(
+                    track, [(None, None)]):
+                values = numpy.asarray(values)
+                type_ = 'i8' if values.dtype.kind == 'i' else 'f8'
+                for array, dtype in ((positions, '<i8'), (spans, '<i8'),
+                                     (values, '<' + type_)):
+                    f.write(numpy.asarray(array, dtype=dtype).tobytes())
+                table.append('region=%s,offset=%d,count=%d,type=%s'
+                             % (region, offset, len(values), type_))
+                offset += 24 * len(values)
+            f.write(('\n'.join(table) + '\n').encode('ascii'))
+            f.write(struct.pack('<q', offset))
+        return filename
+    except IOError:
+        pass
+
+
+def read_cache(track=sys.stdin):
+    """
+    Try to read the cache for a wiggle track from a file.
+
+    :arg track: Wiggle track.
+    :type track: file
+
+    :return: List of (region, positions, spans, values) tuples per block in
+        the order of the wiggle track, or `None` if there is no valid cache.
+    :rtype: list(str, array(int), array(int), array(_))
+    """
+    if not USE_CACHE or numpy is None:
+        return
+
+    filename = _cache_filename(track)
+    stat = _stat(track)
+
+    if filename is None or stat is None:
+        return
+
+    # A truncated or corrupt cache is not used.
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(-8, os.SEEK_END)
+            end = f.tell()
+            offset, = struct.unpack('<q', f.read(8))
+            f.seek(offset)
+            table = f.read(end - offset)
+        data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+
+        # Python 3 compatibility.
+        if not isinstance(table, str):
+            table = table.decode('ascii')
+        table = table.splitlines()
+
+        summary = dict(d.split('=') for d in table[0].split(','))
+        if (int(summary['size']), float(summary['mtime'])) != stat:
+            return
+
+        blocks = []
+        for line in table[1:]:
+            block = dict(d.split('=') for d in line.split(','))
+            offset, count = int(block['offset']), int(block['count'])
+            if offset < 0 or offset + 24 * count > len(data):
+                return
+            arrays = [data[offset + 8 * count * i:
+                           offset + 8 * count * (i + 1)].view(dtype)
+                      for i, dtype in enumerate(('<i8', '<i8',
+                                                 '<' + block['type']))]
+            blocks.append((block['region'],) + tuple(arrays))
+    except (IOError, IndexError, KeyError, TypeError, ValueError,
+            struct.error):
+        return
+
+    return blocks
@@ -10,18 +10,24 @@ Wiggelen command line interface.
 from __future__ import division
 
 import argparse
+from contextlib import contextmanager
 import importlib
 import re
 import sys
 
-from .wiggle import fill, walk, write
-from .index import index
-from .merge import merge, mergers
+from .wiggle import OrderError, fill, walk, write, write_bedgraph
+from .bigwig import write_bigwig
+from .index import ZOOM_LEVELS, ReadError, index
+from .cache import write_cache
+from .compress import BgzfWriter
+from .merge import merge, mergers, write_merge
+from .order import natural_key, order_key, read_order
+from .query import query, regions as track_regions
 from .distance import metrics, distance
 from .transform import (backward_divided_difference,
                         forward_divided_difference,
                         central_divided_difference)
-from . import intervals
+from . import fields, intervals, zoom
 
 # Python 3 compatibility.
 try:
@@ -63,27 +69,207 @@ def read_regions(regions):
     return result
 
 
-def index_track(track):
+def read_sizes(sizes):
+    """
+    Ad-hoc parsing of region sizes, one region and its size per line (e.g., a
+    chrom.sizes file).
+    """
+    result = {}
+    for line in sizes:
+        if line.strip():
+            region, size = line.split()[:2]
+            result[region] = int(size)
+    return result
+
+
+@contextmanager
+def output_track(output=None, threads=1, binary=False):
+    """
+    Open the output file, compressed with BGZF if its name ends with .gz or
+    .bgz, or use standard output.
+    """
+    if output is None:
+        # Python 3 compatibility.
+        yield getattr(sys.stdout, 'buffer', sys.stdout) if binary else \
+            sys.stdout
+        return
+
+    if binary:
+        track = open(output, 'wb')
+    elif output.endswith(('.gz', '.bgz')):
+        track = BgzfWriter(open(output, 'wb'), threads=threads)
+    else:
+        track = open(output, 'w')
+
+    try:
+        yield track
+    finally:
+        track.close()
+
+
+def write_track(walker, format='wiggle', name=None, description=None,
+                runs=False, output=None, threads=1, sizes=None):
+    """
+    Write a walker to standard output or a file in the given format.
+    """
+    # The bigWig format is compressed by itself.
+    with output_track(output, threads, binary=format == 'bigwig') as track:
+        if format == 'bigwig':
+            if sizes is not None:
+                sizes = read_sizes(sizes)
+            write_bigwig(walker, track, runs=runs, sizes=sizes)
+        elif format == 'bedgraph':
+            write_bedgraph(walker, track, name=name, description=description,
+                           runs=runs)
+        else:
+            write(walker, track, name=name, description=description,
+                  runs=runs)
+
+
+def add_format_arguments(parser):
+    """
+    Add arguments for the format of the result.
+    """
+    parser.add_argument(
+        '--format', dest='format', type=str, default='wiggle',
+        choices=('wiggle', 'bedgraph', 'bigwig'),
+        help='output format (default: %(default)s)')
+    parser.add_argument(
+        '--sizes', dest='sizes', metavar='FILE',
+        type=argparse.FileType('r'),
+        help='region sizes for the bigWig format, one region and its size '
+        'per line as in a chrom.sizes file (default: last position with '
+        'data)')
+
+
+def add_output_arguments(parser):
+    """
+    Add arguments for writing the result to a file.
+    """
+    parser.add_argument(
+        '--output', dest='output', metavar='FILE', type=str, default=None,
+        help='write the result to FILE, compressed with BGZF if FILE ends '
+        'with .gz or .bgz (default: standard output)')
+    parser.add_argument(
+        '--threads', dest='threads', type=int, default=1,
+        help='compress the result in this many threads (default: '
+        '%(default)s)')
+
+
+def region_order(natural_order=False, order_file=None):
+    """
+    Key function for the order of regions.
+    """
+    if order_file is not None:
+        return order_key(read_order(order_file))
+    if natural_order:
+        return natural_key
+
+
+def index_track(track, zoom=False, jobs=1, statistics=False, histogram=None):
     """
     Build index for wiggle track.
     """
     # Todo: This will not rebuild the index if it already exists.
-    idx, filename = index(track, force=True)
+    custom_fields = []
+    if statistics:
+        custom_fields.extend([fields.moments(), fields.quantiles()])
+    if histogram is not None:
+        low, high, bins = histogram
+        custom_fields.append(fields.histogram(low, high, int(bins)))
+
+    idx, filename = index(track, force=True, fields=custom_fields,
+                          zoom_levels=ZOOM_LEVELS if zoom else None,
+                          jobs=jobs)
     if filename is None:
         abort('Could not write index file')
 
 
-def sort_track(track, name=None, description=None):
+def cache_track(track):
     """
-    Sort wiggle track regions alphabetically.
+    Build binary cache for wiggle track.
+    """
+    if write_cache(track) is None:
+        abort('Could not write cache file (requires numpy)')
+
+
+def query_track(track, region, start, end, name=None, description=None,
+                output=None, threads=1):
+    """
+    Query positions in a region of a wiggle track.
+    """
+    if name is None and hasattr(track, 'name'):
+        name = 'Query of %s' % track.name
+
+    if region not in track_regions(track, force_index=True):
+        abort('Region not found in track: %s' % region)
+
+    write_track(query(track, region, start, end, force_index=True,
+                      runs=True),
+                name=name, description=description, runs=True,
+                output=output, threads=threads)
+
+
+def extract_track(track, bed, name=None, description=None, output=None,
+                  threads=1):
+    """
+    Extract positions in intervals from a wiggle track.
+    """
+    if name is None and hasattr(track, 'name'):
+        name = 'Extract of %s' % track.name
+
+    # Merge overlapping and adjacent intervals, so we write every position
+    # only once.
+    merged = []
+    for region, begin, end in sorted(intervals.read(bed)):
+        if merged and merged[-1][0] == region and begin <= merged[-1][2] + 1:
+            merged[-1] = region, merged[-1][1], max(end, merged[-1][2])
+        else:
+            merged.append((region, begin, end))
+
+    walker = (item for _, items in intervals.extract(track, merged,
+                                                      force_index=True,
+                                                      runs=True)
+              for item in items)
+    write_track(walker, name=name, description=description, runs=True,
+                output=output, threads=threads)
+
+
+def stats_track(track, bed, output=None, threads=1):
+    """
+    Summary statistics of a wiggle track in intervals.
+    """
+    fields = 'sum', 'mean', 'min', 'max', 'count', 'covered'
+
+    def show(value):
+        return 'NA' if value is None else str(value)
+
+    with output_track(output, threads) as result:
+        result.write('#region\tstart\tend\t%s\n' % '\t'.join(fields))
+        for (region, begin, end), summary in intervals.summarize(
+                walk(track, runs=True), intervals.read(bed), runs=True):
+            result.write('%s\t%i\t%i\t%s\n' % (
+                    region, begin - 1, end,
+                    '\t'.join(show(summary[field]) for field in fields)))
+
+
+def sort_track(track, natural_order=False, order_file=None, format='wiggle',
+               name=None, description=None, output=None, threads=1,
+               sizes=None):
+    """
+    Sort wiggle track regions (alphabetically by default).
     """
     if name is None and hasattr(track, 'name'):
         name = 'Sorted %s' % track.name
 
-    write(walk(track, force_index=True), name=name, description=description)
+    order = region_order(natural_order, order_file)
+    write_track(walk(track, force_index=True, order=order), format=format,
+                name=name, description=description, output=output,
+                threads=threads, sizes=sizes)
 
 
-def scale_track(track, factor=0.1, name=None, description=None):
+def scale_track(track, factor=0.1, format='wiggle', name=None,
+                description=None, output=None, threads=1, sizes=None):
     """
     Scale values in a wiggle track.
     """
@@ -91,11 +277,14 @@ def scale_track(track, factor=0.1, name=None, description=None):
         name = 'Scaled %s' % track.name
 
     scale = lambda (r, p, v): (r, p, v * factor)
-    write(map_(scale, walk(track)), name=name, description=description)
+    write_track(map_(scale, walk(track)), format=format, name=name,
+                description=description, output=output, threads=threads,
+                sizes=sizes)
 
 
 def fill_track(track, genome=None, filler='0', only_edges=False,
-               only_genome=False, name=None, description=None):
+               only_genome=False, format='wiggle', name=None,
+               description=None, output=None, threads=1, sizes=None):
     """
     Fill in undefined positions in a wiggle track.
     """
@@ -126,12 +315,15 @@ def fill_track(track, genome=None, filler='0', only_edges=False,
     except ValueError:
         abort('Could not parse filler value: %s' % filler)
 
-    write(fill(walker, regions=genome, filler=filler, only_edges=only_edges),
-          name=name, description=description)
+    write_track(fill(walker, regions=genome, filler=filler,
+                     only_edges=only_edges),
+                format=format, name=name, description=description,
+                output=output, threads=threads, sizes=sizes)
 
 
 def derivative_track(track, method='forward', step=None, auto_step=False,
-                     name=None, description=None):
+                     format='wiggle', name=None, description=None,
+                     output=None, threads=1, sizes=None):
     """
     Create derivative of a wiggle track.
     """
@@ -147,13 +339,14 @@ def derivative_track(track, method='forward', step=None, auto_step=False,
     else:
         derivative = forward_divided_difference
         kwargs['auto_step'] = auto_step
-    write(derivative(walk(track), **kwargs), name=name,
-          description=description)
+    write_track(derivative(walk(track), **kwargs), format=format, name=name,
+                description=description, output=output, threads=threads,
+                sizes=sizes)
 
 
 def plot_tracks(tracks, regions=None, genome=None, order_by='region',
                 average_threshold=None, sharey=False, ylim=None, columns=None,
-                pdf=None):
+                bins=None, pdf=None):
     """
     Visualize wiggle tracks in a plot.
     """
@@ -169,10 +362,11 @@ def plot_tracks(tracks, regions=None, genome=None, order_by='region',
     if genome is not None:
         # Read genome from BED track and filter by specified regions. If we
         # have more than one track, have a region copy per track.
+        genome_regions = dict((r, v) for r, v in read_regions(genome).items()
+                              if regions is None or r in regions)
         genome = dict((rename(r, track, i), v)
-                      for r, v in read_regions(genome).items()
-                      for i, track in enumerate(tracks)
-                      if regions is None or r in regions)
+                      for r, v in genome_regions.items()
+                      for i, track in enumerate(tracks))
 
     # Filter by specified regions.
     def filtered(walker):
@@ -180,15 +374,24 @@ def plot_tracks(tracks, regions=None, genome=None, order_by='region',
             return walker
         return filter_(lambda (r, p, v): r in regions, walker)
 
+    # Walk over bins of each region in the genome, or every position.
+    def walker(track, i):
+        if bins is None:
+            return walk(track)
+        if genome is None:
+            return zoom.walk_bins(track, bins=bins, force_index=True)
+        return zoom.walk_bins(track, bins=bins, force_index=True,
+                              regions=genome_regions)
+
     # Have all tracks concatenated in one walker.
     walker = ((rename(r, track, i), p, v)
               for i, track in enumerate(tracks)
-              for r, p, v in filtered(walk(track)))
+              for r, p, v in filtered(walker(track, i)))
 
     fig, axes, rows, columns = plot(
         walker, regions=genome, order_by=order_by,
         average_threshold=average_threshold, sharey=sharey, ylim=ylim,
-        columns=columns)
+        columns=columns, binned=bins is not None)
 
     if pdf:
         fig.set_size_inches(6 * columns, 3 * rows)
@@ -197,7 +400,8 @@ def plot_tracks(tracks, regions=None, genome=None, order_by='region',
         pyplot.show()
 
 
-def coverage_track(track, threshold=None, name=None, description=None):
+def coverage_track(track, threshold=None, name=None, description=None,
+                   output=None, threads=1):
     """
     Create coverage BED track of a wiggle track.
     """
@@ -206,16 +410,19 @@ def coverage_track(track, threshold=None, name=None, description=None):
 
     # Todo: Define coverage per region, like in `coverage-wiggle-to-bed` from
     #     bio-playground (https://github.com/martijnvermaat/bio-playground).
-    walker = walk(track)
+    walker = walk(track, runs=True)
     if threshold is not None:
-        walker = filter_(lambda (r, p, v): v >= threshold, walker)
+        walker = filter_(lambda (r, s, e, v): v >= threshold, walker)
 
-    intervals.write(intervals.coverage(walker), name=name,
-                    description=description)
+    with output_track(output, threads) as result:
+        intervals.write(intervals.coverage(walker, runs=True), result,
+                        name=name, description=description)
 
 
 def merge_tracks(tracks, merger='sum', custom_merger=None, no_indices=False,
-                 name=None, description=None):
+                 jobs=1, natural_order=False, order_file=None,
+                 format='wiggle', name=None, description=None, output=None,
+                 threads=1, sizes=None):
     """
     Merge any number of wiggle tracks in various ways.
     """
@@ -235,38 +442,79 @@ def merge_tracks(tracks, merger='sum', custom_merger=None, no_indices=False,
     else:
         merge_function = mergers[merger]
 
-    walkers = [walk(track, force_index=not no_indices)
+    order = region_order(natural_order, order_file)
+
+    if jobs > 1:
+        if no_indices:
+            abort('Merging in parallel requires indices')
+        if format == 'bigwig':
+            abort('Merging in parallel does not support bigWig output')
+        with output_track(output, threads) as track:
+            write_merge(tracks, track, merger=merge_function, jobs=jobs,
+                        order=order, name=name, description=description,
+                        bedgraph=format == 'bedgraph')
+        return
+
+    walkers = [walk(track, force_index=not no_indices, runs=True, order=order)
                for track in tracks]
-    write(merge(*walkers, merger=merge_function), name=name,
-          description=description)
+    write_track(merge(*walkers, merger=merge_function, runs=True,
+                      order=order),
+                format=format, name=name, description=description, runs=True,
+                output=output, threads=threads, sizes=sizes)
 
 
-def distance_tracks(tracks, metric='a', threshold=None):
+def distance_tracks(tracks, metric='a', threshold=None, jobs=1,
+                    per_region=False, state=None, sample=None):
     """
     Calculate the distance between wiggle tracks.
     """
     # Todo: Cleanup this code.
     distances = distance(*tracks, metric=metrics[metric],
-                         threshold=threshold)
+                         threshold=threshold, jobs=jobs,
+                         per_region=per_region, state=state, sample=sample)
+    errors = None
+    if sample:
+        distances, errors = distances
 
     def name(index):
         return chr(ord('A') + index)
 
+    def write_matrix(distances):
+        sys.stdout.write('\n   ')
+        sys.stdout.write(' '.join('   %s ' % name(i)
+                                  for i in range(len(tracks))))
+        sys.stdout.write('\n')
+        sys.stdout.write(name(0) + '     x\n')
+        for i in range(1, len(tracks)):
+            sys.stdout.write('%s  ' % name(i))
+            for j in range(0, i):
+                # Tracks without values in a region have no distance.
+                if (i, j) in distances:
+                    sys.stdout.write(' %.3f' % distances[i, j])
+                else:
+                    sys.stdout.write('   -  ')
+            sys.stdout.write('   x\n')
+
     try:
         sys.stdout.write(''.join('%s: %s\n' % (name(i), track.name)
                                  for i, track in enumerate(tracks)))
     except IOError:
         pass
-    sys.stdout.write('\n   ')
-    sys.stdout.write(' '.join('   %s ' % name(i)
-                              for i in range(len(tracks))))
-    sys.stdout.write('\n')
-    sys.stdout.write(name(0) + '     x\n')
-    for i in range(1, len(tracks)):
-        sys.stdout.write('%s  ' % name(i))
-        for j in range(0, i):
-            sys.stdout.write(' %.3f' % distances[i, j])
-        sys.stdout.write('   x\n')
+
+    def write_matrices(distances, errors):
+        write_matrix(distances)
+        if errors is not None:
+            sys.stdout.write('\nStandard errors:\n')
+            write_matrix(errors)
+
+    if per_region:
+        for region in sorted(distances):
+            if distances[region]:
+                sys.stdout.write('\nRegion %s:\n' % region)
+                write_matrices(distances[region],
+                               None if errors is None else errors[region])
+    else:
+        write_matrices(distances, errors)
 
 
 def main():
@@ -284,14 +532,104 @@ def main():
     p.add_argument(
         'track', metavar='TRACK', type=argparse.FileType('r'),
         help='wiggle track')
+    p.add_argument(
+        '-z', '--zoom', dest='zoom', action='store_true',
+        help='include summaries at zoom levels of %s positions'
+        % ', '.join(str(level) for level in ZOOM_LEVELS))
+    p.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='index regions in this many parallel processes (default: '
+        '%(default)s)')
+    p.add_argument(
+        '-s', '--statistics', dest='statistics', action='store_true',
+        help='include mean, variance, and a quantile sketch of the values')
+    p.add_argument(
+        '--histogram', dest='histogram', metavar=('LOW', 'HIGH', 'BINS'),
+        nargs=3, type=float, help='include a histogram of the values in '
+        'BINS bins from LOW to HIGH')
 
     p = subparsers.add_parser(
-        'sort', help='sort wiggle track regions alphabetically',
+        'cache', help='build binary cache for wiggle track',
+        description=cache_track.__doc__.split('\n\n')[0])
+    p.set_defaults(func=cache_track)
+    p.add_argument(
+        'track', metavar='TRACK', type=argparse.FileType('r'),
+        help='wiggle track')
+
+    p = subparsers.add_parser(
+        'query', help='query positions in a region of a wiggle track',
+        description=query_track.__doc__.split('\n\n')[0])
+    p.set_defaults(func=query_track)
+    p.add_argument(
+        'track', metavar='TRACK', type=argparse.FileType('r'),
+        help='wiggle track')
+    p.add_argument(
+        'region', metavar='REGION', type=str, help='region to query')
+    p.add_argument(
+        'start', metavar='START', type=int,
+        help='first position to query (one-based)')
+    p.add_argument(
+        'end', metavar='END', type=int,
+        help='last position to query (one-based, including)')
+    p.add_argument(
+        '-n', '--name', dest='name', type=str,
+        help='name to use for result track, displayed to the left of the '
+        'track in the UCSC Genome Browser (default: Query of TRACK)')
+    p.add_argument(
+        '-d', '--description', dest='description', type=str,
+        help='description to use for result track, displayed as center label '
+        'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
+
+    p = subparsers.add_parser(
+        'extract', help='extract positions in intervals from a wiggle track',
+        description=extract_track.__doc__.split('\n\n')[0])
+    p.set_defaults(func=extract_track)
+    p.add_argument(
+        'track', metavar='TRACK', type=argparse.FileType('r'),
+        help='wiggle track')
+    p.add_argument(
+        '-b', '--bed', dest='bed', type=argparse.FileType('r'),
+        required=True, help='intervals in BED format')
+    p.add_argument(
+        '-n', '--name', dest='name', type=str,
+        help='name to use for result track, displayed to the left of the '
+        'track in the UCSC Genome Browser (default: Extract of TRACK)')
+    p.add_argument(
+        '-d', '--description', dest='description', type=str,
+        help='description to use for result track, displayed as center label '
+        'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
+
+    p = subparsers.add_parser(
+        'stats', help='summary statistics of a wiggle track in intervals',
+        description=stats_track.__doc__.split('\n\n')[0])
+    p.set_defaults(func=stats_track)
+    p.add_argument(
+        'track', metavar='TRACK', type=argparse.FileType('r'),
+        help='wiggle track')
+    p.add_argument(
+        '-b', '--bed', dest='bed', type=argparse.FileType('r'),
+        required=True, help='intervals in BED format')
+    add_output_arguments(p)
+
+    p = subparsers.add_parser(
+        'sort', help='sort wiggle track regions',
         description=sort_track.__doc__.split('\n\n')[0])
     p.set_defaults(func=sort_track)
     p.add_argument(
         'track', metavar='TRACK', type=argparse.FileType('r'),
         help='wiggle track')
+    g = p.add_mutually_exclusive_group()
+    g.add_argument(
+        '--natural-order', dest='natural_order', action='store_true',
+        help='order regions naturally (e.g., chr1, chr2, chr10) instead of '
+        'alphabetically')
+    g.add_argument(
+        '--order-file', dest='order_file', type=argparse.FileType('r'),
+        help='order regions as listed in the first column of this file '
+        '(e.g., a FASTA index or chromosome sizes file)')
+    add_format_arguments(p)
     p.add_argument(
         '-n', '--name', dest='name', type=str,
         help='name to use for result track, displayed to the left of the '
@@ -300,6 +638,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     p = subparsers.add_parser(
         'scale', help='scale values in a wiggle track',
@@ -311,6 +650,7 @@ def main():
     p.add_argument(
         '-f', '--factor', dest='factor', type=float, default=0.1,
         help='scaling factor to use (default: %(default)s)')
+    add_format_arguments(p)
     p.add_argument(
         '-n', '--name', dest='name', type=str,
         help='name to use for result track, displayed to the left of the '
@@ -319,6 +659,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     p = subparsers.add_parser(
         'fill', help='fill undefined positions in a wiggle track',
@@ -343,6 +684,7 @@ def main():
     p.add_argument(
         '-o', '--only-genome', dest='only_genome', action='store_true',
         help='only report positions in regions defined by the GENOME file')
+    add_format_arguments(p)
     p.add_argument(
         '-n', '--name', dest='name', type=str,
         help='name to use for result track, displayed to the left of the '
@@ -351,6 +693,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     p = subparsers.add_parser(
         'derivative', help='create derivative of a wiggle track',
@@ -373,6 +716,7 @@ def main():
         help='automatically set STEP to a value based on the first two '
         'positions in TRACK (default if METHOD is central and STEP is '
         'omitted)')
+    add_format_arguments(p)
     p.add_argument(
         '-n', '--name', dest='name', type=str,
         help='name to use for result track, displayed to the left of the '
@@ -381,6 +725,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     if plot is not None:
         p = subparsers.add_parser(
@@ -419,6 +764,10 @@ def main():
             '-c', '--columns', dest='columns', type=int, default=None,
             help='when plotting multiple tracks and/or regions, use this '
             'many columns (default: automatically chosen)')
+        p.add_argument(
+            '-b', '--bins', dest='bins', type=int, default=None,
+            help='plot mean values in this many bins per region, using zoom '
+            'levels from the index (default: plot all positions)')
         p.add_argument(
             '-o', '--output', dest='pdf', type=argparse.FileType('wb'),
             default=None, help='output PDF file')
@@ -442,6 +791,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     p = subparsers.add_parser(
         'merge', help='merge any number of wiggle tracks in various ways',
@@ -460,9 +810,23 @@ def main():
     p.add_argument(
         '-x', '--no-indices', dest='no_indices', action='store_true',
         help='assume tracks are sorted, don\'t force building indices')
+    p.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='merge regions in this many parallel processes (default: '
+        '%(default)s)')
+    g = p.add_mutually_exclusive_group()
+    g.add_argument(
+        '--natural-order', dest='natural_order', action='store_true',
+        help='order regions naturally (e.g., chr1, chr2, chr10) instead of '
+        'alphabetically')
+    g.add_argument(
+        '--order-file', dest='order_file', type=argparse.FileType('r'),
+        help='order regions as listed in the first column of this file '
+        '(e.g., a FASTA index or chromosome sizes file)')
     p.add_argument(
         'tracks', metavar='TRACK', nargs='+', type=argparse.FileType('r'),
         help='wiggle track')
+    add_format_arguments(p)
     p.add_argument(
         '-n', '--name', dest='name', type=str,
         help='name to use for result track, displayed to the left of the '
@@ -471,6 +835,7 @@ def main():
         '-d', '--description', dest='description', type=str,
         help='description to use for result track, displayed as center label '
         'in the UCSC Genome Browser (default: no description)')
+    add_output_arguments(p)
 
     # Todo: Add additional information on the metrics (using the epilog
     # argument of the subparser).
@@ -484,6 +849,22 @@ def main():
     p.add_argument(
         '-t', dest='threshold', type=float, default=None,
         help='threshold for noise filter (default: no noise filter)')
+    p.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='calculate regions in this many parallel processes (default: '
+        '%(default)s)')
+    p.add_argument(
+        '-r', '--per-region', dest='per_region', action='store_true',
+        help='calculate a distance matrix for every region, with weights '
+        'per region')
+    p.add_argument(
+        '-s', '--state', dest='state', type=str, metavar='FILE',
+        help='store intermediate results in this file and reuse them for '
+        'pairs of unchanged tracks (e.g., after adding tracks)')
+    p.add_argument(
+        '--sample', dest='sample', type=int, metavar='K',
+        help='approximate the distances using only every K-th window of '
+        'positions with data, and show their standard errors')
     p.add_argument(
         'tracks', metavar='TRACK', nargs='+', type=argparse.FileType('r'),
         help='wiggle track')
@@ -493,7 +874,7 @@ def main():
     try:
         args.func(**dict((k, v) for k, v in vars(args).items()
                          if k not in ('func', 'subcommand')))
-    except IOError as e:
+    except (IOError, OrderError, ReadError, ValueError) as e:
         abort(str(e))
 
 
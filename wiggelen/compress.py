@@ -0,0 +1,485 @@
+"""
+Read and write compressed wiggle tracks.
+
+Tracks compressed with gzip are decompressed transparently by
+:func:`wiggelen.walk`, :func:`wiggelen.index.index`,
+:func:`wiggelen.query.query`, and :func:`wiggelen.arrays.walk_arrays`.
+
+Tracks compressed with BGZF (e.g., using ``bgzip`` from htslib) are read
+with random access. BGZF is a series of gzip members (blocks) of at most
+64 KiB of uncompressed data. The position in such a track is a virtual
+offset [#]_, where the upper 48 bits are the byte offset of the block in the
+compressed file and the lower 16 bits are the offset in the uncompressed
+block. Since these are what `tell` returns for BGZF tracks, the index (see
+:mod:`wiggelen.index`) and checkpoints (see :mod:`wiggelen.query`) simply
+contain virtual offsets and jumping to a region only decompresses the blocks
+that are needed.
+
+Other gzip compressed tracks can only be read sequentially. Their offsets are
+in the uncompressed data, and jumping back means decompressing from the start
+of the track again.
+
+Tracks can be written with BGZF compression using :class:`BgzfWriter`,
+optionally compressing blocks in parallel threads. If the index of the
+written track is written (e.g., by :func:`wiggelen.write`), its offsets are
+converted to virtual offsets, so the result can be read with random access
+right away. Since BGZF is a valid gzip file, it can be decompressed with any
+gzip implementation.
+
+.. [#] Li, H., Handsaker, B., Wysoker, A., Fennell, T., Ruan, J., Homer, N.,
+   Marth, G., Abecasis, G., Durbin, R. The Sequence Alignment/Map format and
+   SAMtools. Bioinformatics, 25(16):2078-9, 2009.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from collections import deque
+import io
+from multiprocessing.pool import ThreadPool
+import struct
+import zlib
+
+
+#: Magic bytes identifying gzip files.
+GZIP_MAGIC = b'\x1f\x8b'
+
+#: Number of compressed bytes to read at once from gzip files.
+GZIP_CHUNK_SIZE = 1 << 16
+
+#: Number of uncompressed bytes per BGZF block when writing (as used by
+#: htslib, leaving room for incompressible data in a block of 64 KiB).
+BGZF_BLOCK_SIZE = 0xff00
+
+
+def _binary(track):
+    # Python 3 compatibility.
+    return getattr(track, 'buffer', track)
+
+
+def _text(data):
+    # Python 3 compatibility. We decode as Latin-1 so that the length of the
+    # text is the same as that of the data.
+    if isinstance(data, str):
+        return data
+    return data.decode('latin-1')
+
+
+def _bytes(text):
+    # Python 3 compatibility.
+    if isinstance(text, bytes):
+        return text
+    return text.encode('latin-1')
+
+
+def _header(track, size):
+    # Read the first bytes of the track without changing its position.
+    data = _binary(track)
+    try:
+        position = data.tell()
+        data.seek(0)
+        header = data.read(size)
+        data.seek(position)
+    except (AttributeError, IOError, ValueError):
+        # Streams can only be peeked at from their current position.
+        try:
+            header = data.peek(size)[:size]
+        except (AttributeError, IOError, ValueError):
+            return b''
+    if not isinstance(header, bytes):
+        return b''
+    return header
+
+
+def is_gzip(track):
+    """
+    Check if a track is compressed with gzip (including BGZF).
+
+    :arg track: Track.
+    :type track: file
+
+    :return: Whether or not `track` is compressed with gzip.
+    :rtype: bool
+    """
+    return _header(track, 2) == GZIP_MAGIC
+
+
+def is_bgzf(track):
+    """
+    Check if a track is compressed with BGZF.
+
+    :arg track: Track.
+    :type track: file
+
+    :return: Whether or not `track` is compressed with BGZF.
+    :rtype: bool
+    """
+    header = _header(track, 18)
+    return (len(header) == 18 and header[:2] == GZIP_MAGIC and
+            bool(ord(header[3:4]) & 4) and header[12:14] == b'BC')
+
+
+def decompress(track):
+    """
+    Return a file-like object with the decompressed track if it is
+    compressed with gzip, or the track itself otherwise.
+
+    :arg track: Track.
+    :type track: file
+
+    :return: Decompressed track.
+    :rtype: file
+    """
+    if isinstance(track, _Reader):
+        return track
+    track = _peekable(track)
+    # Streams that cannot seek are read sequentially, also if they are
+    # compressed with BGZF.
+    if is_bgzf(track) and _seekable(track):
+        return BgzfReader(track)
+    if is_gzip(track):
+        return GzipReader(track)
+    return track
+
+
+def _seekable(track):
+    try:
+        _binary(track).tell()
+    except (AttributeError, IOError, ValueError):
+        return False
+    return True
+
+
+def _peekable(track):
+    # Python 2 compatibility. Streams that cannot seek (e.g., standard input)
+    # can only be peeked at if they are buffered, so we read them through a
+    # buffered reader. This must be done before anything is read from them.
+    if hasattr(_binary(track), 'peek') or _seekable(track):
+        return track
+    try:
+        return _Buffered(track)
+    except (AttributeError, IOError, ValueError):
+        return track
+
+
+class _Buffered(object):
+    # Buffered reader of a stream with the name of the stream.
+    def __init__(self, track):
+        self.name = getattr(track, 'name', None)
+        # Keep a reference to the track, closing it would close the file
+        # descriptor.
+        self._track = track
+        self._buffer = io.open(track.fileno(), 'rb', closefd=False)
+
+    def __getattr__(self, name):
+        return getattr(self._buffer, name)
+
+    def __iter__(self):
+        return iter(self._buffer)
+
+
+class _Reader(object):
+    # Read-only text file interface to data that is decompressed in blocks.
+    # Subclasses implement `_load`, `tell`, and `seek`.
+    def __init__(self, track):
+        self.name = getattr(track, 'name', None)
+        # Keep a reference to the track, closing it would close `_file`.
+        self._track = track
+        self._file = _binary(track)
+        self._data = ''
+        self._position = 0
+
+    def _load(self):
+        # Load the next block of decompressed data in `self._data` and set
+        # the position to its start. Return `False` if there is no more data.
+        raise NotImplementedError
+
+    def read(self, size=-1):
+        parts = []
+        while size:
+            if self._position >= len(self._data) and not self._load():
+                break
+            if size < 0:
+                part = self._data[self._position:]
+            else:
+                part = self._data[self._position:self._position + size]
+                size -= len(part)
+            self._position += len(part)
+            parts.append(part)
+        return ''.join(parts)
+
+    def readline(self):
+        parts = []
+        while True:
+            if self._position >= len(self._data) and not self._load():
+                break
+            end = self._data.find('\n', self._position) + 1
+            if end:
+                parts.append(self._data[self._position:end])
+                self._position = end
+                break
+            parts.append(self._data[self._position:])
+            self._position = len(self._data)
+        return ''.join(parts)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    # Python 3 compatibility.
+    __next__ = next
+
+    def close(self):
+        self._file.close()
+
+
+class GzipReader(_Reader):
+    """
+    Read a gzip compressed track sequentially.
+
+    Offsets given by `tell` and accepted by `seek` are offsets in the
+    decompressed track. Seeking backwards decompresses the track from the
+    start again.
+
+    :arg track: Gzip compressed track.
+    :type track: file
+    """
+    def __init__(self, track):
+        _Reader.__init__(self, track)
+        try:
+            self._file.tell()
+            self._seekable = True
+        except (AttributeError, IOError, ValueError):
+            self._seekable = False
+        self._restart()
+
+    def _restart(self):
+        # Start decompressing from the start of the track.
+        if self._seekable:
+            self._file.seek(0)
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._start = 0
+        self._data = ''
+        self._position = 0
+
+    def _load(self):
+        data = b''
+        while not data:
+            compressed = self._file.read(GZIP_CHUNK_SIZE)
+            if not compressed:
+                data = self._decompressor.flush()
+                if not data:
+                    return False
+                break
+            data = self._decompressor.decompress(compressed)
+            # A gzip file can consist of several members.
+            while self._decompressor.unused_data:
+                compressed = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self._decompressor.decompress(compressed)
+        self._start += len(self._data)
+        self._data = _text(data)
+        self._position = 0
+        return True
+
+    def tell(self):
+        if not self._seekable:
+            raise IOError('Gzip compressed stream does not support tell')
+        return self._start + self._position
+
+    def seek(self, offset):
+        if offset < self._start:
+            if not self._seekable:
+                raise IOError('Gzip compressed stream does not support seek')
+            self._restart()
+        while offset > self._start + len(self._data) and self._load():
+            pass
+        self._position = min(offset - self._start, len(self._data))
+
+
+class BgzfReader(_Reader):
+    """
+    Read a BGZF compressed track with random access.
+
+    Offsets given by `tell` and accepted by `seek` are virtual offsets.
+
+    :arg track: BGZF compressed track.
+    :type track: file
+    """
+    #: Offsets are virtual offsets.
+    virtual = True
+
+    def __init__(self, track):
+        _Reader.__init__(self, track)
+        self._block = 0
+        self._next = 0
+        self.seek(0)
+
+    def _load(self):
+        data = ''
+        while not data:
+            self._file.seek(self._next)
+            header = self._file.read(12)
+            if len(header) < 12:
+                return False
+            if header[:2] != GZIP_MAGIC:
+                raise IOError('Invalid BGZF block at offset %d' % self._next)
+            extra_size = struct.unpack('<H', header[10:12])[0]
+            extra = self._file.read(extra_size)
+            block_size = None
+            i = 0
+            while i + 4 <= len(extra):
+                subfield_size = struct.unpack('<H', extra[i + 2:i + 4])[0]
+                if extra[i:i + 2] == b'BC':
+                    block_size = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+                i += 4 + subfield_size
+            if block_size is None:
+                raise IOError('Invalid BGZF block at offset %d' % self._next)
+            compressed = self._file.read(block_size - extra_size - 12)
+            data = _text(zlib.decompress(compressed[:-8], -zlib.MAX_WBITS))
+            self._block = self._next
+            self._next += block_size
+        self._data = data
+        self._position = 0
+        return True
+
+    def tell(self):
+        if self._position >= len(self._data):
+            return self._next << 16
+        return self._block << 16 | self._position
+
+    def seek(self, offset):
+        block, position = offset >> 16, offset & 0xffff
+        if block != self._block or not self._data:
+            self._next = block
+            self._data = ''
+            self._position = 0
+            if not self._load():
+                return
+        self._position = position
+
+
+def _compress_block(data, level=6):
+    # Compress data as one BGZF block.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) + 26 > 1 << 16:
+        # Incompressible data, store it without compression.
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                         ord('B'), ord('C'), 2, len(compressed) + 25)
+    return (header + compressed +
+            struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+class BgzfWriter(object):
+    """
+    Write a track with BGZF compression.
+
+    Blocks are compressed as soon as :data:`BGZF_BLOCK_SIZE` bytes are
+    written. The track is completed by closing the writer, which also closes
+    the underlying file.
+
+    :arg track: Writable file handle.
+    :type track: file
+    :arg threads: Number of threads to compress blocks in. Compressing
+        releases the global interpreter lock, so this uses more than one
+        processor.
+    :type threads: int
+    :arg level: Compression level (1 to 9).
+    :type level: int
+
+    Functions in the `on_close` list are called (without arguments) after the
+    track is completed, e.g., to write its index.
+
+    Example::
+
+        >>> writer = BgzfWriter(open('a.wig.gz', 'wb'), threads=4)
+        >>> write(walk(open('a.wig')), track=writer)
+        >>> writer.close()
+    """
+    def __init__(self, track, threads=1, level=6):
+        self.name = getattr(track, 'name', None)
+        self._file = _binary(track)
+        self._level = level
+        self._buffer = []
+        self._buffered = 0
+        # Compressed offsets of the written blocks, and of the next block.
+        self._blocks = [0]
+        self._pending = deque()
+        self._threads = threads
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self.on_close = []
+
+    def _compress(self, data):
+        # Compress the data as the next block.
+        if self._pool is None:
+            self._write_block(_compress_block(data, self._level))
+            return
+        self._pending.append(self._pool.apply_async(_compress_block,
+                                                    (data, self._level)))
+        # Limit the number of blocks in memory.
+        self._drain(2 * self._threads)
+
+    def _drain(self, pending=0):
+        # Write compressed blocks until at most `pending` are left.
+        while len(self._pending) > pending:
+            self._write_block(self._pending.popleft().get())
+
+    def _write_block(self, block):
+        self._file.write(block)
+        self._blocks.append(self._blocks[-1] + len(block))
+
+    def write(self, text):
+        self._buffer.append(_bytes(text))
+        self._buffered += len(text)
+        if self._buffered < BGZF_BLOCK_SIZE:
+            return
+        data = b''.join(self._buffer)
+        end = len(data) - len(data) % BGZF_BLOCK_SIZE
+        for start in range(0, end, BGZF_BLOCK_SIZE):
+            self._compress(data[start:start + BGZF_BLOCK_SIZE])
+        self._buffer = [data[end:]]
+        self._buffered = len(data) - end
+
+    def virtual_offset(self, offset):
+        """
+        Convert an offset in the uncompressed track to a virtual offset.
+
+        :arg offset: Offset in the uncompressed track, at most the number of
+            bytes written.
+        :type offset: int
+
+        :return: Virtual offset.
+        :rtype: int
+        """
+        block, position = divmod(offset, BGZF_BLOCK_SIZE)
+        if block >= len(self._blocks):
+            self._drain()
+        return self._blocks[block] << 16 | position
+
+    def close(self):
+        """
+        Compress any remaining data, write the end-of-file marker block, and
+        close the underlying file.
+        """
+        if self._buffered:
+            self._compress(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._drain()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        self._file.write(_compress_block(b''))
+        self._file.close()
+        for function in self.on_close:
+            function()
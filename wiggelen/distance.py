@@ -20,6 +20,16 @@ Metric ``d``: :math:`\\frac{|x - y|}{\\text{max}(x, y) + 1}`
 .. note:: These metrics are ill-defined on the interval (0, 1) so we scale all
        values if necessary.
 
+If :mod:`numpy` is installed, the predefined metrics are computed for all
+pairs of tracks at once using array expressions. The tracks are decoded into
+blocks of arrays (see :mod:`wiggelen.arrays`) and aligned on stretches of
+positions where none of the values change, so the metrics are computed once
+per stretch instead of once per position.
+
+For a quick comparison of many large tracks, the distances can be
+approximated from a sample of windows of positions, with an estimate of the
+error (see the `sample` argument of :func:`distance`).
+
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 .. moduleauthor:: Jeroen Laros <j.f.j.laros@lumc.nl>
 
@@ -31,11 +41,38 @@ from __future__ import division
 
 from collections import defaultdict
 import itertools
+import math
+import multiprocessing
+import os
 import sys
 
 from .wiggle import walk
-from .index import Field, index
+from .index import Field, ReadError, _signature, _stat, _valid, index
 from .merge import merge
+from .arrays import walk_arrays
+from .bigwig import is_bigwig
+from .query import query
+
+# Python 3 compatibility.
+try:
+    from urllib import quote, unquote
+except ImportError:
+    from urllib.parse import quote, unquote
+
+# Vectorized computation only if NumPy is installed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Width of the windows of positions sampled by an approximate distance
+#: calculation (see :func:`distance`).
+SAMPLE_WINDOW = 10000
+
+
+# Number of metric values computed at once by the vectorized computation.
+_VECTOR_SIZE = 1 << 20
 
 
 # Todo: Give these metrics a name.
@@ -54,6 +91,15 @@ metrics = {'a': _metric_a,
            'd': _metric_d}
 
 
+# Array expressions for the predefined metrics.
+_vectorized_metrics = {
+    _metric_a: lambda x, y: numpy.abs(x - y) / ((x + 1) * (y + 1)),
+    _metric_b: lambda x, y: numpy.abs(x - y) / (x + y + 1),
+    _metric_c: lambda x, y: ((numpy.maximum(x, y) * numpy.abs(x - y))
+                             / (((x * x) + 1) * ((y * y) + 1))),
+    _metric_d: lambda x, y: numpy.abs(x - y) / (numpy.maximum(x, y) + 1)}
+
+
 def normalize(*values):
     """
     Normalize values relative to the smallest value.
@@ -113,6 +159,417 @@ def matrix(size, reflexive=False, symmetric=False):
                             range(i + 1, size if symmetric else 0))]
 
 
+def _track_blocks(track, regions=None, window=None):
+    # Walk over (region, positions, spans, values) blocks of arrays in the
+    # order of a walk with forced index, or of a (region, start, end) window
+    # of positions.
+    if window is not None:
+        runs = query(track, *window, force_index=True, runs=True)
+    elif is_bigwig(track):
+        runs = walk(track, force_index=True, runs=True, regions=regions)
+    else:
+        for block in walk_arrays(track, force_index=True, regions=regions):
+            yield block
+        return
+    for region, runs in itertools.groupby(runs, lambda run: run[0]):
+        _, starts, ends, values = zip(*runs)
+        positions = numpy.array(starts, dtype='i8')
+        spans = numpy.array(ends, dtype='i8') - positions + 1
+        yield region, positions, spans, numpy.array(values, dtype='f8')
+
+
+def _segments(runs, size):
+    # Split (positions, ends, values) arrays of runs per track into segments
+    # where none of the values change. Return the segment lengths and a
+    # matrix of values with a column per track (0 if undefined), omitting
+    # segments without values.
+    borders = [a for positions, ends, _ in runs for a in (positions, ends)
+               if len(a)]
+    if not borders:
+        return numpy.zeros(0, dtype='i8'), numpy.zeros((0, size))
+
+    borders = numpy.unique(numpy.concatenate(borders))
+    starts = borders[:-1]
+    values = numpy.zeros((len(starts), size))
+
+    for i, (positions, ends, track_values) in enumerate(runs):
+        if not len(positions):
+            continue
+        j = numpy.searchsorted(positions, starts, side='right') - 1
+        inside = j >= 0
+        j = numpy.maximum(j, 0)
+        inside &= starts < ends[j]
+        values[inside, i] = track_values[j[inside]]
+
+    defined = values.any(axis=1)
+    return numpy.diff(borders)[defined], values[defined]
+
+
+def _align(tracks, regions=None, window=None):
+    # Walk over the blocks of all tracks simultaneously and yield aligned
+    # segments (see `_segments`). Within a region, blocks are consumed up to
+    # the smallest position any track has data for.
+    size = len(tracks)
+    blocks = [_track_blocks(track, regions, window) for track in tracks]
+    heads = [next(b, None) for b in blocks]
+
+    while any(head is not None for head in heads):
+        region = min(head[0] for head in heads if head is not None)
+        empty = numpy.zeros(0, dtype='i8')
+        pending = [(empty, empty, empty)] * size
+
+        while True:
+            active = []
+            for i in range(size):
+                if not len(pending[i][0]):
+                    head = heads[i]
+                    if head is None or head[0] != region:
+                        continue
+                    _, positions, spans, values = head
+                    pending[i] = positions, positions + spans, values
+                    heads[i] = next(blocks[i], None)
+                active.append(i)
+
+            if not active:
+                break
+
+            # Runs ending after this border are split.
+            border = min(pending[i][1][-1] for i in active)
+            runs = []
+            for i in range(size):
+                positions, ends, values = pending[i]
+                k = numpy.searchsorted(positions, border)
+                runs.append((positions[:k], numpy.minimum(ends[:k], border),
+                             values[:k]))
+                if k and ends[k - 1] > border:
+                    pending[i] = (numpy.concatenate([[border], positions[k:]]),
+                                  ends[k - 1:], values[k - 1:])
+                else:
+                    pending[i] = positions[k:], ends[k:], values[k:]
+
+            yield _segments(runs, size)
+
+
+def _noise_filter(threshold):
+    # Noise filter for the given threshold.
+    if threshold:
+        return lambda value: max(value - threshold, 0)
+    return lambda value: value
+
+
+def _aggregate(tracks, comparisons, metric, scale, threshold, regions=None,
+               window=None):
+    # Aggregate the metric over all positions, per comparison. Return the
+    # totals and the number of positions with a value per comparison.
+    noise_filter = _noise_filter(threshold)
+
+    def merger(values):
+        results = {}
+        for left, right, weight_left, weight_right in comparisons:
+            value_left, value_right = values[left], values[right]
+            if value_left is None and value_right is None:
+                result = None
+            else:
+                x = (weight_left * scale * noise_filter(value_left)
+                     if value_left else 0)
+                y = (weight_right * scale * noise_filter(value_right)
+                     if value_right else 0)
+                result = metric(x, y) if x or y else None
+            results[left, right] = result
+        return results
+
+    # Indexed walkers.
+    if window is None:
+        walkers = [walk(track, force_index=True, regions=regions)
+                   for track in tracks]
+    else:
+        walkers = [query(track, *window, force_index=True)
+                   for track in tracks]
+
+    totals = defaultdict(lambda: 0)
+    counts = defaultdict(lambda: 0)
+    for _, _, values in merge(*walkers, merger=merger):
+        for comparison, value in values.items():
+            if value is not None:
+                totals[comparison] += value
+                counts[comparison] += 1
+    return totals, counts
+
+
+def _aggregate_arrays(tracks, comparisons, metric, scale, threshold,
+                      regions=None, window=None):
+    # Aggregate the metric over all positions for all comparisons at once,
+    # with the same result as `_aggregate`.
+    left, right, weight_left, weight_right = [numpy.array(c) for c in
+                                              zip(*comparisons)]
+    totals = numpy.zeros(len(comparisons))
+    counts = numpy.zeros(len(comparisons), dtype='i8')
+    rows = max(1, _VECTOR_SIZE // len(comparisons))
+
+    for lengths, values in _align(tracks, regions, window):
+        if threshold:
+            values = numpy.maximum(values - threshold, 0)
+        values *= scale
+        for i in range(0, len(lengths), rows):
+            x = values[i:i + rows, left] * weight_left
+            y = values[i:i + rows, right] * weight_right
+            totals += numpy.dot(lengths[i:i + rows], metric(x, y))
+            counts += numpy.dot(lengths[i:i + rows], (x != 0) | (y != 0))
+
+    comparisons = [(l, r) for l, r, _, _ in comparisons]
+    return (dict(zip(comparisons, totals.tolist())),
+            dict((comparison, count) for comparison, count
+                 in zip(comparisons, counts.tolist()) if count))
+
+
+# Distance options used by `_distance_region`, set by `_init_distance_region`
+# (in worker processes).
+_region_options = {}
+
+
+def _init_distance_region(metric, threshold, vectorized):
+    _region_options['metric'] = metric
+    _region_options['threshold'] = threshold
+    _region_options['vectorized'] = vectorized
+
+
+def _distance_region(task):
+    # Aggregate the metric over one region for a block of comparisons and
+    # return the totals and counts.
+    region, filenames, comparisons, scale = task
+    tracks = _open_tracks(filenames, comparisons)
+    try:
+        return _aggregate_tracks(tracks, comparisons,
+                                 _region_options['metric'], scale,
+                                 _region_options['threshold'],
+                                 _region_options['vectorized'],
+                                 regions=[region])
+    finally:
+        _close_tracks(tracks)
+
+
+def _distance_windows(task):
+    # Aggregate the metric over windows of positions and return the totals
+    # and counts per window.
+    windows, filenames, comparisons, scale = task
+    tracks = _open_tracks(filenames, comparisons)
+    try:
+        return [_aggregate_tracks(tracks, comparisons,
+                                  _region_options['metric'], scale,
+                                  _region_options['threshold'],
+                                  _region_options['vectorized'],
+                                  window=window)
+                for window in windows]
+    finally:
+        _close_tracks(tracks)
+
+
+# Open only the tracks in the comparisons (others are `None`).
+def _open_tracks(filenames, comparisons):
+    tracks = [None] * len(filenames)
+    for comparison in comparisons:
+        for i in comparison[:2]:
+            if tracks[i] is None:
+                tracks[i] = open(filenames[i])
+    return tracks
+
+
+def _close_tracks(tracks):
+    for track in tracks:
+        if track is not None:
+            track.close()
+
+
+def _aggregate_tracks(tracks, comparisons, metric, scale, threshold,
+                      vectorized, regions=None, window=None):
+    # Aggregate the metric with array expressions if possible. Only the
+    # tracks in the comparisons are walked.
+    if not comparisons:
+        return {}, {}
+
+    used = sorted(set(c[0] for c in comparisons) |
+                  set(c[1] for c in comparisons))
+    positions = dict((track, i) for i, track in enumerate(used))
+    tracks = [tracks[track] for track in used]
+    comparisons = [(positions[left], positions[right], weight_left,
+                    weight_right)
+                   for left, right, weight_left, weight_right in comparisons]
+
+    if vectorized and numpy is not None and metric in _vectorized_metrics:
+        totals, counts = _aggregate_arrays(tracks, comparisons,
+                                           _vectorized_metrics[metric],
+                                           scale, threshold, regions, window)
+    else:
+        totals, counts = _aggregate(tracks, comparisons, metric, scale,
+                                    threshold, regions, window)
+
+    return (dict(((used[left], used[right]), total)
+                 for (left, right), total in totals.items()),
+            dict(((used[left], used[right]), count)
+                 for (left, right), count in counts.items()))
+
+
+def _windows(indices, regions, width):
+    # Sorted list of (region, start, end) windows of `width` positions with
+    # data in any of the tracks, from the zoom level summaries in their
+    # indices.
+    windows = set()
+    for idx in indices:
+        for region in regions:
+            bins = idx.get(region, {}).get('zoom', {}).get(width, {})
+            windows.update((region, b) for b in bins)
+    return [(region, b * width + 1, (b + 1) * width)
+            for region, b in sorted(windows)]
+
+
+def _estimate(comparisons, samples, fraction):
+    # Estimate the distance per comparison from the totals and counts in a
+    # sample of windows, with its standard error. We use the ratio estimator
+    # of the total over the count, scaled by the sampled fraction of windows.
+    distances, errors = {}, {}
+    size = len(samples)
+    for left, right, _, _ in comparisons:
+        comparison = left, right
+        totals = [t.get(comparison, 0) for t, _ in samples]
+        counts = [c.get(comparison, 0) for _, c in samples]
+        total, count = sum(totals), sum(counts)
+        if not count:
+            continue
+        distances[comparison] = (total / fraction) / (count / fraction + 1)
+        if fraction == 1:
+            errors[comparison] = 0.0
+        elif size < 2:
+            errors[comparison] = float('nan')
+        else:
+            ratio = total / count
+            variance = (sum((t - ratio * c) ** 2
+                            for t, c in zip(totals, counts)) / (size - 1))
+            errors[comparison] = (math.sqrt((1 - fraction) * variance / size)
+                                  / (count / size))
+    return distances, errors
+
+
+def _read_state(filename, metric, threshold):
+    # Read the signatures of tracks and the (scale, total, count) of pairs of
+    # tracks from a distance state file. The pairs are indexed by region
+    # (`None` for entire tracks) and the names of both tracks in sorted
+    # order. The state is empty if the file does not exist.
+    tracks, pairs = {}, {}
+    if not os.path.exists(filename):
+        return tracks, pairs
+
+    with open(filename) as f:
+        try:
+            for line in f:
+                entry = dict((key, unquote(value)) for key, value in
+                             (d.split('=', 1)
+                              for d in line.rstrip('\n').split(',')))
+                if 'metric' in entry:
+                    if ((entry['metric'], entry['threshold']) !=
+                        (metric, _serialize_threshold(threshold))):
+                        raise ReadError('Distance state file %s was '
+                                        'calculated with metric %s and '
+                                        'threshold %s'
+                                        % (filename, entry['metric'],
+                                           entry['threshold']))
+                elif 'track' in entry:
+                    tracks[entry['track']] = (int(entry['size']),
+                                              float(entry['mtime']),
+                                              int(entry['checksum']))
+                else:
+                    region = entry['region']
+                    pairs[None if region == '_all' else region,
+                          entry['left'], entry['right']] = (
+                        float(entry['scale']), float(entry['total']),
+                        int(entry['count']))
+        except (KeyError, ValueError):
+            raise ReadError('Could not parse distance state file %s'
+                            % filename)
+    return tracks, pairs
+
+
+def _write_state(filename, metric, threshold, tracks, pairs):
+    # Write the signatures of tracks and the (scale, total, count) of pairs of
+    # tracks to a distance state file (see `_read_state`). Track names and
+    # regions are escaped, so they cannot clash with the separators.
+    with open(filename, 'w') as f:
+        f.write('metric=%s,threshold=%s\n'
+                % (quote(metric), _serialize_threshold(threshold)))
+        for name, signature in sorted(tracks.items()):
+            f.write('track=%s,size=%d,mtime=%r,checksum=%d\n'
+                    % ((quote(name),) + signature))
+        for (region, left, right), (scale, total, count) in sorted(
+                ((('_all' if region is None else region, left, right),
+                  value) for (region, left, right), value in pairs.items())):
+            f.write('region=%s,left=%s,right=%s,scale=%r,total=%r,count=%d\n'
+                    % (quote(region), quote(left), quote(right),
+                       float(scale), total, count))
+
+
+# Threshold as written in a distance state file.
+def _serialize_threshold(threshold):
+    return repr(float(threshold)) if threshold else 'None'
+
+
+def _comparisons(summaries, field_suffix=''):
+    # Create a list of comparisons for all pairs of tracks, where each
+    # comparison is a tuple of (left, right, weight_left, weight_right), and
+    # the scale of the values, from the index summaries of the tracks.
+
+    # Our metrics are undifined on the (0, 1) interval, so if the positive
+    # minimum over all tracks is < 1 we upscale everything.
+    min_value = min(summary.get('posmin' + field_suffix, sys.float_info.max)
+                    for summary in summaries)
+    scale = 1 / min_value if 0 < min_value < 1 else 1
+
+    # Based on the sums of all values in each track we define weights.
+    sums = [summary.get('sum' + field_suffix, 0) for summary in summaries]
+    comparisons = []
+    for left, right in matrix(len(summaries)):
+        weight_right, weight_left = normalize(sums[left], sums[right])
+        comparisons.append( (left, right, weight_left, weight_right) )
+
+    return comparisons, scale
+
+
+def _distance_sample(tracks, plans, indices, regions, sample, sample_window,
+                     per_region, metric, threshold, vectorized, jobs):
+    # Approximate the distances for the plans (see `distance`) in a sample of
+    # windows.
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_distance_region,
+                                    (metric, threshold, vectorized))
+
+    matrices, errors = {}, {}
+    try:
+        for key, comparisons, scale in plans:
+            windows = _windows(indices, regions if key is None else [key],
+                               sample_window)
+            sampled = windows[::sample]
+            if pool is None:
+                samples = [_aggregate_tracks(tracks, comparisons, metric,
+                                             scale, threshold, vectorized,
+                                             window=window)
+                           for window in sampled]
+            else:
+                tasks = [(sampled[i::jobs], [track.name for track in tracks],
+                          comparisons, scale) for i in range(jobs)]
+                samples = [s for samples in pool.map(_distance_windows, tasks)
+                           for s in samples]
+            matrices[key], errors[key] = _estimate(
+                comparisons, samples,
+                len(sampled) / len(windows) if windows else 1)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if per_region:
+        return matrices, errors
+    return matrices[None], errors[None]
+
+
 def distance(*tracks, **options):
     """
     Calculate the pairwise distances between wiggle tracks.
@@ -123,24 +580,71 @@ def distance(*tracks, **options):
     :type merger: function(float, float -> float)
     :arg threshold: Threshold for noise filter (default: no noise filter)
     :type threshold: float
+    :arg vectorized: Use array expressions if :mod:`numpy` is installed and
+        `metric` is one of the predefined metrics (default: `True`).
+    :type vectorized: bool
+    :arg jobs: Number of processes to aggregate regions in (default: 1, which
+        aggregates all regions in the current process). With more processes,
+        every region is aggregated separately and if there are fewer regions
+        than processes, the pairs of tracks are also split over the
+        processes. The tracks must be regular files in this case, since they
+        are opened again by the processes.
+    :type jobs: int
+    :arg per_region: Calculate a distance matrix for every region, with the
+        weights and the scale of the values defined per region (default:
+        `False`). Every region is still read only once.
+    :type per_region: bool
+    :arg state: Filename of a distance state file (default: no state file).
+        If given, the totals and counts of all pairs of tracks are stored in
+        this file, and pairs of unchanged tracks (regular files only) that
+        are already in the file are not calculated again. This makes adding
+        a few tracks to a large set cheap. Pairs are only reused with the
+        same scale of the values (the scale changes if a new track has a
+        smaller positive value below 1). A state file calculated with another
+        metric or threshold, or one that cannot be parsed, results in a
+        :class:`wiggelen.index.ReadError`.
+    :type state: str
+    :arg sample: Approximate the distances by calculating them only in every
+        `sample`-th window of :data:`SAMPLE_WINDOW` positions (default: no
+        approximation). Only windows with data in any of the tracks are
+        counted and they are read using random access (see
+        :mod:`wiggelen.query`). The result is a tuple of the approximate
+        distances and their estimated standard errors.
+    :type sample: int
+    :arg sample_window: Width of the sampled windows (default:
+        :data:`SAMPLE_WINDOW`).
+    :type sample_window: int
 
     :return: Pairwise distances between `tracks` as a mapping from
-        coordinates in the distance matrix to their values.
+        coordinates in the distance matrix to their values. With
+        `per_region`, a mapping from regions to these distance matrices.
+        With `sample`, a tuple of these and the standard errors in the same
+        form.
     :rtype: dict((int, int), float)
 
+    .. note:: On platforms where new processes are not forked, `metric` must
+        be picklable.
+
+    .. note:: A state file can only be used with the predefined metrics and
+        not with `sample`.
+
     .. todo:: Check where this goes wrong if we cannot .seek() the tracks.
-    .. todo:: Calculate weights per region instead of over the entire track.
     """
     metric = options.get('metric', metrics['a'])
     threshold = options.get('threshold')
+    vectorized = options.get('vectorized', True)
+    jobs = options.get('jobs', 1)
+    per_region = options.get('per_region', False)
+    state = options.get('state')
+    sample = options.get('sample')
+    sample_window = options.get('sample_window', SAMPLE_WINDOW)
 
-    # We construct a list of comparisons for the merger, where each comparison
-    # is a tuple of (left, right, weight_left, weight_right).
-    comparisons = []
+    if sample and state is not None:
+        raise ValueError('Distance state cannot be used with sampling')
 
     if threshold:
         field_suffix = '-threshold-%s' % str(threshold)
-        noise_filter = lambda value: max(value - threshold, 0)
+        noise_filter = _noise_filter(threshold)
 
         def sum_func(acc, value, span):
             return acc + noise_filter(value) * span
@@ -151,59 +655,138 @@ def distance(*tracks, **options):
                 return min(acc, noise_filter(value))
             return acc
 
-        fields = [Field('sum' + field_suffix, float, 0, sum_func),
+        fields = [Field('sum' + field_suffix, float, 0, sum_func,
+                        lambda acc, other: acc + other),
                   Field('posmin' + field_suffix, float, sys.float_info.max,
-                        min_func)]
+                        min_func, min)]
 
     else:
         field_suffix = ''
-        noise_filter = lambda value: value
         fields = []
 
-    summaries = [index(track, force=True, fields=fields)[0]['_all']
-                 for track in tracks]
-
-    # Our metrics are undifined on the (0, 1) interval, so if the positive
-    # minimum over all tracks is < 1 we upscale everything.
-    min_value = min(summary['posmin' + field_suffix] for summary in summaries)
-    scale = 1 / min_value if 0 < min_value < 1 else 1
-
-    # Based on the sums of all values in each track we define weights.
-    sums = [summary['sum' + field_suffix] for summary in summaries]
-    for left, right in matrix(len(tracks)):
-        weight_right, weight_left = normalize(sums[left], sums[right])
-        comparisons.append( (left, right, weight_left, weight_right) )
-
-    # The merger returns a matrix of values, one for each pairwise comparison.
-    def merger(values):
-        results = {}
-        for left, right, weight_left, weight_right in comparisons:
-            value_left, value_right = values[left], values[right]
-            if value_left is None and value_right is None:
-                result = None
-            else:
-                x = (weight_left * scale * noise_filter(value_left)
-                     if value_left else 0)
-                y = (weight_right * scale * noise_filter(value_right)
-                     if value_right else 0)
-                result = metric(x, y) if x or y else None
-            results[left, right] = result
-        return results
-
-    # Indexed walkers.
-    walkers = [walk(track, force_index=True) for track in tracks]
+    # Zoom level summaries in the index tell us which windows have data.
+    zoom_levels = [sample_window] if sample else None
+    indices = [index(track, force=True, fields=fields,
+                     zoom_levels=zoom_levels)[0]
+               for track in tracks]
+    regions = sorted(set(region for idx in indices for region in idx
+                         if region != '_all'))
+
+    # Each plan is a tuple of (region, comparisons, scale) and aggregates the
+    # given region, or all regions if `None`.
+    if per_region:
+        plans = [(region,) + _comparisons([idx.get(region, {})
+                                           for idx in indices], field_suffix)
+                 for region in regions]
+    else:
+        plans = [(None,) + _comparisons([idx['_all'] for idx in indices],
+                                        field_suffix)]
+
+    if sample:
+        return _distance_sample(tracks, plans, indices, regions, sample,
+                                sample_window, per_region, metric, threshold,
+                                vectorized, jobs)
+
+    # Comparisons already calculated in the state file are not calculated
+    # again, their (total, count) are in `cached`.
+    cached = {}
+    if state is not None:
+        metric_names = [name for name in metrics if metrics[name] is metric]
+        if not metric_names:
+            raise ValueError('Distance state needs a predefined metric')
+        state_tracks, state_pairs = _read_state(state, metric_names[0],
+                                                threshold)
+
+        # Names of tracks in the state, or `None` if they are not files.
+        names = []
+        changed = set()
+        for track in tracks:
+            name = signature = None
+            if _stat(track) is not None:
+                name = os.path.abspath(track.name)
+                signature = _signature(track)
+            if signature is None:
+                names.append(None)
+                continue
+            if (name in state_tracks and
+                not _valid(state_tracks[name], track)):
+                changed.add(name)
+            state_tracks[name] = signature
+            names.append(name)
+        state_pairs = dict((pair, value) for pair, value in state_pairs.items()
+                           if not changed.intersection(pair[1:]))
+
+        def pair(key, left, right):
+            if names[left] is not None and names[right] is not None:
+                return (key,) + tuple(sorted([names[left], names[right]]))
+
+        for i, (key, comparisons, scale) in enumerate(plans):
+            calculate = []
+            for comparison in comparisons:
+                value = state_pairs.get(pair(key, *comparison[:2]))
+                if value is not None and value[0] == scale:
+                    cached[key, comparison[:2]] = value[1:]
+                else:
+                    calculate.append(comparison)
+            plans[i] = key, calculate, scale
 
     # Aggregate results.
-    totals = defaultdict(lambda: 0)
-    counts = defaultdict(lambda: 1)
-    for _, _, values in merge(*walkers, merger=merger):
-        for comparison, value in values.items():
-            if value is not None:
-                totals[comparison] += value
-                counts[comparison] += 1
-
-    # Create the distance matrix by taking the averages.
-    distances = {}
-    for comparison in counts:
-        distances[comparison] = totals[comparison] / counts[comparison]
-    return distances
+    results = {}
+    if jobs > 1:
+        # Split the comparisons in blocks if there are fewer regions than
+        # processes.
+        blocks = max(1, -(-jobs // max(len(regions), 1)))
+        keys, tasks = [], []
+        for key, comparisons, scale in plans:
+            results[key] = defaultdict(lambda: 0), defaultdict(lambda: 0)
+            for region in regions if key is None else [key]:
+                for i in range(min(len(comparisons), blocks)):
+                    keys.append(key)
+                    tasks.append((region, [track.name for track in tracks],
+                                  comparisons[i::blocks], scale))
+        pool = multiprocessing.Pool(jobs, _init_distance_region,
+                                    (metric, threshold, vectorized))
+        try:
+            for key, (task_totals, task_counts) in zip(
+                    keys, pool.imap(_distance_region, tasks)):
+                totals, counts = results[key]
+                for comparison, total in task_totals.items():
+                    totals[comparison] += total
+                for comparison, count in task_counts.items():
+                    counts[comparison] += count
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for key, comparisons, scale in plans:
+            results[key] = _aggregate_tracks(
+                tracks, comparisons, metric, scale, threshold, vectorized,
+                regions=None if key is None else [key])
+
+    for (key, comparison), (total, count) in cached.items():
+        totals, counts = results[key]
+        totals[comparison], counts[comparison] = total, count
+
+    if state is not None:
+        for key, comparisons, scale in plans:
+            totals, counts = results[key]
+            for left, right, _, _ in comparisons:
+                p = pair(key, left, right)
+                if p is not None:
+                    state_pairs[p] = (scale,
+                                      float(totals.get((left, right), 0)),
+                                      counts.get((left, right), 0))
+        _write_state(state, metric_names[0], threshold, state_tracks,
+                     state_pairs)
+
+    # Create the distance matrices by taking the averages. The count starts
+    # at one for every comparison.
+    matrices = {}
+    for key, (totals, counts) in results.items():
+        matrices[key] = dict((comparison, totals[comparison] / (count + 1))
+                             for comparison, count in counts.items()
+                             if count)
+
+    if per_region:
+        return matrices
+    return matrices[None]
@@ -0,0 +1,367 @@
+"""
+Custom index fields for summary statistics of wiggle tracks.
+
+The statistics are computed in the same pass as the rest of the index (see
+:mod:`wiggelen.index`), so they do not need an extra pass over the track:
+
+* Mean and variance, using Welford's online algorithm (see
+  :func:`moments`).
+* Quantiles such as the median, approximated by a t-digest (see
+  :func:`quantiles`).
+* Histogram with bins of fixed width (see :func:`histogram`).
+
+All values are weighted by the number of positions they are defined on, so
+a data line with a span of 10 counts as 10 positions. The statistics of
+regions can be merged, which is used to summarize the entire track and to
+build the index in parallel processes.
+
+In the index file, the statistics are serialized without commas and equal
+signs, for example::
+
+    region=1,moments=643:12.4:5321.8,histogram=0.0:50.0:0/120/311/212/0/0
+
+Example::
+
+    >>> from wiggelen.index import index
+    >>> from wiggelen.fields import moments, quantiles
+    >>> idx, _ = index(open('a.wig'), force=True,
+    ...                fields=[moments(), quantiles()])
+    >>> idx['MT']['moments'].std
+    51.24021857876877
+    >>> idx['MT']['quantiles'].quantile(0.5)
+    607.0
+
+.. note:: The fields use functions that are not picklable. On platforms where
+    new processes are not forked, they cannot be used to build an index in
+    parallel processes.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from __future__ import division
+
+import math
+
+from .index import Field
+
+
+#: Default compression of quantile sketches, roughly the number of centroids.
+COMPRESSION = 100
+
+
+class Moments(object):
+    """
+    Count, mean, and sum of squared deviations of values, updated with
+    Welford's online algorithm.
+
+    :arg count: Number of positions.
+    :type count: int
+    :arg mean: Mean value.
+    :type mean: float
+    :arg m2: Sum of squared deviations from the mean.
+    :type m2: float
+    """
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create moments from their serialization.
+        """
+        count, mean, m2 = text.split(':')
+        return cls(int(count), float(mean), float(m2))
+
+    def add(self, value, weight=1):
+        """
+        Add a value defined on `weight` positions.
+        """
+        self.count += weight
+        delta = value - self.mean
+        self.mean += delta * weight / self.count
+        self.m2 += delta * weight * (value - self.mean)
+
+    def merge(self, other):
+        """
+        Merge the moments of other values.
+        """
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """
+        Population variance, or `None` if there are no values.
+        """
+        if not self.count:
+            return None
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        """
+        Population standard deviation, or `None` if there are no values.
+        """
+        if not self.count:
+            return None
+        return math.sqrt(self.variance)
+
+    def __str__(self):
+        return '%d:%r:%r' % (self.count, self.mean, self.m2)
+
+
+class QuantileSketch(object):
+    """
+    Approximation of the distribution of values by a merging t-digest.
+
+    Values are summarized as centroids (mean and weight), where centroids
+    near the tails of the distribution are kept small. Quantiles are
+    interpolated between the centroids and are most accurate near the tails.
+
+    :arg compression: Compression, roughly the number of centroids kept.
+    :type compression: int
+    :arg centroids: List of (mean, weight) tuples, ordered by mean.
+    :type centroids: list(float, int)
+    """
+    def __init__(self, compression=COMPRESSION, centroids=None):
+        self.compression = compression
+        self._centroids = centroids or []
+        self._buffer = []
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create a quantile sketch from its serialization.
+        """
+        compression, centroids = text.split(':')
+        centroids = [centroid.split('/') for centroid in centroids.split(';')
+                     if centroid]
+        return cls(int(compression),
+                   [(float(mean), int(weight)) for mean, weight in centroids])
+
+    def _compress(self):
+        # Merge the buffered values into the centroids, keeping the weight of
+        # every centroid within the limit of the scale function.
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+
+        def scale(q):
+            return (self.compression / (2 * math.pi) *
+                    math.asin(2 * min(q, 1) - 1))
+
+        centroids = [list(points[0])]
+        before = 0
+        for mean, weight in points[1:]:
+            centroid = centroids[-1]
+            # Equal values are always merged, which keeps the sketch exact
+            # for values with few distinct values (e.g., read depths).
+            if (mean == centroid[0] or
+                scale((before + centroid[1] + weight) / total) -
+                scale(before / total) <= 1):
+                centroid[1] += weight
+                centroid[0] += (mean - centroid[0]) * weight / centroid[1]
+            else:
+                before += centroid[1]
+                centroids.append([mean, weight])
+        self._centroids = [tuple(centroid) for centroid in centroids]
+
+    def add(self, value, weight=1):
+        """
+        Add a value defined on `weight` positions.
+        """
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Merge the sketch of other values.
+        """
+        self._buffer.extend(other.centroids)
+        self._compress()
+
+    @property
+    def centroids(self):
+        """
+        List of (mean, weight) tuples, ordered by mean.
+        """
+        self._compress()
+        return list(self._centroids)
+
+    @property
+    def count(self):
+        """
+        Number of positions.
+        """
+        return sum(weight for _, weight in self.centroids)
+
+    def quantile(self, q):
+        """
+        Approximate the `q` quantile of the values (e.g., 0.5 for the
+        median), or `None` if there are no values.
+        """
+        centroids = self.centroids
+        if not centroids:
+            return None
+
+        target = q * sum(weight for _, weight in centroids)
+        previous = None
+        cumulative = 0
+        for mean, weight in centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if previous is None:
+                    return mean
+                previous_mean, previous_center = previous
+                return previous_mean + ((mean - previous_mean) *
+                                        (target - previous_center) /
+                                        (center - previous_center))
+            previous = mean, center
+            cumulative += weight
+        return centroids[-1][0]
+
+    def __str__(self):
+        return '%d:%s' % (self.compression,
+                          ';'.join('%r/%d' % (float(mean), weight)
+                                   for mean, weight in self.centroids))
+
+
+class Histogram(object):
+    """
+    Counts of positions with values in bins of fixed width.
+
+    Values lower than `low` and values from `high` on are counted in two
+    extra bins, at the start and at the end of the counts.
+
+    :arg low: Start of the first bin.
+    :type low: float
+    :arg high: End of the last bin.
+    :type high: float
+    :arg bins: Number of bins.
+    :type bins: int
+    :arg counts: Counts per bin, including the two extra bins.
+    :type counts: list(int)
+    """
+    def __init__(self, low, high, bins, counts=None):
+        self.low = float(low)
+        self.high = float(high)
+        self.bins = bins
+        self.counts = counts or [0] * (bins + 2)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create a histogram from its serialization.
+        """
+        low, high, counts = text.split(':')
+        counts = [int(count) for count in counts.split('/')]
+        return cls(float(low), float(high), len(counts) - 2, counts)
+
+    def add(self, value, weight=1):
+        """
+        Add a value defined on `weight` positions.
+        """
+        if value < self.low:
+            b = 0
+        elif value >= self.high:
+            b = self.bins + 1
+        else:
+            b = min(int((value - self.low) / (self.high - self.low) *
+                        self.bins), self.bins - 1) + 1
+        self.counts[b] += weight
+
+    def merge(self, other):
+        """
+        Merge the histogram of other values, which must have the same bins.
+        """
+        if (other.low, other.high, other.bins) != (self.low, self.high,
+                                                   self.bins):
+            raise ValueError('Cannot merge histograms with different bins')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    @property
+    def edges(self):
+        """
+        List of the borders of the bins, from `low` to `high`.
+        """
+        return [self.low + (self.high - self.low) * b / self.bins
+                for b in range(self.bins + 1)]
+
+    def __str__(self):
+        return '%r:%r:%s' % (self.low, self.high,
+                             '/'.join(str(count) for count in self.counts))
+
+
+def _add(acc, value, span):
+    acc.add(value, span)
+    return acc
+
+
+def _merge(acc, other):
+    acc.merge(other)
+    return acc
+
+
+def moments(name='moments'):
+    """
+    Custom index field with the mean and variance of the values (see
+    :class:`Moments`).
+
+    :arg name: Field name.
+    :type name: str
+
+    :return: Custom index field definition.
+    :rtype: wiggelen.index.Field
+    """
+    return Field(name, Moments.parse, Moments, _add, _merge)
+
+
+def quantiles(name='quantiles', compression=COMPRESSION):
+    """
+    Custom index field with a sketch to approximate quantiles of the values
+    (see :class:`QuantileSketch`).
+
+    :arg name: Field name.
+    :type name: str
+    :arg compression: Compression, roughly the number of centroids kept.
+    :type compression: int
+
+    :return: Custom index field definition.
+    :rtype: wiggelen.index.Field
+    """
+    return Field(name, QuantileSketch.parse,
+                 lambda: QuantileSketch(compression), _add, _merge)
+
+
+def histogram(low, high, bins, name='histogram'):
+    """
+    Custom index field with a histogram of the values (see
+    :class:`Histogram`).
+
+    :arg low: Start of the first bin.
+    :type low: float
+    :arg high: End of the last bin.
+    :type high: float
+    :arg bins: Number of bins.
+    :type bins: int
+    :arg name: Field name.
+    :type name: str
+
+    :return: Custom index field definition.
+    :rtype: wiggelen.index.Field
+    """
+    return Field(name, Histogram.parse, lambda: Histogram(low, high, bins),
+                 _add, _merge)
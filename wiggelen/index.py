@@ -9,6 +9,7 @@ special region ``_all``.
 This data can be written to a file next to the wiggle track file (in case this
 is a regular file). Example of the serialization we use::
 
+    size=12515,mtime=1399110213.0,checksum=2877061482
     region=_all,start=0,stop=12453,sum=4544353,count=63343
     region=1,start=47,stop=3433,sum=4353,count=643
     region=X,start=3433,stop=8743,sum=454,count=343
@@ -18,31 +19,62 @@ is a regular file). Example of the serialization we use::
 Note that we do not impose a certain order on the lines in the index nor on
 the fields on a line.
 
+The line without region is the signature of the track file the index was
+built for: its size, modification time, and a checksum of its contents. An
+index is only used if the track still has the same size and modification
+time. If only the modification time differs (e.g., the track was copied),
+the checksum of the entire track must be the same. Indices without signature
+are not used.
+
+For tracks compressed with BGZF, the start and stop positions are virtual
+offsets (see :mod:`wiggelen.compress`).
+
 Additional custom fields can be added to the index by providing custom field
 definitions. Such a definition is created with the `Field` constructor and the
 following arguments:
 
 * The name of the field.
 * A function casting a field value from `string`.
-* Initial value.
+* Initial value, or a function without arguments creating it. The latter
+  is needed for mutable values, which are updated in place by the aggregate
+  function. Values are written to the index file as strings, so their string
+  representation should be accepted by the casting function and not contain
+  commas or equal signs.
 * Aggregate function used as the function argument in a reduce- or fold-like
   operation to construct the field value. This function takes as inputs the
   accumulated field value, the current value and the current span, and returns
   a new accumulated field value.
+* Optionally, a function merging two accumulated field values (e.g., of two
+  regions) into one. Merging with the initial value must not change the
+  other value.
 
 As an example, the standard `sum` field could be defined as the
 following tuple::
 
-    Field('sum', float, 0, lambda acc, value, span: acc + value * span)
-
-In practice, choose unique names for custom fields, not clashing with the
-standard fields such as `sum`.
+    Field('sum', float, 0, lambda acc, value, span: acc + value * span,
+          lambda acc, other: acc + other)
 
-.. todo:: Add some other metrics to the index (standard deviation, min, max).
+Custom fields that are missing from an existing index are added to it by
+scanning all regions again, leaving the other fields as they are. This is
+done in parallel processes if all missing fields have a merge function (see
+:func:`index`). Zoom levels that are missing are added the same way.
 
-.. todo:: A custom field that is missing from an existing index file causes
-   the entire index to be rebuilt, throwing away any other custom field values
-   that were already there.
+In practice, choose unique names for custom fields, not clashing with the
+standard fields such as `sum`. Custom fields for the variance, quantiles,
+and a histogram of the values are provided by :mod:`wiggelen.fields`.
+
+Optionally, the index also contains summaries of the values in bins of fixed
+width at several zoom levels. These summaries are used to summarize large
+parts of a region without walking every position (see :mod:`wiggelen.zoom`).
+For every zoom level (the bin width) and every bin with data, a line is added
+to the index with the sum, minimum, maximum, and count of the values in the
+bin. Bins are numbered from zero and bin ``b`` contains positions
+``b * zoom + 1`` to ``(b + 1) * zoom``. Zoom levels without any data are
+recorded on the ``_all`` region::
+
+    region=_all,zoom=1000
+    region=1,zoom=1000,bin=0,sum=34655,min=3,max=58,count=1000
+    region=1,zoom=1000,bin=1,sum=12432,min=1,max=23,count=765
 
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 
@@ -51,9 +83,16 @@ standard fields such as `sum`.
 
 
 from collections import defaultdict, namedtuple
+import mmap
+import multiprocessing
+import os
+import re
 import sys
+import zlib
 
 from .parse import LineType, create_state, parse
+from .bigwig import is_bigwig, walk_bigwig
+from .compress import GZIP_MAGIC, _text, decompress, is_gzip
 
 
 #: Whether or not indices are written to a file.
@@ -65,13 +104,30 @@ INDEX_SUFFIX = '.idx'
 #: Whether or not indices are cached in memory during execution.
 CACHE_INDEX = True
 
+#: Whether or not walking over a track without index writes the index that
+#: is built during the walk (see :func:`wiggelen.walk`).
+INDEX_ON_WALK = False
+
+#: Default zoom levels (bin widths) for summaries in the index.
+ZOOM_LEVELS = [1000, 10000, 100000]
+
+#: Number of bytes of the track read at once to compute its checksum.
+CHECKSUM_CHUNK_SIZE = 1 << 20
 
-# Cache store of indices, indexed by index filename.
+
+# Region definition lines, found by a byte scan of the track.
+_REGION_LINE = re.compile(br'^(?:variableStep|fixedStep)[ \t][^\n]*?'
+                          br'chrom=([^ \t\r\n]+)', re.M)
+
+
+# Cache store of indices with the signature of their track, indexed by index
+# filename.
 _cache = {}
 
 
 #: Type for custom index field definitions.
-Field = namedtuple('Field', 'name caster init func')
+Field = namedtuple('Field', 'name caster init func merge')
+Field.__new__.__defaults__ = (None,)
 
 
 class ReadError(Exception):
@@ -92,6 +148,110 @@ def _cast(field, value, fields=None):
     return casters[field](value)
 
 
+# Check if all custom fields and zoom levels are in the index.
+def _complete(idx, fields=None, zoom_levels=None):
+    # Todo: Here we check if all the required custom fields are in the index
+    #     for `_all`, but we should really do a better check if all required
+    #     data is there.
+    return (all(field.name in idx['_all'] for field in fields or []) and
+            all(level in idx['_all'].get('zoom', {})
+                for level in zoom_levels or []))
+
+
+# Add a run of values to the zoom level summaries of a region.
+def _add_zoom(zoom, position, span, value):
+    end = position + span - 1
+    for level, bins in zoom.items():
+        for b in range((position - 1) // level, (end - 1) // level + 1):
+            count = (min(end, (b + 1) * level) -
+                     max(position, b * level + 1) + 1)
+            summary = bins.get(b)
+            if summary is None:
+                bins[b] = [value * count, value, value, count]
+            else:
+                summary[0] += value * count
+                summary[1] = min(value, summary[1])
+                summary[2] = max(value, summary[2])
+                summary[3] += count
+
+
+# Initial value of a custom field.
+def _initial(field):
+    return field.init() if callable(field.init) else field.init
+
+
+# Create an empty summary for a region.
+def _summary(region, start, stop, fields=None, zoom_levels=None):
+    summary = {'region': region,
+               'start':  start,
+               'stop':   stop,
+               'sum':    0,
+               'min':    sys.float_info.max,
+               'posmin': sys.float_info.max,
+               'max':    0,
+               'count':  0}
+    summary.update(dict((field.name, _initial(field))
+                        for field in fields or []))
+    if zoom_levels:
+        summary['zoom'] = dict((level, {}) for level in zoom_levels)
+    return summary
+
+
+# Add a data value to the summaries of a region and the entire track.
+def _add(idx, region, position, span, value, fields=None):
+    for r in region, '_all':
+        idx[r]['sum'] += value * span
+        idx[r]['min'] = min(value, idx[r]['min'])
+        if value > 0:
+            idx[r]['posmin'] = min(value, idx[r]['posmin'])
+        idx[r]['max'] = max(value, idx[r]['max'])
+        idx[r]['count'] += span
+        for field in fields or []:
+            idx[r][field.name] = field.func(idx[r][field.name], value, span)
+    if 'zoom' in idx[region]:
+        _add_zoom(idx[region]['zoom'], position, span, value)
+
+
+# Size and modification time of the track file.
+def _stat(track):
+    try:
+        stat = os.stat(track.name)
+    except (AttributeError, OSError):
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+# Size, modification time, and checksum of the track file.
+def _signature(track):
+    stat = _stat(track)
+    if stat is None:
+        return None
+    checksum = 0
+    try:
+        with open(track.name, 'rb') as f:
+            while True:
+                data = f.read(CHECKSUM_CHUNK_SIZE)
+                if not data:
+                    break
+                checksum = zlib.crc32(data, checksum)
+    except IOError:
+        return None
+    return stat + (checksum & 0xffffffff,)
+
+
+# Check if a signature matches the track file. Tracks that are not regular
+# files have no signature.
+def _valid(signature, track):
+    stat = _stat(track)
+    if signature is None or stat is None:
+        return signature is None and stat is None
+    if stat == signature[:2]:
+        return True
+    current = _signature(track)
+    return (current is not None and
+            (current[0], current[2]) == (signature[0], signature[2]))
+
+
 # Try to create a filename for the index file.
 def _index_filename(track=sys.stdin):
     filename = getattr(track, 'name', None)
@@ -126,22 +286,35 @@ def write_index(idx, track=sys.stdout):
     if filename is None:
         return
 
+    signature = _signature(track)
+
     if CACHE_INDEX:
-        _cache[filename] = idx
+        _cache[filename] = signature, idx
 
     if not WRITE_INDEX:
         return
 
     try:
         with open(filename, 'w') as f:
-            f.write('\n'.join(','.join('%s=%s' % d for d in s.items())
+            if signature is not None:
+                f.write('size=%d,mtime=%r,checksum=%d\n' % signature)
+            f.write('\n'.join(','.join('%s=%s' % d for d in s.items()
+                                       if d[0] != 'zoom')
                               for s in idx.values()) + '\n')
+            for region, s in idx.items():
+                for level, bins in s.get('zoom', {}).items():
+                    if region == '_all':
+                        f.write('region=_all,zoom=%d\n' % level)
+                    for b, summary in sorted(bins.items()):
+                        f.write('region=%s,zoom=%d,bin=%d,sum=%s,min=%s,'
+                                'max=%s,count=%s\n'
+                                % ((region, level, b) + tuple(summary)))
         return filename
     except IOError:
         pass
 
 
-def read_index(track=sys.stdin, fields=None):
+def read_index(track=sys.stdin, fields=None, zoom_levels=None):
     """
     Try to read the index from a file.
 
@@ -149,12 +322,21 @@ def read_index(track=sys.stdin, fields=None):
     :type track: file
     :arg fields: List of custom index field definitions.
     :type fields: list
+    :arg zoom_levels: List of zoom levels that must be in the index.
+    :type zoom_levels: list(int)
 
-    :return: Wiggle track index, or `None` if the index could not be read.
+    :return: Wiggle track index, or `None` if the index could not be read,
+        does not match the track, or is incomplete.
     :rtype: dict(str, dict(str, _))
-
-    .. todo:: Only accept if index is newer than wiggle track?
     """
+    idx = _read_index(track, fields=fields)
+    if idx is not None and _complete(idx, fields, zoom_levels):
+        return idx
+
+
+# Try to read the index from the cache or a file, regardless of the custom
+# fields and zoom levels in it.
+def _read_index(track=sys.stdin, fields=None):
     fields = fields or []
 
     filename = _index_filename(track)
@@ -163,66 +345,313 @@ def read_index(track=sys.stdin, fields=None):
         return
 
     if CACHE_INDEX and filename in _cache:
-        return _cache[filename]
+        signature, idx = _cache[filename]
+        if _valid(signature, track):
+            return idx
+        del _cache[filename]
 
     try:
         idx = {}
+        zoom = defaultdict(dict)
+        signature = None
         with open(filename) as f:
             for line in f:
-                summary = {}
-                for d in line.rstrip().split(','):
-                    k, v = d.split('=')
+                summary = dict(d.split('=') for d in line.rstrip().split(','))
+                if 'region' not in summary:
+                    signature = (int(summary['size']),
+                                 float(summary['mtime']),
+                                 int(summary['checksum']))
+                    continue
+                if 'zoom' in summary:
+                    bins = zoom[summary['region']].setdefault(
+                        int(summary['zoom']), {})
+                    if 'bin' in summary:
+                        bins[int(summary['bin'])] = [
+                            _cast(k, summary[k])
+                            for k in ('sum', 'min', 'max', 'count')]
+                    continue
+                for k, v in summary.items():
                     summary[k] = _cast(k, v, fields=fields)
                 idx[summary['region']] = summary
-        # Todo: Here we check if all the required custom fields are in the
-        #     index for `_all`, but we should really do a better check if all
-        #     required data is there.
-        if all(field.name in idx['_all'] for field in fields):
+        for region, levels in zoom.items():
+            idx[region]['zoom'] = levels
+        if _valid(signature, track):
             return idx
-    except IOError:
+    except (IOError, KeyError, ValueError):
         pass
 
 
-def index(track=sys.stdin, force=False, fields=None):
+# Custom fields and zoom levels used by `_scan_region` and `_index_shard`,
+# set by `_init_scan_region` (in worker processes).
+_scan_options = {}
+
+
+def _init_scan_region(fields, zoom_levels):
+    _scan_options['fields'] = fields
+    _scan_options['zoom_levels'] = zoom_levels
+
+
+def _scan_region(task):
+    # Scan one region of a track file in a worker process.
+    filename, region, start = task
+    with open(filename) as track:
+        return _scan(decompress(track), region, start,
+                     _scan_options['fields'], _scan_options['zoom_levels'])
+
+
+def _index_shard(task):
+    # Index one shard of a track file in a worker process, starting at its
+    # first region line and stopping at the next shard. The result has the
+    # summary of the region and of the shard as part of the entire track.
+    filename, start, stop = task
+    fields = _scan_options['fields']
+    zoom_levels = _scan_options['zoom_levels']
+
+    region = None
+    idx = {'_all': _summary('_all', 0, 0, fields)}
+    state = create_state()
+    offset = start
+
+    with open(filename, 'rb') as track:
+        track.seek(start)
+        for line in track:
+            if offset >= stop:
+                break
+            start, offset = offset, offset + len(line)
+            line_type, data = parse(_text(line), state)
+
+            if line_type & LineType.REGION and state['region'] != region:
+                region = state['region']
+                idx[region] = _summary(region, start, offset, fields,
+                                       zoom_levels)
+            if line_type & LineType.DATA:
+                idx[region]['stop'] = idx['_all']['stop'] = offset
+                _add(idx, region, data.position, data.span, data.value,
+                     fields)
+
+    return idx
+
+
+# Find shards of a track file by a byte scan for region lines, without
+# parsing the track. Consecutive region lines of the same region start one
+# shard. Return a list of (region, start, stop) per shard, or `None` if the
+# track cannot be scanned or has no region lines (e.g., bedGraph).
+def _shards(track):
+    if _stat(track) is None or is_gzip(track):
+        return None
+
+    try:
+        with open(track.name, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+
+    try:
+        # The track file can be compressed if `track` decompresses it.
+        if data[:2] == GZIP_MAGIC:
+            return None
+        regions, starts = [], []
+        for match in _REGION_LINE.finditer(data):
+            if not regions or match.group(1) != regions[-1]:
+                regions.append(match.group(1))
+                starts.append(match.start())
+        size = len(data)
+    finally:
+        data.close()
+
+    if not starts:
+        return None
+    return list(zip([_text(region) for region in regions], starts,
+                    starts[1:] + [size]))
+
+
+# Merge the summary of part of a track into another summary.
+def _merge(summary, other, fields=None):
+    summary['stop'] = max(summary['stop'], other['stop'])
+    summary['sum'] += other['sum']
+    summary['min'] = min(summary['min'], other['min'])
+    summary['posmin'] = min(summary['posmin'], other['posmin'])
+    summary['max'] = max(summary['max'], other['max'])
+    summary['count'] += other['count']
+    for field in fields or []:
+        summary[field.name] = field.merge(summary[field.name],
+                                          other[field.name])
+
+
+# Index a track file shard by shard in parallel processes.
+def _index_shards(track, shards, fields, zoom_levels, jobs):
+    tasks = [(track.name, start, stop) for _, start, stop in shards]
+    pool = multiprocessing.Pool(jobs, _init_scan_region,
+                                (fields, zoom_levels))
+    try:
+        results = pool.map(_index_shard, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    idx = {'_all': _summary('_all', 0, 0, fields, zoom_levels)}
+    for result in results:
+        _merge(idx['_all'], result.pop('_all'), fields)
+        # A region occurring more than once in the track is summarized by its
+        # last occurrence, like in a sequential scan.
+        idx.update(result)
+    return idx
+
+
+# Compute custom field values and zoom level summaries for one region,
+# starting at its offset in the track. If given, the field values for the
+# entire track in `totals` are updated as well.
+def _scan(track, region, start, fields, zoom_levels, totals=None):
+    values = dict((field.name, _initial(field)) for field in fields)
+    zoom = dict((level, {}) for level in zoom_levels)
+    state = create_state()
+
+    track.seek(start)
+
+    for line in track:
+        line_type, data = parse(line, state)
+        if line_type & LineType.REGION and state['region'] != region:
+            break
+        if line_type & LineType.DATA:
+            for field in fields:
+                values[field.name] = field.func(values[field.name],
+                                                data.value, data.span)
+                if totals is not None:
+                    totals[field.name] = field.func(totals[field.name],
+                                                    data.value, data.span)
+            if zoom:
+                _add_zoom(zoom, data.position, data.span, data.value)
+
+    return values, zoom
+
+
+# Add missing custom fields and zoom levels to an index by scanning all its
+# regions again, leaving the fields that are already there as they are.
+def _extend(track, idx, fields, zoom_levels, jobs=1):
+    fields = [field for field in fields if field.name not in idx['_all']]
+    zoom_levels = [level for level in zoom_levels
+                   if level not in idx['_all'].get('zoom', {})]
+
+    idx = dict((region, dict(summary)) for region, summary in idx.items())
+    for summary in idx.values():
+        summary.update((field.name, _initial(field)) for field in fields)
+        if zoom_levels:
+            summary['zoom'] = dict(summary.get('zoom', {}))
+            summary['zoom'].update((level, {}) for level in zoom_levels)
+
+    # Regions in the order of the track, so values are aggregated for the
+    # entire track in the same order as when building the index.
+    regions = sorted((r for r in idx if r != '_all'),
+                     key=lambda r: idx[r]['start'])
+
+    if (jobs > 1 and _stat(track) is not None and
+        all(field.merge is not None for field in fields)):
+        tasks = [(track.name, region, idx[region]['start'])
+                 for region in regions]
+        pool = multiprocessing.Pool(jobs, _init_scan_region,
+                                    (fields, zoom_levels))
+        try:
+            results = pool.map(_scan_region, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for field in fields:
+            for values, _ in results:
+                idx['_all'][field.name] = field.merge(idx['_all'][field.name],
+                                                      values[field.name])
+    else:
+        track = decompress(track)
+        results = [_scan(track, region, idx[region]['start'], fields,
+                         zoom_levels, totals=idx['_all'])
+                   for region in regions]
+
+    for region, (values, zoom) in zip(regions, results):
+        idx[region].update(values)
+        if zoom_levels:
+            idx[region]['zoom'].update(zoom)
+
+    return idx
+
+
+def index(track=sys.stdin, force=False, fields=None, zoom_levels=None,
+          jobs=1):
     """
     Return index of region positions in track.
 
+    An existing index is only used if it matches the track (see the
+    signature described above). If the index is forced and an existing index
+    lacks some of the custom fields or zoom levels, only these are added.
+
+    With more than one job, a new index is built in parallel processes. The
+    track file is split in shards per region by a byte scan for region lines
+    (`variableStep` or `fixedStep`), after which the shards are summarized
+    independently and the summaries are merged. This requires an
+    uncompressed regular file in the wiggle format and merge functions for
+    all custom fields, otherwise the index is built in one process.
+
     :arg track: Wiggle track.
     :type track: file
     :arg force: Force creating an index if it does not yet exist.
     :type force: bool
     :arg fields: List of custom index field definitions.
     :type fields: list
+    :arg zoom_levels: List of zoom levels (bin widths) to include summaries
+        for (see :data:`ZOOM_LEVELS` for sensible defaults).
+    :type zoom_levels: list(int)
+    :arg jobs: Number of processes to build the index in, or to add missing
+        custom fields and zoom levels in, region by region. This requires a
+        regular file and merge functions for all (missing) custom fields.
+    :type jobs: int
 
     :return: Wiggle track index and index filename.
     :rtype: dict(str, dict(str, _)), str
 
+    .. note:: On platforms where new processes are not forked, custom fields
+        must be picklable to use more than one process.
     .. todo:: It is not possible to force the index to be rewritten if it
         already exists.
     .. todo:: Handle non-writable index, corrupt index, etc.
     """
     fields = fields or []
 
-    idx = read_index(track, fields=fields)
+    zoom_levels = zoom_levels or []
 
-    if idx is not None or not force:
+    idx = _read_index(track, fields=fields)
+
+    if idx is not None and _complete(idx, fields, zoom_levels):
         return idx, _index_filename(track)
 
+    if not force:
+        return None, _index_filename(track)
+
+    if idx is not None and not is_bigwig(track):
+        idx = _extend(track, idx, fields, zoom_levels, jobs=jobs)
+        return idx, write_index(idx, track)
+
+    if is_bigwig(track):
+        # Byte offsets are not used for bigWig tracks.
+        idx = {'_all': _summary('_all', 0, 0, fields, zoom_levels)}
+        for region, start, end, value in walk_bigwig(track, runs=True):
+            if region not in idx:
+                idx[region] = _summary(region, 0, 0, fields, zoom_levels)
+            _add(idx, region, start, end - start + 1, value, fields)
+        return idx, write_index(idx, track)
+
+    if jobs > 1 and all(field.merge is not None for field in fields):
+        shards = _shards(track)
+        if shards:
+            idx = _index_shards(track, shards, fields, zoom_levels, jobs)
+            return idx, write_index(idx, track)
+
+    track = decompress(track)
+
     try:
-        track.tell()
+        offset = track.tell()
     except (AttributeError, IOError):
         raise ReadError('Could not index track (needs random access)')
 
     region = None
-    idx = {'_all': {'region': '_all',
-                    'start':  0,
-                    'stop':   track.tell(),
-                    'sum':    0,
-                    'min':    sys.float_info.max,
-                    'posmin': sys.float_info.max,
-                    'max':    0,
-                    'count':  0}}
-    idx['_all'].update(dict((field.name, field.init) for field in fields))
+    idx = {'_all': _summary('_all', 0, offset, fields, zoom_levels)}
 
     state = create_state()
 
@@ -230,33 +659,19 @@ def index(track=sys.stdin, force=False, fields=None):
         line = track.readline()
         if not line:
             break
+        # We do not compute offsets from line lengths, they can be virtual
+        # offsets in compressed tracks (see :mod:`wiggelen.compress`).
+        start, offset = offset, track.tell()
         line_type, data = parse(line, state)
 
-        if line_type == LineType.REGION:
-            region = data
-            idx[region] = {
-                'region': region,
-                'start':  track.tell() - len(line),
-                'stop':   track.tell(),
-                'sum':    0,
-                'min':    sys.float_info.max,
-                'posmin': sys.float_info.max,
-                'max':    0,
-                'count':  0}
-            idx[region].update(dict((field.name, field.init)
-                                    for field in fields))
-        elif line_type == LineType.DATA:
-            for r in region, '_all':
-                idx[r]['stop'] = track.tell()
-                idx[r]['sum'] += data.value * data.span
-                idx[r]['min'] = min(data.value, idx[r]['min'])
-                if data.value > 0:
-                    idx[r]['posmin'] = min(data.value, idx[r]['posmin'])
-                idx[r]['max'] = max(data.value, idx[r]['max'])
-                idx[r]['count'] += data.span
-                for field in fields:
-                    idx[r][field.name] = field.func(idx[r][field.name],
-                                                    data.value,
-                                                    data.span)
+        # A region can be defined by consecutive region lines, e.g., to
+        # change the span.
+        if line_type & LineType.REGION and state['region'] != region:
+            region = state['region']
+            idx[region] = _summary(region, start, offset, fields,
+                                   zoom_levels)
+        if line_type & LineType.DATA:
+            idx[region]['stop'] = idx['_all']['stop'] = offset
+            _add(idx, region, data.position, data.span, data.value, fields)
 
     return idx, write_index(idx, track)
@@ -1,5 +1,9 @@
 """
-Get covered intervals from wiggle tracks and write to BED format.
+Get covered intervals from wiggle tracks and write to BED format, or read
+intervals from BED format and extract their values from wiggle tracks.
+
+Intervals are represented as tuples of `(region, begin, end)` where `begin`
+and `end` are one-based and inclusive.
 
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 
@@ -7,15 +11,34 @@ Get covered intervals from wiggle tracks and write to BED format.
 """
 
 
+import itertools
 import sys
 
+from .index import Field, _initial, index
+from .wiggle import walk
+
+
+#: Field definitions for interval summaries (see :func:`summarize`).
+SUMMARY_FIELDS = [
+    Field('sum', float, 0, lambda acc, value, span: acc + value * span),
+    Field('min', float, None,
+          lambda acc, value, span: value if acc is None else min(acc, value)),
+    Field('max', float, None,
+          lambda acc, value, span: value if acc is None else max(acc, value)),
+    Field('count', int, 0, lambda acc, value, span: acc + span),
+    Field('covered', int, 0,
+          lambda acc, value, span: acc + span if value else acc)]
+
 
-def coverage(walker):
+def coverage(walker, runs=False):
     """
     Get intervals of consecutively defined positions from a walker.
 
     :arg walker: Tuple of `(region, position, value)` per defined position.
     :type walker: generator(str, int, _)
+    :arg runs: The walker yields tuples of `(region, start, end, value)` per
+        run.
+    :type runs: bool
 
     :return: Tuples of `(region, begin, end)` per position where `begin` and
         `end` are one-based and inclusive.
@@ -32,16 +55,20 @@ def coverage(walker):
     """
     interval = None
 
-    for region, position, _ in walker:
+    if not runs:
+        walker = ((region, position, position, value)
+                  for region, position, value in walker)
+
+    for region, start, end, _ in walker:
         if interval is not None:
-            if region != interval[0] or position != interval[2] + 1:
+            if region != interval[0] or start != interval[2] + 1:
                 yield interval
                 interval = None
 
         if interval is None:
-            interval = region, position, position
+            interval = region, start, end
         else:
-            interval = interval[0], interval[1], position
+            interval = interval[0], interval[1], end
 
     # Backlog.
     if interval is not None:
@@ -81,3 +108,212 @@ def write(intervals, track=sys.stdout, name=None, description=None):
 
     for interval in intervals:
         track.write('%s\t%i\t%i\n' % interval)
+
+
+def read(track=sys.stdin):
+    """
+    Read intervals from a bed track.
+
+    :arg track: Bed track.
+    :type track: file
+
+    :return: List of (region, begin, end) per interval.
+    :rtype: list(str, int, int)
+    """
+    intervals = []
+    for line in track:
+        if line.startswith('track') or line.startswith('browser') or \
+               line.startswith('#') or not line.strip():
+            continue
+        region, start, stop = line.strip().split('\t')[:3]
+        intervals.append((region, int(start) + 1, int(stop)))
+    return intervals
+
+
+def _sweep(walker, intervals, init, func):
+    # Sweep over a walker of runs in one region and yield (index, value) for
+    # every interval in the list of (begin, end) tuples, which must be sorted
+    # by `begin`. The value of an interval is `init()` folded with `func`
+    # over the runs clipped to the interval. Results are yielded in order of
+    # the intervals.
+    values = [None] * len(intervals)
+    done = [False] * len(intervals)
+    active = []
+    activated = emitted = 0
+
+    for region, start, end, value in walker:
+        # Activate intervals beginning before the end of this run.
+        while (activated < len(intervals) and
+               intervals[activated][0] <= end):
+            values[activated] = init()
+            active.append(activated)
+            activated += 1
+
+        # Add this run to the active intervals, or finish them.
+        still_active = []
+        for i in active:
+            begin, stop = intervals[i]
+            if stop < start:
+                done[i] = True
+                continue
+            still_active.append(i)
+            first, last = max(begin, start), min(stop, end)
+            if first <= last:
+                values[i] = func(values[i], region, first, last, value)
+        active = still_active
+
+        while emitted < len(intervals) and done[emitted]:
+            yield emitted, values[emitted]
+            values[emitted] = None
+            emitted += 1
+
+        # No need to walk any further in this region.
+        if activated == len(intervals) and not active:
+            break
+
+    for i in range(emitted, len(intervals)):
+        yield i, values[i] if i < activated else init()
+
+
+def _sweep_track(walkers, intervals, init, func, order=None):
+    # Sweep over (region, walker) tuples and yield (interval, value) for all
+    # intervals (see `_sweep`), followed by intervals in regions that were
+    # not walked.
+    by_region = {}
+    for region, begin, end in sorted(intervals):
+        by_region.setdefault(region, []).append((begin, end))
+
+    for region, walker in walkers:
+        if region not in by_region:
+            continue
+        region_intervals = by_region.pop(region)
+        for i, value in _sweep(walker, region_intervals, init, func):
+            begin, end = region_intervals[i]
+            yield (region, begin, end), value
+
+    for region in sorted(by_region, key=order):
+        for begin, end in by_region[region]:
+            yield (region, begin, end), init()
+
+
+def extract(track, intervals, force_index=False, runs=False, order=None):
+    """
+    Extract the values in intervals from a wiggle track.
+
+    The intervals are sorted and every region of the track is walked at most
+    once. If the track has an index, regions without intervals are skipped
+    and walking a region stops after its last interval.
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg intervals: List of (region, begin, end) per interval. Intervals can
+        overlap.
+    :type intervals: list(str, int, int)
+    :arg force_index: Force creating an index if it does not yet exist.
+    :type force_index: bool
+    :arg runs: Extract tuples of (region, start, end, value) per run instead
+        of per position (see :func:`wiggelen.walk`). Runs are clipped to the
+        interval.
+    :type runs: bool
+    :arg order: Key function defining the order of regions if we have an
+        index (see :mod:`wiggelen.order`).
+    :type order: function(str -> _)
+
+    :return: Tuples of (interval, items) per interval, where `items` is a
+        list of (region, position, value) tuples per defined position in the
+        interval. Intervals are sorted by region (in the order they are
+        walked) and position.
+    :rtype: generator((str, int, int), list(str, int, _))
+
+    Example::
+
+        >>> for x in extract(open('a.wig'), [('MT', 2, 3), ('1', 9, 12)]):
+        ...     x
+        ...
+        (('1', 9, 12), [('1', 9, 657.0), ('1', 10, 676.0)])
+        (('MT', 2, 3), [('MT', 2, 536.0), ('MT', 3, 553.0)])
+    """
+    idx, _ = index(track, force=force_index)
+
+    if idx is None:
+        walkers = itertools.groupby(walk(track, runs=True), lambda r: r[0])
+    else:
+        regions = sorted(set(r for r, _, _ in intervals if r in idx),
+                         key=order)
+        walkers = ((region, walk(track, runs=True, regions=[region]))
+                   for region in regions)
+
+    if runs:
+        def func(items, region, first, last, value):
+            items.append((region, first, last, value))
+            return items
+    else:
+        def func(items, region, first, last, value):
+            items.extend((region, p, value) for p in range(first, last + 1))
+            return items
+
+    return _sweep_track(walkers, intervals, list, func, order=order)
+
+
+def summarize(walker, intervals, runs=False, fields=None):
+    """
+    Summarize the values in intervals from a walker.
+
+    The walker is consumed in one sweep, so every region must be walked
+    consecutively. The summary of an interval is a dictionary with the
+    following fields:
+
+    * ``sum``: Sum of values.
+    * ``mean``: Mean value (`None` for an empty interval).
+    * ``min``: Minimum value (`None` for an empty interval).
+    * ``max``: Maximum value (`None` for an empty interval).
+    * ``count``: Number of defined positions.
+    * ``covered``: Number of positions with a non-zero value.
+
+    Additional fields can be defined with custom field definitions, as for
+    the index (see :mod:`wiggelen.index`).
+
+    :arg walker: Tuple of `(region, position, value)` per defined position.
+    :type walker: generator(str, int, _)
+    :arg intervals: List of (region, begin, end) per interval. Intervals can
+        overlap.
+    :type intervals: list(str, int, int)
+    :arg runs: The walker yields tuples of `(region, start, end, value)` per
+        run.
+    :type runs: bool
+    :arg fields: List of custom field definitions.
+    :type fields: list
+
+    :return: Tuples of (interval, summary) per interval. Intervals are sorted
+        by region (in the order they are walked) and position.
+    :rtype: generator((str, int, int), dict(str, _))
+
+    Example::
+
+        >>> for x in summarize(walk(open('a.wig')), [('MT', 2, 5)]):
+        ...     x
+        ...
+        (('MT', 2, 5), {'count': 2, 'covered': 2, 'max': 568.0,
+                        'mean': 552.0, 'min': 536.0, 'sum': 1104.0})
+    """
+    fields = SUMMARY_FIELDS + (fields or [])
+
+    if not runs:
+        walker = ((region, position, position, value)
+                  for region, position, value in walker)
+
+    def init():
+        return dict((field.name, _initial(field)) for field in fields)
+
+    def func(summary, region, first, last, value):
+        span = last - first + 1
+        for field in fields:
+            summary[field.name] = field.func(summary[field.name], value, span)
+        return summary
+
+    walkers = itertools.groupby(walker, lambda r: r[0])
+
+    for interval, summary in _sweep_track(walkers, intervals, init, func):
+        summary['mean'] = (summary['sum'] / float(summary['count'])
+                           if summary['count'] else None)
+        yield interval, summary
@@ -39,7 +39,18 @@ positive and negative values).
 
 from __future__ import division
 
-from .wiggle import zip_
+import multiprocessing
+import sys
+
+from .index import index
+from .wiggle import (walk, zip_, _write_header, _write_index,
+                     _write_regions)
+
+# Python 3 compatibility.
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 
 # Compute the sum of all values.
@@ -121,6 +132,13 @@ def merge(*walkers, **options):
     :type walkers: list(generator(str, int, _))
     :keyword merger: Merge operation (default: sum).
     :type merger: function(list(_) -> _)
+    :keyword runs: Walkers yield tuples of (region, start, end, value) per
+        run and we yield tuples of (region, start, end, merged value) (see
+        :func:`wiggelen.zip_`).
+    :type runs: bool
+    :keyword order: Key function defining the order of regions (see
+        :mod:`wiggelen.order`).
+    :type order: function(str -> _)
 
     :return: Tuples of (region, position, merged value) per defined position
         in `walkers`.
@@ -129,5 +147,127 @@ def merge(*walkers, **options):
     # Todo: Would it be better to also pass region/position to the merger?
     merger = options.get('merger', mergers['sum'])
 
-    for region, position, values in zip_(*walkers):
+    order = options.get('order')
+
+    if options.get('runs', False):
+        for region, start, end, values in zip_(*walkers, runs=True,
+                                               order=order):
+            yield region, start, end, merger(values)
+        return
+
+    for region, position, values in zip_(*walkers, order=order):
         yield region, position, merger(values)
+
+
+# Merge operation and write options used by `_merge_region`, set by
+# `_init_merge_region` (in worker processes).
+_region_options = {}
+
+
+def _init_merge_region(merger, serializer, compact, bedgraph):
+    _region_options['merger'] = merger
+    _region_options['serializer'] = serializer
+    _region_options['compact'] = compact
+    _region_options['bedgraph'] = bedgraph
+
+
+def _merge_region(task):
+    # Merge one region of the tracks and return the written data and its
+    # index.
+    region, filenames = task
+    tracks = [open(filename) for filename in filenames]
+    try:
+        walkers = [walk(track, runs=True, regions=[region])
+                   for track in tracks]
+        data = StringIO()
+        idx, _ = _write_regions(merge(*walkers, runs=True,
+                                      merger=_region_options['merger']),
+                                data,
+                                serializer=_region_options['serializer'],
+                                runs=True,
+                                compact=_region_options['compact'],
+                                bedgraph=_region_options['bedgraph'])
+    finally:
+        for track in tracks:
+            track.close()
+    return data.getvalue(), idx
+
+
+def write_merge(tracks, track=sys.stdout, serializer=str, name=None,
+                description=None, **options):
+    """
+    Merge wiggle tracks region by region and write the result to a wiggle
+    track.
+
+    The result is the same as writing :func:`merge` over walkers with forced
+    indices, but the regions are merged independently, optionally in
+    parallel processes.
+
+    :arg tracks: List of wiggle tracks. These must be regular files, since
+        every region is read by opening the files again.
+    :type tracks: list(file)
+    :arg track: Writable file handle.
+    :type track: file
+    :arg serializer: Function making strings from values.
+    :type serializer: function(_ -> str)
+    :arg name: Optional track name (displayed to the left of the track in the
+        UCSC Genome Browser).
+    :type name: str
+    :arg description: Optional track description (displayed as center label in
+        the UCSC Genome Browser).
+    :type description: str
+    :keyword merger: Merge operation (default: sum).
+    :type merger: function(list(_) -> _)
+    :keyword jobs: Number of processes to merge regions in (default: 1, which
+        merges all regions in the current process).
+    :type jobs: int
+    :keyword order: Key function defining the order of regions (see
+        :mod:`wiggelen.order`).
+    :type order: function(str -> _)
+    :keyword compact: Choose the most compact encoding per block of positions
+        (default: `True`, see :func:`wiggelen.write`).
+    :type compact: bool
+    :keyword bedgraph: Write the result in the bedGraph format (default:
+        `False`, see :func:`wiggelen.write_bedgraph`).
+    :type bedgraph: bool
+
+    .. note:: On platforms where new processes are not forked, `merger` and
+        `serializer` must be picklable.
+    """
+    merger = options.get('merger', mergers['sum'])
+    jobs = options.get('jobs', 1)
+    compact = options.get('compact', True)
+    bedgraph = options.get('bedgraph', False)
+
+    regions = set()
+    for t in tracks:
+        idx, _ = index(t, force=True)
+        regions.update(r for r in idx if r != '_all')
+    tasks = [(region, [t.name for t in tracks])
+             for region in sorted(regions, key=options.get('order'))]
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_merge_region,
+                                    (merger, serializer, compact, bedgraph))
+        results = pool.imap(_merge_region, tasks)
+    else:
+        pool = None
+        _init_merge_region(merger, serializer, compact, bedgraph)
+        results = (_merge_region(task) for task in tasks)
+
+    try:
+        size = _write_header(track, name=name, description=description,
+                             type='bedGraph' if bedgraph else 'wiggle_0')
+        idx = {}
+        for data, region_idx in results:
+            track.write(data)
+            for region, summary in region_idx.items():
+                summary['start'] += size
+                summary['stop'] += size
+                idx[region] = summary
+            size += len(data)
+        _write_index(idx, track, size)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -0,0 +1,73 @@
+"""
+Orders of regions in wiggle tracks.
+
+By default, regions are ordered alphabetically by name. Other orders can be
+used by providing a key function (as with the built-in `sorted` function) to
+:func:`wiggelen.walk`, :func:`wiggelen.zip_`, and
+:func:`wiggelen.merge.merge`. This module provides some such functions.
+
+Example::
+
+    >>> sorted(['chr10', 'chr2', 'chrX', 'chr1'], key=natural_key)
+    ['chr1', 'chr2', 'chr10', 'chrX']
+    >>> sorted(['chr10', 'chr2', 'chrX', 'chr1'],
+    ...        key=order_key(['chrX', 'chr1']))
+    ['chrX', 'chr1', 'chr10', 'chr2']
+
+Tracks that are already ordered this way can be zipped without an index.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import re
+
+
+def natural_key(region):
+    """
+    Key function for natural ordering of regions, where numbers in the name
+    are ordered numerically (chr1, chr2, ..., chr10, chrX).
+
+    :arg region: Region name.
+    :type region: str
+
+    :return: Sort key for `region`.
+    :rtype: tuple
+    """
+    # Splitting on a group of digits alternates between strings and numbers,
+    # so we never compare a string with a number.
+    parts = re.split(r'(\d+)', region)
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts), region
+
+
+def order_key(regions):
+    """
+    Create a key function for ordering regions as they are listed. Regions
+    that are not listed are ordered alphabetically after the listed regions.
+
+    :arg regions: List of regions.
+    :type regions: list(str)
+
+    :return: Key function for ordering regions.
+    :rtype: function(str -> tuple)
+    """
+    ranks = dict((region, i) for i, region in enumerate(regions))
+    return lambda region: (ranks.get(region, len(ranks)), region)
+
+
+def read_order(regions):
+    """
+    Read the order of regions from the first column of a tab-delimited file
+    such as a FASTA index (``.fai``) or chromosome sizes file.
+
+    :arg regions: File to read the regions from.
+    :type regions: file
+
+    :return: List of regions.
+    :rtype: list(str)
+    """
+    return [line.split('\t')[0].strip() for line in regions
+            if line.strip() and not line.startswith('#')]
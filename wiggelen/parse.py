@@ -1,6 +1,15 @@
 """
 Helper functions for parsing wiggle tracks.
 
+Tracks in the bedGraph format [#]_ are parsed as well. They are detected by
+the ``type=bedGraph`` argument of the track definition line, or by the first
+data line having four fields. Every bedGraph line defines both a region and
+data (with the zero-based, half-open coordinates converted to a one-based
+position and a span), so it can be parsed as a region definition line and a
+data line at the same time.
+
+.. [#] http://genome.ucsc.edu/goldenPath/help/bedgraph.html
+
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 
 .. Licensed under the MIT license, see the LICENSE file.
@@ -17,14 +26,15 @@ class ParseError(Exception):
     pass
 
 
-# Line types.
+# Line types. These are flags, a bedGraph line starting a new region is both a
+# region definition and data (`REGION_DATA`).
 class LineType(object):
-    NONE, REGION, DATA = range(3)
+    NONE, REGION, DATA, REGION_DATA = range(4)
 
 
 # Track modes.
 class Mode(object):
-    VARIABLE, FIXED = range(2)
+    VARIABLE, FIXED, BEDGRAPH = range(3)
 
 
 Data = namedtuple('Data', 'position span value')
@@ -32,16 +42,56 @@ Data = namedtuple('Data', 'position span value')
 
 # Create a new object encapsulating state for the parse function.
 def create_state():
-    return dict(mode=Mode.VARIABLE, span=1, start=None, step=None)
+    return dict(mode=Mode.VARIABLE, span=1, start=None, step=None,
+                region=None)
+
+
+def _parse_bedgraph(fields, line, state):
+    # Parse the fields of a bedGraph line.
+    try:
+        region, start, end, value = fields
+        start = int(start)
+        end = int(end)
+        data = Data(position=start + 1,
+                    span=end - start,
+                    value=float(value) if '.' in value else int(value))
+    except ValueError:
+        raise ParseError('Could not parse line: %s' % line)
+
+    if data.span < 1:
+        raise ParseError('Could not parse line: %s' % line)
+
+    if region != state['region']:
+        state['region'] = region
+        return LineType.REGION_DATA, data
+    return LineType.DATA, data
+
+
+def _detect_bedgraph(line, state):
+    # Parse the line as bedGraph if we did not see a region definition yet and
+    # it has four fields, otherwise raise ParseError.
+    fields = line.split()
+    if state['region'] is not None or len(fields) != 4:
+        raise ParseError('Could not parse line: %s' % line)
+    state['mode'] = Mode.BEDGRAPH
+    return _parse_bedgraph(fields, line, state)
 
 
 def parse(line, state):
-    # Parse a line and return a tuple (line_type, data). The state dictionary
-    # is modified and should be passed as such with the next call.
+    # Parse a line and return a tuple (line_type, data), where data is the
+    # region for region definition lines. The current region is also stored
+    # in the state dictionary, which is modified and should be passed as such
+    # with the next call.
+
+    if state['mode'] == Mode.BEDGRAPH:
+        fields = line.split()
+        if (len(fields) == 4 and
+            not line.startswith(('track', 'browser', '#'))):
+            return _parse_bedgraph(fields, line, state)
 
     # As an optimization, we first check for the common case of a line with
     # data. It must always start with a number (either position or value).
-    if line[0] in '0123456789.':
+    elif line[0] in '0123456789.':
         if state['mode'] == Mode.VARIABLE:
             try:
                 position, value = line.split()
@@ -50,7 +100,8 @@ def parse(line, state):
                     span=state['span'],
                     value=float(value) if '.' in value else int(value))
             except ValueError:
-                raise ParseError('Could not parse line: %s' % line)
+                # This might be a bedGraph line with a numeric region.
+                return _detect_bedgraph(line, state)
 
         if state['mode'] == Mode.FIXED:
             try:
@@ -63,7 +114,12 @@ def parse(line, state):
             except ValueError:
                 raise ParseError('Could not parse line: %s' % line)
 
-    if (line[:7] == 'browser' or line[:5] == 'track' or line[0] == '#' or
+    if line[:5] == 'track':
+        if 'type=bedGraph' in line:
+            state['mode'] = Mode.BEDGRAPH
+        return LineType.NONE, None
+
+    if (line[:7] == 'browser' or line[0] == '#' or
         line in ('\n', '\r\n', '\r')):
         # As far as I can see empty lines and comments are not allowed
         # by the spec, but I guess they exist in the real world.
@@ -75,6 +131,7 @@ def parse(line, state):
                               line[len('variableStep'):].split()))
             state['mode'] = Mode.VARIABLE
             state['span'] = int(fields.get('span', 1))
+            state['region'] = fields['chrom']
             return LineType.REGION, fields['chrom']
         except (ValueError, KeyError):
             raise ParseError('Could not parse line: %s' % line)
@@ -91,8 +148,9 @@ def parse(line, state):
             # UCSC Genome Browser).
             # Issue: https://github.com/martijnvermaat/wiggelen/issues/1
             state['step'] = int(fields.get('step', min(1, state['span'])))
+            state['region'] = fields['chrom']
             return LineType.REGION, fields['chrom']
         except (ValueError, KeyError):
             raise ParseError('Could not parse line: %s' % line)
 
-    raise ParseError('Could not parse line: %s' % line)
+    return _detect_bedgraph(line, state)
@@ -21,7 +21,7 @@ from .wiggle import fill
 
 
 def plot(walker, regions=None, order_by='region', average_threshold=None,
-         sharey=False, ylim=None, columns=None, line=True):
+         sharey=False, ylim=None, columns=None, line=True, binned=False):
     """
     Visualize a wiggle track in a plot.
 
@@ -54,6 +54,10 @@ def plot(walker, regions=None, order_by='region', average_threshold=None,
     :arg line: Connect values to create a lineplot. Undefined positions are
         assumed to be `0`.
     :type line: bool
+    :arg binned: The walker yields values per bin instead of per position
+        (for example, using :func:`wiggelen.zoom.walk_bins`). Consecutive
+        bins are connected without filling the positions in between.
+    :type binned: bool
 
     :return: A tuple containing a matplotlib figure object, a list of
         subplots, the number of rows and the number of columns.
@@ -61,12 +65,13 @@ def plot(walker, regions=None, order_by='region', average_threshold=None,
         int
 
     .. note:: This function loads the walker in memory and as such is not
-        appropriate for use on very large datasets.
+        appropriate for use on very large datasets, unless the values are
+        summarized in bins.
     """
     fig = pyplot.figure(tight_layout=True)
     subplots = collections.OrderedDict()
 
-    if line:
+    if line and not binned:
         walker = fill(walker, regions=regions, filler=0, only_edges=True)
 
     # Keep track of the last added subplot for sharing the Y axis.
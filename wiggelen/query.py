@@ -0,0 +1,316 @@
+"""
+Query positions in wiggle tracks using random access.
+
+The region index (see :mod:`wiggelen.index`) tells us where each region
+starts in the track. To jump to a position inside a region, we use a finer
+grained index of checkpoints. Roughly every :data:`CHECKPOINT_INTERVAL`
+bytes, we store the first position of a data line, its byte offset, and the
+parser state needed to continue parsing from there. A query for a range of
+positions then takes a seek and parsing of at most a few kilobytes before
+the first position in the range is found.
+
+For tracks compressed with BGZF, the offsets are virtual offsets (see
+:mod:`wiggelen.compress`) and the interval is in compressed bytes.
+
+The checkpoints can be written to a file next to the wiggle track file (in
+case this is a regular file), using a serialization similar to that of the
+index (including the signature of the track)::
+
+    size=131506,mtime=1399110213.0,checksum=2877061482
+    region=1,position=1,offset=47,mode=0,span=1,step=0
+    region=1,position=8812,offset=65583,mode=0,span=1,step=0
+    region=X,position=1,offset=131172,mode=1,span=5,step=5
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import bisect
+import sys
+
+from .parse import LineType, Mode, create_state, parse
+from .index import ReadError, _signature, _valid, index
+from .bigwig import _Reader, is_bigwig, query_bigwig
+from .compress import decompress
+from . import index as indexing
+
+
+#: Approximate number of bytes between checkpoints.
+CHECKPOINT_INTERVAL = 1 << 16
+
+#: Suffix used for checkpoint files.
+CHECKPOINT_SUFFIX = '.pidx'
+
+
+# Cache store of checkpoints with the signature of their track, indexed by
+# checkpoint filename.
+_cache = {}
+
+
+# Try to create a filename for the checkpoint file.
+def _checkpoint_filename(track=sys.stdin):
+    filename = getattr(track, 'name', None)
+    if filename is not None and not filename.startswith('<'):
+        return filename + CHECKPOINT_SUFFIX
+
+
+def clear_cache():
+    """
+    Clear the in-memory cache of checkpoint objects.
+    """
+    _cache.clear()
+
+
+def write_checkpoints(checkpoints, track=sys.stdout):
+    """
+    Try to write the checkpoints to a file and return its filename.
+
+    :arg checkpoints: Wiggle track checkpoints.
+    :type checkpoints: dict(str, (list(int), list(int, int, int, int)))
+    :arg track: Wiggle track the checkpoints belong to.
+    :type track: file
+
+    :return: Filename for the written checkpoints, or `None` if the
+        checkpoints could not be written.
+    :rtype: str
+    """
+    filename = _checkpoint_filename(track)
+
+    if filename is None:
+        return
+
+    signature = _signature(track)
+
+    if indexing.CACHE_INDEX:
+        _cache[filename] = signature, checkpoints
+
+    if not indexing.WRITE_INDEX:
+        return
+
+    try:
+        with open(filename, 'w') as f:
+            if signature is not None:
+                f.write('size=%d,mtime=%r,checksum=%d\n' % signature)
+            for region, (positions, entries) in checkpoints.items():
+                for position, entry in zip(positions, entries):
+                    f.write('region=%s,position=%d,offset=%d,mode=%d,'
+                            'span=%d,step=%d\n'
+                            % ((region, position) + entry))
+        return filename
+    except IOError:
+        pass
+
+
+def read_checkpoints(track=sys.stdin):
+    """
+    Try to read the checkpoints from a file.
+
+    :arg track: Wiggle track the checkpoints belong to.
+    :type track: file
+
+    :return: Wiggle track checkpoints, or `None` if the checkpoints could not
+        be read or do not match the track.
+    :rtype: dict(str, (list(int), list(int, int, int, int)))
+    """
+    filename = _checkpoint_filename(track)
+
+    if filename is None:
+        return
+
+    if indexing.CACHE_INDEX and filename in _cache:
+        signature, checkpoints = _cache[filename]
+        if _valid(signature, track):
+            return checkpoints
+        del _cache[filename]
+
+    try:
+        checkpoints = {}
+        signature = None
+        with open(filename) as f:
+            for line in f:
+                checkpoint = dict(d.split('=')
+                                  for d in line.rstrip().split(','))
+                if 'region' not in checkpoint:
+                    signature = (int(checkpoint['size']),
+                                 float(checkpoint['mtime']),
+                                 int(checkpoint['checksum']))
+                    continue
+                positions, entries = checkpoints.setdefault(
+                    checkpoint['region'], ([], []))
+                positions.append(int(checkpoint['position']))
+                entries.append(tuple(int(checkpoint[field]) for field in
+                                     ('offset', 'mode', 'span', 'step')))
+        if _valid(signature, track):
+            return checkpoints
+    except (IOError, KeyError, ValueError):
+        pass
+
+
+def checkpoints(track=sys.stdin, force=False, interval=CHECKPOINT_INTERVAL):
+    """
+    Return checkpoints of positions in track.
+
+    Checkpoints are given per region as a tuple of a sorted list of positions
+    and a list of (offset, mode, span, step) tuples for these positions.
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg force: Force creating checkpoints if they do not yet exist.
+    :type force: bool
+    :arg interval: Approximate number of bytes between checkpoints.
+    :type interval: int
+
+    :return: Wiggle track checkpoints and checkpoint filename.
+    :rtype: dict(str, (list(int), list(int, int, int, int))), str
+    """
+    result = read_checkpoints(track)
+
+    if result is not None or not force:
+        return result, _checkpoint_filename(track)
+
+    track = decompress(track)
+    virtual = getattr(track, 'virtual', False)
+
+    try:
+        track.seek(0)
+    except (AttributeError, IOError):
+        raise ReadError('Could not index track (needs random access)')
+
+    result = {}
+    region = None
+    previous = None
+    state = create_state()
+
+    while True:
+        offset = track.tell()
+        line = track.readline()
+        if not line:
+            break
+        line_type, data = parse(line, state)
+
+        if line_type & LineType.REGION and state['region'] != region:
+            region = state['region']
+            previous = None
+        if line_type & LineType.DATA:
+            if previous is not None:
+                # For virtual offsets, we use the distance between the
+                # compressed blocks.
+                if virtual:
+                    distance = (offset >> 16) - (previous >> 16)
+                else:
+                    distance = offset - previous
+            if previous is None or distance >= interval:
+                positions, entries = result.setdefault(region, ([], []))
+                positions.append(data.position)
+                entries.append((offset, state['mode'], state['span'],
+                                state['step'] or 0))
+                previous = offset
+
+    return result, write_checkpoints(result, track)
+
+
+def regions(track, force_index=False):
+    """
+    Regions in the track, read from its index. Tracks in the bigWig format
+    have their own index (see :mod:`wiggelen.bigwig`).
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg force_index: Force creating an index if it does not yet exist.
+    :type force_index: bool
+
+    :return: Regions in the track, sorted alphabetically.
+    :rtype: list(str)
+    """
+    if is_bigwig(track):
+        return sorted(_Reader(track).chroms)
+
+    idx, _ = index(decompress(track), force=force_index)
+    if idx is None:
+        raise ReadError('Could not read regions of track (needs index)')
+    return sorted(region for region in idx if region != '_all')
+
+
+def query(track, region, start, end, force_index=False, runs=False):
+    """
+    Walk over the positions from `start` to `end` (both including) in a
+    region of the track.
+
+    This requires an index of the track. If checkpoints are available, they
+    are used to skip to the first position. Tracks in the bigWig format are
+    queried using their own index (see :mod:`wiggelen.bigwig`).
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg region: Region to query.
+    :type region: str
+    :arg start: First position to query.
+    :type start: int
+    :arg end: Last position to query.
+    :type end: int
+    :arg force_index: Force creating an index and checkpoints if they do not
+        yet exist.
+    :type force_index: bool
+    :arg runs: Yield tuples of (region, start, end, value) per run (see
+        :func:`wiggelen.walk`). Runs are clipped to the queried positions.
+    :type runs: bool
+
+    :return: Tuples of (region, position, value) per defined position.
+    :rtype: generator(str, int, _)
+
+    Example::
+
+        >>> for x in query(open('a.wig'), 'MT', 2, 4, force_index=True):
+        ...     x
+        ...
+        ('MT', 2, 536.0)
+        ('MT', 4, 568.0)
+    """
+    if is_bigwig(track):
+        for item in query_bigwig(track, region, start, end, runs=runs):
+            yield item
+        return
+
+    track = decompress(track)
+    idx, _ = index(track, force=force_index)
+    if idx is None:
+        raise ReadError('Could not query track (needs index)')
+
+    if region not in idx or region == '_all':
+        return
+
+    offset = idx[region]['start']
+    state = create_state()
+
+    result, _ = checkpoints(track, force=force_index)
+    positions, entries = (result or {}).get(region, ([], []))
+    i = bisect.bisect_right(positions, start) - 1
+    if i >= 0:
+        offset, mode, span, step = entries[i]
+        state.update(mode=mode, span=span, start=positions[i],
+                     step=step if mode == Mode.FIXED else None)
+
+    track.seek(offset)
+
+    while True:
+        line = track.readline()
+        if not line:
+            break
+        line_type, data = parse(line, state)
+
+        if line_type & LineType.REGION and state['region'] != region:
+            break
+        if line_type & LineType.DATA:
+            if data.position > end:
+                break
+            first = max(start, data.position)
+            last = min(end, data.position + data.span - 1)
+            if runs:
+                if first <= last:
+                    yield region, first, last, data.value
+                continue
+            while first <= last:
+                yield region, first, data.value
+                first += 1
@@ -1,10 +1,7 @@
 """
 Read and write wiggle tracks.
 
-.. todo:: Now that we also include the end positions in the index, it is
-    possible to do random jumps inside a region with some educated guessing.
-    Perfect hits would not be possible, since the length of the lines is
-    variable.
+For random jumps inside a region, see :mod:`wiggelen.query`.
 
 .. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
 
@@ -12,24 +9,83 @@ Read and write wiggle tracks.
 """
 
 
+import heapq
+import itertools
+import marshal
 import sys
+import tempfile
 
 from .parse import LineType, create_state, parse
-from .index import ReadError, index, write_index
+from .index import (ReadError, _add, _index_filename, _summary, index,
+                    write_index)
+from .cache import read_cache
+from .bigwig import is_bigwig, walk_bigwig
+from .compress import decompress
+from . import index as indexing
 
+# Python 3 compatibility.
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 
-def walk(track=sys.stdin, force_index=False):
+
+# Number of runs for which the most compact encoding is chosen at once.
+_COMPACT_CHUNK = 1024
+
+# Number of runs written to the spool at once.
+_SPOOL_CHUNK = 4096
+
+
+class OrderError(Exception):
+    """
+    Raised if the order of regions is not compatible between walkers.
+    """
+    pass
+
+
+def walk(track=sys.stdin, force_index=False, runs=False, regions=None,
+         order=None):
     """
     Walk over the track and yield (region, position, value) tuples.
 
     The values are always of type `int` or `float`.
 
+    If a valid cache exists for the track (see :mod:`wiggelen.cache`), it is
+    used instead of parsing the track.
+
+    If the index is forced but does not yet exist, it is built while walking
+    over the track. Regions in a track file are found by a byte scan for
+    region lines and are then parsed once, in the requested order. For other
+    tracks (e.g., compressed), the track is walked in one pass and regions
+    that are read before they are due are spooled to a temporary file.
+    Without forcing the index, the index built during the walk is only
+    written if :data:`wiggelen.index.INDEX_ON_WALK` is set. In both cases,
+    the index is written when the walk is complete.
+
+    Tracks in the bigWig format are read using their own index (see
+    :mod:`wiggelen.bigwig`). Tracks compressed with gzip or BGZF are
+    decompressed transparently (see :mod:`wiggelen.compress`).
+
     :arg track: Wiggle track.
     :type track: file
     :arg force_index: Force creating an index if it does not yet exist.
     :type force_index: bool
+    :arg runs: Instead of a tuple per position, yield a tuple of (region,
+        start, end, value) per data line where `start` and `end` are
+        one-based and inclusive. This avoids expanding spans into separate
+        positions.
+    :type runs: bool
+    :arg regions: Walk only these regions, in this order. This requires an
+        index. Regions that are not in the track are skipped.
+    :type regions: list(str)
+    :arg order: Key function defining the order of regions if we have an
+        index (see :mod:`wiggelen.order`). If `None`, regions are ordered
+        alphabetically.
+    :type order: function(str -> _)
 
-    :return: Tuples of (region, position, value) per defined position.
+    :return: Tuples of (region, position, value) per defined position, or
+        tuples of (region, start, end, value) per run if `runs` is `True`.
     :rtype: generator(str, int, _)
 
     Example::
@@ -42,8 +98,6 @@ def walk(track=sys.stdin, force_index=False):
         ('chr18', 34446, 657.0)
         ('chrM',  308,   520.0)
         ('chrM',  309,   519.0)
-
-    .. todo:: Optionally give a list of regions to walk, in that order.
     """
     # Todo: Do something with browser and track lines.
     # Todo: Better exceptions.
@@ -51,15 +105,52 @@ def walk(track=sys.stdin, force_index=False):
     # Todo: Detect if index does not agree with track.
     region = None
 
-    idx, _ = index(track, force=force_index)
+    if is_bigwig(track):
+        for item in walk_bigwig(track, runs=runs, regions=regions,
+                                order=order):
+            yield item
+        return
+
+    track = decompress(track)
+    idx, _ = index(track)
+    blocks = read_cache(track)
+
+    if (idx is None and blocks is None and
+        (force_index or (regions is None and indexing.INDEX_ON_WALK and
+                         _index_filename(track) is not None))):
+        try:
+            offset = track.tell()
+        except (AttributeError, IOError):
+            offset = None
+        if offset is not None:
+            for item in _walk_indexing(track, offset, runs=runs,
+                                       regions=regions, order=order,
+                                       force=force_index):
+                yield item
+            return
+
+    if idx is None and force_index:
+        idx, _ = index(track, force=True)
 
-    if idx is None:
+    if regions is not None:
+        if idx is None:
+            raise ReadError('Could not walk regions (needs index)')
+        regions = [r for r in regions if r in idx and r != '_all']
+    elif idx is None:
         regions = [None]
     else:
-        # Todo: Sort in a way that is compatible with existing wiggle tracks.
-        #     Inspiration could be sorted BAM files. GATK requires these to be
-        #     sorted according to the order in the reference file.
-        regions = sorted(r for r in idx if r != '_all')
+        regions = sorted((r for r in idx if r != '_all'), key=order)
+
+    if blocks is not None:
+        if regions != [None]:
+            blocks_by_region = {}
+            for block in blocks:
+                blocks_by_region.setdefault(block[0], []).append(block)
+            blocks = [block for r in regions
+                      for block in blocks_by_region.get(r, [])]
+        for item in _walk_blocks(blocks, runs=runs):
+            yield item
+        return
 
     for expected_region in regions:
 
@@ -70,11 +161,15 @@ def walk(track=sys.stdin, force_index=False):
 
         for line in track:
             line_type, data = parse(line, state)
-            if line_type == LineType.REGION:
-                region = data
+            if line_type & LineType.REGION:
+                region = state['region']
                 if expected_region is not None and region != expected_region:
                     break
-            elif line_type == LineType.DATA:
+            if line_type & LineType.DATA:
+                if runs:
+                    yield (region, data.position,
+                           data.position + data.span - 1, data.value)
+                    continue
                 # Optimization: A `while` loop is faster than `for` and
                 # `range`.
                 i = 0
@@ -82,29 +177,262 @@ def walk(track=sys.stdin, force_index=False):
                     yield region, data.position + i, data.value
                     i += 1
 
-        # Todo: If there is no index yet, but we read the whole file, write
-        #     the index we just built. But if we go this route, I think we
-        #     should somehow merge wiggle.walk with index.index since they
-        #     will be doing virtually the same thing.
-        #
-        #     if expected_region is None:
-        #        write_index(idx, track)
 
+def _line_size(track):
+    # Offsets in a track that is decoded while reading are byte offsets, so
+    # we count the encoded length of decoded lines.
+    encoding = getattr(track, 'encoding', None)
+    if encoding is None:
+        return len
+    errors = getattr(track, 'errors', None) or 'strict'
+    return lambda line: (len(line) if isinstance(line, bytes)
+                         else len(line.encode(encoding, errors)))
+
+
+def _walk_indexing(track, offset, runs=False, regions=None, order=None,
+                   force=False):
+    # Walk over the track and build the index on the way (like
+    # :func:`wiggelen.index.index`). Without `force`, regions are yielded in
+    # the order of the track in one pass. Otherwise, they are yielded in the
+    # order they would have with an index. Track files are then walked
+    # shard by shard (see `_walk_shards`), and in other tracks regions that
+    # are not yet due are spooled.
+    if force:
+        shards = indexing._shards(track)
+        if shards is not None:
+            for item in _walk_shards(track, shards, runs=runs,
+                                     regions=regions, order=order):
+                yield item
+            return
+
+    virtual = getattr(track, 'virtual', False)
+    size = _line_size(track)
+    idx = {'_all': _summary('_all', 0, offset)}
+    spool = _Spool()
+    pending = list(regions or [])
+    region = None
+    direct = not force
+    state = create_state()
+
+    for line in track:
+        # Offsets in compressed tracks can be virtual offsets (see
+        # :mod:`wiggelen.compress`), otherwise we avoid calling `tell`.
+        start = offset
+        offset = track.tell() if virtual else offset + size(line)
+        line_type, data = parse(line, state)
+
+        if line_type & LineType.REGION and state['region'] != region:
+            region = state['region']
+            idx[region] = _summary(region, start, offset)
+            if force:
+                spool.flush()
+                while pending and pending[0] in spool:
+                    for item in spool.walk(pending.pop(0), runs=runs):
+                        yield item
+                direct = bool(pending) and pending[0] == region
+                if direct:
+                    pending.pop(0)
+                elif regions is None or region in pending:
+                    spool.start(region)
+                else:
+                    spool.start(None)
+        if line_type & LineType.DATA:
+            idx[region]['stop'] = idx['_all']['stop'] = offset
+            _add(idx, region, data.position, data.span, data.value)
+            if not direct:
+                spool.add(data.position, data.position + data.span - 1,
+                          data.value)
+                continue
+            if runs:
+                yield (region, data.position, data.position + data.span - 1,
+                       data.value)
+                continue
+            i = 0
+            while i < data.span:
+                yield region, data.position + i, data.value
+                i += 1
+
+    # Offsets computed from line lengths are wrong if newlines were
+    # translated while reading.
+    if getattr(track, 'newlines', None) in (None, '\n'):
+        write_index(idx, track)
+
+    if regions is None:
+        pending = sorted((r for r in spool if r is not None), key=order)
+    for r in pending:
+        if r in spool:
+            for item in spool.walk(r, runs=runs):
+                yield item
+    spool.close()
+
+
+def _walk_shards(track, shards, runs=False, regions=None, order=None):
+    # Walk over the regions of a track file in the order they would have
+    # with an index by seeking to their shards (found by a byte scan, see
+    # `wiggelen.index._shards`), and build the index on the way. Every shard
+    # is parsed once. Shards that are not walked (other regions and earlier
+    # occurrences of a region) are only indexed, after the walk.
+    size = _line_size(track)
+    last = dict((region, (start, stop)) for region, start, stop in shards)
+    if regions is None:
+        regions = sorted(last, key=order)
+    walked = [(r,) + last[r] for r in regions if r in last]
+    others = [shard for shard in shards if shard not in set(walked)]
+    yielded = set(walked)
+    idx = {'_all': _summary('_all', 0, 0)}
+    indexed = set()
+
+    for shard in walked + others:
+        region, start, stop = shard
+        summaries = {'_all': _summary('_all', 0, 0),
+                     region: _summary(region, start, start)}
+        yielding = shard in yielded
+        offset = start
+        current = None
+        state = create_state()
+        track.seek(start)
+
+        while offset < stop:
+            line = track.readline()
+            if not line:
+                break
+            offset += size(line)
+            line_type, data = parse(line, state)
+
+            if line_type & LineType.REGION:
+                # Offsets computed from line lengths are wrong if newlines
+                # were translated while reading, we stop at the next region.
+                if current is None:
+                    current = state['region']
+                    summaries[region]['stop'] = offset
+                elif state['region'] != current:
+                    break
+            if line_type & LineType.DATA:
+                summaries[region]['stop'] = offset
+                summaries['_all']['stop'] = offset
+                _add(summaries, region, data.position, data.span, data.value)
+                if not yielding:
+                    continue
+                if runs:
+                    yield (region, data.position,
+                           data.position + data.span - 1, data.value)
+                    continue
+                i = 0
+                while i < data.span:
+                    yield region, data.position + i, data.value
+                    i += 1
+
+        # A region that is walked more than once is indexed once. A region
+        # occurring more than once in the track is summarized by its last
+        # occurrence (see :func:`wiggelen.index._index_shards`).
+        if shard not in indexed:
+            indexed.add(shard)
+            indexing._merge(idx['_all'], summaries['_all'])
+            if (start, stop) == last[region]:
+                idx[region] = summaries[region]
+
+    if getattr(track, 'newlines', None) in (None, '\n'):
+        write_index(idx, track)
+
+
+class _Spool(object):
+    # Temporary storage of runs per region, written in chunks serialized
+    # with marshal (faster than pickle for tuples of numbers). Runs added
+    # for region `None` are discarded.
+    def __init__(self):
+        self._file = None
+        self._chunks = {}
+        self._region = None
+        self._runs = []
 
-def zip_(*walkers):
+    def __contains__(self, region):
+        return region in self._chunks
+
+    def __iter__(self):
+        return iter(list(self._chunks))
+
+    def start(self, region):
+        # A region that occurs twice in the track only keeps its last
+        # occurrence, like in the index.
+        self.flush()
+        self._region = region
+        self._chunks[region] = []
+
+    def add(self, start, end, value):
+        self._runs.append((start, end, value))
+        if len(self._runs) >= _SPOOL_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if not self._runs:
+            return
+        if self._region is not None:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile()
+            self._file.seek(0, 2)
+            self._chunks[self._region].append(self._file.tell())
+            marshal.dump(self._runs, self._file)
+        self._runs = []
+
+    def walk(self, region, runs=False):
+        self.flush()
+        chunks = self._chunks.pop(region)
+        for chunk in chunks:
+            self._file.seek(chunk)
+            for start, end, value in marshal.load(self._file):
+                if runs:
+                    yield region, start, end, value
+                    continue
+                while start <= end:
+                    yield region, start, value
+                    start += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _walk_blocks(blocks, runs=False):
+    # Walk over (region, positions, spans, values) blocks of arrays.
+    for region, positions, spans, values in blocks:
+        for position, span, value in izip(positions.tolist(), spans.tolist(),
+                                          values.tolist()):
+            if runs:
+                yield region, position, position + span - 1, value
+                continue
+            i = 0
+            while i < span:
+                yield region, position + i, value
+                i += 1
+
+
+def zip_(*walkers, **options):
     """
     Walk over all tracks simultaneously and for each position yield the
     region, position and a list of values for each track, or `None` in case
     the track has no value on the position.
 
     .. note:: This assumes the order of regions is compatible over all
-        walkers. If you are unsure if this is the case for your input wiggle
-        tracks, use the :func:`walk` function with the `force_index` keyword
-        argument.
+        walkers and with the `order` keyword argument. If you are unsure if
+        this is the case for your input wiggle tracks, use the :func:`walk`
+        function with the `force_index` and `order` keyword arguments. An
+        :exc:`OrderError` is raised if an incompatibility is detected.
+
+    Walkers are kept in a heap, grouped by position, so the cost per
+    position grows with the logarithm of the number of walkers (instead of
+    linearly).
 
     :arg walkers: List of generators yielding tuples of (region, position,
         value) per defined position.
     :type walkers: list(generator(str, int, _))
+    :keyword runs: Walkers yield tuples of (region, start, end, value) per
+        run and we yield tuples of (region, start, end, values). Runs are
+        only split at positions where the value of another track changes.
+    :type runs: bool
+    :keyword order: Key function defining the order of regions (see
+        :mod:`wiggelen.order`). If `None`, regions are ordered
+        alphabetically.
+    :type order: function(str -> _)
 
     :return: Tuples of (region, position, values) per defined position.
     :rtype: generator(str, int, list(_))
@@ -120,49 +448,142 @@ def zip_(*walkers):
         ('MT', 1, [20.0, None])
         ('MT', 2, [36.0, 92.0])
     """
-    # We work with a list of lookahead items. If a walker has no more items,
-    # we use None in the lookahead list.
-    items = []
-    for walker in walkers:
+    order = options.get('order')
+    zip_walkers = _zip_runs if options.get('runs', False) else _zip
+
+    if order is None:
+        return zip_walkers(*walkers)
+
+    # We replace regions by (key, region) tuples, which compare according to
+    # the key function but are still unique per region.
+    ranks = {}
+
+    def rank(region):
+        if region not in ranks:
+            ranks[region] = order(region), region
+        return ranks[region]
+
+    walkers = [((rank(item[0]),) + item[1:] for item in walker)
+               for walker in walkers]
+    return ((item[0][1],) + item[1:] for item in zip_walkers(*walkers))
+
+
+def _zip(*walkers):
+    # Lookahead items are grouped by position in a dictionary, mapping
+    # (region, position) tuples to lists of (index, value) tuples for the
+    # walkers at that position. The positions themselves are kept in a heap.
+    # This way, walkers at the same position are advanced as a group.
+    groups = {}
+    heap = []
+
+    for i, walker in enumerate(walkers):
         try:
-            items.append(next(walker))
+            region, position, value = next(walker)
         except StopIteration:
-            items.append(None)
+            continue
+        group = groups.get((region, position))
+        if group is None:
+            groups[region, position] = [(i, value)]
+            heap.append((region, position))
+        else:
+            group.append((i, value))
+    heapq.heapify(heap)
 
     # Regions seen so far.
     regions = set()
     previous_region = None
 
-    while True:
-        # If all lookahead items are None, we are done.
-        if not any(items):
-            break
-
+    while heap:
         # Get the next position to yield.
-        region, position = min(item[0:2] for item in items if item is not None)
+        region, position = heapq.heappop(heap)
+        group = groups.pop((region, position))
 
         # Check region order compatibility.
         if region != previous_region:
             if region in regions:
-                raise Exception('The order of regions is not compatible')
+                raise OrderError('The order of regions is not compatible')
             regions.add(region)
             previous_region = region
 
         # Yield all values at this position.
-        values = [item[2] if item is not None and item[0:2] == (region, position)
-                  else None for item in items]
+        values = [None] * len(walkers)
+        for i, value in group:
+            values[i] = value
         yield region, position, values
 
-        # Advance the lookahead list where we just yielded a value.
-        for i, item in enumerate(items):
-            if item is not None and item[0:2] == (region, position):
-                try:
-                    items[i] = next(walkers[i])
-                except StopIteration:
-                    items[i] = None
+        # Advance the walkers where we just yielded a value.
+        for i, _ in group:
+            try:
+                region, position, value = next(walkers[i])
+            except StopIteration:
+                continue
+            next_group = groups.get((region, position))
+            if next_group is None:
+                groups[region, position] = [(i, value)]
+                heapq.heappush(heap, (region, position))
+            else:
+                next_group.append((i, value))
+
+
+def _zip_runs(*walkers):
+    # Like `_zip`, but the lookahead items are (region, start, index, end,
+    # value) tuples. A run that is only partly yielded goes back on the heap
+    # with its start moved past the yielded part.
+    heap = []
+    for i, walker in enumerate(walkers):
+        try:
+            region, start, end, value = next(walker)
+        except StopIteration:
+            continue
+        heap.append((region, start, i, end, value))
+    heapq.heapify(heap)
+
+    # Regions seen so far.
+    regions = set()
+    previous_region = None
+
+    while heap:
+        # Get the start of the next run to yield.
+        region, start = heap[0][0:2]
+
+        # Check region order compatibility.
+        if region != previous_region:
+            if region in regions:
+                raise OrderError('The order of regions is not compatible')
+            regions.add(region)
+            previous_region = region
+
+        # Collect all runs starting here.
+        items = []
+        while heap and heap[0][1] == start and heap[0][0] == region:
+            items.append(heapq.heappop(heap))
+
+        # The run ends where one of the runs starting here ends, or just
+        # before another run in this region starts.
+        end = min(item[3] for item in items)
+        if heap and heap[0][0] == region:
+            end = min(end, heap[0][1] - 1)
+
+        values = [None] * len(walkers)
+        for _, _, i, _, value in items:
+            values[i] = value
 
+        yield region, start, end, values
 
-def fill(walker, regions=None, filler=None, only_edges=False):
+        # Advance the walkers where we just yielded a value.
+        for _, _, i, item_end, value in items:
+            if item_end > end:
+                heapq.heappush(heap, (region, end + 1, i, item_end, value))
+                continue
+            try:
+                item_region, item_start, item_end, value = next(walkers[i])
+            except StopIteration:
+                continue
+            heapq.heappush(heap, (item_region, item_start, i, item_end,
+                                  value))
+
+
+def fill(walker, regions=None, filler=None, only_edges=False, runs=False):
     """
     Fill in undefined positions with `filler` (or `None`).
 
@@ -178,6 +599,9 @@ def fill(walker, regions=None, filler=None, only_edges=False):
     :arg only_edges: Only fill the first and last of continuously undefined
         positions.
     :type only_edges: bool
+    :arg runs: The walker yields tuples of (region, start, end, value) per
+        run and undefined positions are filled with runs.
+    :type runs: bool
 
     :return: Tuples of (region, position, value) per position where value is
         `filler` if it was not defined in the original walker.
@@ -213,6 +637,14 @@ def fill(walker, regions=None, filler=None, only_edges=False):
         generate the positions. I don't think it's worth it to add version
         specific code paths for this.
     """
+    if runs:
+        return _fill_runs(walker, regions=regions, filler=filler,
+                          only_edges=only_edges)
+    return _fill(walker, regions=regions, filler=filler,
+                 only_edges=only_edges)
+
+
+def _fill(walker, regions=None, filler=None, only_edges=False):
     previous_region = previous_position = None
 
     for region, position, value in walker:
@@ -274,8 +706,57 @@ def fill(walker, regions=None, filler=None, only_edges=False):
             pass
 
 
+def _fill_runs(walker, regions=None, filler=None, only_edges=False):
+    # Runs of filler values for positions `start` to `stop` (both including).
+    def gap(region, start, stop):
+        if start > stop:
+            return []
+        if only_edges and start < stop:
+            return [(region, start, start, filler),
+                    (region, stop, stop, filler)]
+        return [(region, start, stop, filler)]
+
+    previous_region = previous_end = None
+
+    for region, start, end, value in walker:
+        if region != previous_region:
+            # Backlog.
+            if regions is not None and previous_region in regions:
+                first, last = regions[previous_region]
+                for run in gap(previous_region, max(previous_end + 1, first),
+                               last):
+                    yield run
+            previous_region = region
+            previous_end = None
+
+        if regions is None:
+            # No explicitely specified regions, fill everything.
+            if previous_end is not None:
+                for run in gap(region, previous_end + 1, start - 1):
+                    yield run
+        elif region in regions:
+            # Specified where we must fill.
+            first, last = regions[region]
+            if previous_end is None:
+                runs = gap(region, first, min(start - 1, last))
+            else:
+                runs = gap(region, max(previous_end + 1, first),
+                           min(start - 1, last))
+            for run in runs:
+                yield run
+
+        previous_end = end
+        yield region, start, end, value
+
+    # Backlog.
+    if regions is not None and previous_region in regions:
+        first, last = regions[previous_region]
+        for run in gap(previous_region, max(previous_end + 1, first), last):
+            yield run
+
+
 def write(walker, track=sys.stdout, serializer=str, name=None,
-          description=None):
+          description=None, runs=False, compact=True):
     """
     Write items from a walker to a wiggle track.
 
@@ -291,6 +772,16 @@ def write(walker, track=sys.stdout, serializer=str, name=None,
     :arg description: Optional track description (displayed as center label in
         the UCSC Genome Browser).
     :type description: str
+    :arg runs: The walker yields tuples of (region, start, end, value) per
+        run. Runs longer than one position are written using the `span`
+        argument of `variableStep`.
+    :type runs: bool
+    :arg compact: Choose the most compact encoding per block of positions.
+        Adjacent positions with the same value are combined using the `span`
+        argument and positions with a constant step are written using
+        `fixedStep`. If `False`, every run is written as a `variableStep`
+        line.
+    :type compact: bool
 
     .. note:: Values of `None` are discarded.
 
@@ -306,29 +797,94 @@ def write(walker, track=sys.stdout, serializer=str, name=None,
        1 568.0
        2 598.0
        6 616.0
+    """
+    size = _write_header(track, name=name, description=description)
+    idx, size = _write_regions(walker, track, serializer=serializer,
+                               runs=runs, size=size, compact=compact)
+    _write_index(idx, track, size)
+
+
+def write_bedgraph(walker, track=sys.stdout, serializer=str, name=None,
+                   description=None, runs=False):
+    """
+    Write items from a walker to a track in the bedGraph format.
 
-    .. todo:: Options for variable or fixed step, window size, etc.
+    Adjacent positions with the same value are combined in one line.
+
+    :arg walker: Tuples of (region, position, value) per defined position.
+    :type walker: generator(str, int, _)
+    :arg track: Writable file handle.
+    :type track: file
+    :arg serializer: Function making strings from values.
+    :type serializer: function(_ -> str)
+    :arg name: Optional track name (displayed to the left of the track in the
+        UCSC Genome Browser).
+    :type name: str
+    :arg description: Optional track description (displayed as center label in
+        the UCSC Genome Browser).
+    :type description: str
+    :arg runs: The walker yields tuples of (region, start, end, value) per
+        run.
+    :type runs: bool
+
+    .. note:: Values of `None` are discarded.
+
+    Example::
+
+       >>> write_bedgraph(walk(open('a.wig')), name='My example')
+       track type=bedGraph name="My example"
+       1    0    1    520.0
+       1    3    4    536.0
+       1    7    8    553.0
+       MT   0    1    568.0
+       MT   1    2    598.0
+       MT   5    6    616.0
     """
-    size = 0
+    size = _write_header(track, name=name, description=description,
+                         type='bedGraph')
+    idx, size = _write_regions(walker, track, serializer=serializer,
+                               runs=runs, size=size, bedgraph=True)
+    _write_index(idx, track, size)
+
 
-    header = 'track type=wiggle_0'
+def _write_header(track, name=None, description=None, type='wiggle_0'):
+    # Write the track definition line and return its size.
+    header = 'track type=%s' % type
     if name is not None:
         header += ' name="%s"' % name
     if description is not None:
         header += ' description="%s"' % description
     header += '\n'
     track.write(header)
-    size += len(header)
+    return len(header)
+
 
+def _write_regions(walker, track, serializer=str, runs=False, size=0,
+                   compact=False, bedgraph=False):
+    # Write the data and return the index of the written regions and the
+    # total size of the track. Argument `size` is the number of bytes
+    # already written to the track. If `bedgraph` is `True`, the data is
+    # written in the bedGraph format.
     idx = {}
     current_region = None
 
-    for region, position, value in walker:
-        if value is None:
-            continue
+    if not runs:
+        walker = ((region, position, position, value)
+                  for region, position, value in walker)
+
+    walker = ((region, start, end, value)
+              for region, start, end, value in walker if value is not None)
+
+    if bedgraph:
+        lines = _encode_bedgraph(walker, serializer=serializer)
+    elif compact:
+        lines = _encode_compact(walker, serializer=serializer)
+    else:
+        lines = _encode(walker, serializer=serializer)
+
+    for region, line, value, span in lines:
+        track.write(line)
         if region != current_region:
-            line = 'variableStep chrom=%s\n' % region
-            track.write(line)
             idx[region] = {
                 'region': region,
                 'start':  size,
@@ -338,27 +894,185 @@ def write(walker, track=sys.stdout, serializer=str, name=None,
                 'posmin': sys.float_info.max,
                 'max':    0,
                 'count':  0}
-            size += len(line)
             current_region = region
-        line = '%d %s\n' % (position, serializer(value))
-        track.write(line)
-        idx[region]['stop'] = size + len(line)
-        idx[region]['sum'] += value
+        size += len(line)
+        idx[region]['stop'] = size
+        if value is None:
+            continue
+        idx[region]['sum'] += value * span
         idx[region]['min'] = min(value, idx[region]['min'])
         if value > 0:
             idx[region]['posmin'] = min(value, idx[region]['posmin'])
         idx[region]['max'] = max(value, idx[region]['max'])
-        idx[region]['count'] += 1
-        size += len(line)
+        idx[region]['count'] += span
+
+    return idx, size
+
+
+def _encode(walker, serializer=str):
+    # Encode runs as variableStep lines and yield (region, line, value, span)
+    # per line, where `value` is `None` for region definition lines.
+    current_region = current_span = None
+
+    for region, start, end, value in walker:
+        span = end - start + 1
+        if region != current_region or span != current_span:
+            line = 'variableStep chrom=%s' % region
+            if span != 1:
+                line += ' span=%d' % span
+            yield region, line + '\n', None, None
+            current_region = region
+            current_span = span
+        yield region, '%d %s\n' % (start, serializer(value)), value, span
+
+
+def _encode_bedgraph(walker, serializer=str):
+    # Encode runs as bedGraph lines, combining adjacent runs with the same
+    # value, and yield (region, line, value, span) per line.
+    walker = ((region, start, end, value, None)
+              for region, start, end, value in walker)
+
+    for region, start, end, value, _ in _combine(walker):
+        yield (region,
+               '%s\t%d\t%d\t%s\n' % (region, start - 1, end,
+                                       serializer(value)),
+               value, end - start + 1)
+
+
+def _encode_compact(walker, serializer=str):
+    # Encode runs as lines and yield (region, line, value, span) per line,
+    # where `value` is `None` for region definition lines. The runs are
+    # encoded in chunks of at most `_COMPACT_CHUNK` runs within one region,
+    # with and without combining adjacent runs with the same value, and the
+    # smallest is used.
+    header = None
+    chunk = []
+
+    walker = ((region, start, end, value, serializer(value))
+              for region, start, end, value in walker)
+
+    for run in itertools.chain(walker, [None]):
+        # A chunk never spans more than one region, so the encoding of a
+        # region does not depend on the regions written before it (see
+        # :func:`wiggelen.merge.write_merge`).
+        if chunk and (run is None or run[0] != chunk[-1][0] or
+                      len(chunk) >= _COMPACT_CHUNK):
+            candidates = [_encode_blocks(runs, header)
+                          for runs in (chunk, list(_combine(chunk)))]
+            lines, header = min(candidates,
+                                key=lambda c: sum(len(line[1])
+                                                  for line in c[0]))
+            for line in lines:
+                yield line
+            chunk = []
+        if run is None:
+            break
+        chunk.append(run)
+
+
+def _combine(runs):
+    # Combine adjacent runs with the same value.
+    run = None
+    for region, start, end, value, text in runs:
+        if (run is not None and region == run[0] and start == run[2] + 1 and
+            value == run[3]):
+            run = region, run[1], end, value, text
+            continue
+        if run is not None:
+            yield run
+        run = region, start, end, value, text
+
+    # Backlog.
+    if run is not None:
+        yield run
+
+
+def _encode_blocks(runs, header=None):
+    # Encode runs as lines by grouping consecutive runs with equal span and
+    # step in blocks. Argument `header` is the current variableStep region
+    # definition as a tuple of (region, span), or `None`. Return the lines
+    # and the new current variableStep region definition.
+    lines = []
+    block = []
+    step = None
+
+    for run in runs:
+        region, start, end = run[:3]
+        if block and (region != block[-1][0] or
+                      end - start != block[-1][2] - block[-1][1] or
+                      (step is not None and start - block[-1][1] != step)):
+            header = _encode_block(block, step, header, lines)
+            block = []
+            step = None
+        if block and step is None:
+            step = start - block[-1][1]
+        block.append(run)
+
+    # Backlog.
+    if block:
+        header = _encode_block(block, step, header, lines)
+
+    return lines, header
+
+
+def _encode_block(block, step, header, lines):
+    # Encode a block of runs with equal span and step as fixedStep or
+    # variableStep, whichever is smaller, and add the lines to `lines`.
+    # Return the new current variableStep region definition.
+    region, start, end = block[0][:3]
+    span = end - start + 1
+    suffix = ' span=%d\n' % span if span != 1 else '\n'
+
+    variable = []
+    if header != (region, span):
+        variable.append((region, 'variableStep chrom=%s%s' % (region, suffix),
+                         None, None))
+    variable.extend((region, '%d %s\n' % (position, text), value, span)
+                    for _, position, _, value, text in block)
+
+    if len(block) > 1:
+        fixed = [(region, 'fixedStep chrom=%s start=%d step=%d%s'
+                  % (region, start, step, suffix), None, None)]
+        fixed.extend((region, text + '\n', value, span)
+                     for _, _, _, value, text in block)
+        if (sum(len(line[1]) for line in fixed) <
+            sum(len(line[1]) for line in variable)):
+            lines.extend(fixed)
+            return None
+
+    lines.extend(variable)
+    return region, span
+
+
+def _write_index(idx, track, size):
+    # Add the summary for the entire track to the index and write it. If the
+    # track is written with BGZF compression, the offsets are converted to
+    # virtual offsets (see :mod:`wiggelen.compress`). The summary of an
+    # empty track is that of an empty region.
+    if not idx:
+        idx['_all'] = _summary('_all', 0, size)
+    else:
+        idx['_all'] = {
+            'region': '_all',
+            'start':  0,
+            'stop':   size,
+            'sum':    sum(r['sum'] for r in idx.values()),
+            'min':    min(r['min'] for r in idx.values()),
+            'posmin': min(r['posmin'] for r in idx.values()),
+            'max':    max(r['max'] for r in idx.values()),
+            'count':  sum(r['count'] for r in idx.values())}
 
-    idx['_all'] = {
-        'region': '_all',
-        'start':  0,
-        'stop':   size,
-        'sum':    sum(r['sum'] for r in idx.values()),
-        'min':    min(r['min'] for r in idx.values()),
-        'posmin': min(r['posmin'] for r in idx.values()),
-        'max':    max(r['max'] for r in idx.values()),
-        'count':  sum(r['count'] for r in idx.values())}
+    virtual_offset = getattr(track, 'virtual_offset', None)
+    if virtual_offset is not None:
+        for summary in idx.values():
+            summary['start'] = virtual_offset(summary['start'])
+            summary['stop'] = virtual_offset(summary['stop'])
+        # The signature of the track in the index (see :mod:`wiggelen.index`)
+        # is only known after the end-of-file marker block is written.
+        track.on_close.append(lambda: write_index(idx, track))
+        return
 
+    # Make sure the signature of the track in the index is computed from
+    # all written data.
+    track.flush()
     write_index(idx, track)
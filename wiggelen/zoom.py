@@ -0,0 +1,183 @@
+"""
+Summarize wiggle tracks in bins using zoom levels from the index.
+
+Summarizing a large part of a region, for example to plot an entire
+chromosome, does not require walking every position if the index has zoom
+levels (see :mod:`wiggelen.index`). We use the zoom level with the largest
+bins that are still at most as wide as the requested bins, and distribute the
+summaries of its bins over the requested bins. If a zoom bin overlaps more
+than one requested bin, its sum and count are divided proportionally to the
+overlap, which assumes the values are evenly spread in the zoom bin.
+
+If there is no suitable zoom level, the requested bins are summarized exactly
+by querying all positions (see :mod:`wiggelen.query`).
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from __future__ import division
+
+from .index import ReadError, ZOOM_LEVELS, index
+from .intervals import summarize as summarize_intervals
+from .query import query
+
+
+# Bins of `start` to `end` (both including) as (begin, end) tuples.
+def _bins(start, end, bins):
+    width = (end - start + 1) / bins
+    borders = [start + int(i * width) for i in range(bins + 1)]
+    return [(borders[i], borders[i + 1] - 1) for i in range(bins)
+            if borders[i] < borders[i + 1]]
+
+
+# Summarize bins from zoom level summaries.
+def _summarize_zoom(zoom, level, bins):
+    summaries = [{'sum': 0, 'min': None, 'max': None, 'count': 0}
+                 for _ in bins]
+
+    i = 0
+    for b in range((bins[0][0] - 1) // level, (bins[-1][1] - 1) // level + 1):
+        if b not in zoom:
+            continue
+        sum_, min_, max_, count = zoom[b]
+        first, last = b * level + 1, (b + 1) * level
+
+        while bins[i][1] < first:
+            i += 1
+
+        for j in range(i, len(bins)):
+            begin, end = bins[j]
+            if begin > last:
+                break
+            overlap = min(end, last) - max(begin, first) + 1
+            if overlap <= 0:
+                continue
+            summary = summaries[j]
+            summary['sum'] += sum_ * overlap / level
+            summary['count'] += count * overlap / level
+            if summary['min'] is None or min_ < summary['min']:
+                summary['min'] = min_
+            if summary['max'] is None or max_ > summary['max']:
+                summary['max'] = max_
+
+    for summary in summaries:
+        summary['mean'] = (summary['sum'] / summary['count']
+                           if summary['count'] else None)
+    return summaries
+
+
+def summarize(track, region, start, end, bins=1, force_index=False):
+    """
+    Summarize the values from `start` to `end` (both including) in a region
+    of the track in a number of bins of (roughly) equal width.
+
+    The summary of a bin is a dictionary with fields ``sum``, ``mean``,
+    ``min``, ``max``, and ``count`` (see :func:`wiggelen.intervals.summarize`).
+    If the bins are summarized from a zoom level, the sum, mean, and count
+    are approximations.
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg region: Region to summarize.
+    :type region: str
+    :arg start: First position to summarize.
+    :type start: int
+    :arg end: Last position to summarize.
+    :type end: int
+    :arg bins: Number of bins.
+    :type bins: int
+    :arg force_index: Force creating an index with the default zoom levels
+        (see :data:`wiggelen.index.ZOOM_LEVELS`) if it does not yet exist.
+    :type force_index: bool
+
+    :return: List of (begin, end, summary) tuples per bin.
+    :rtype: list(int, int, dict(str, _))
+
+    Example::
+
+        >>> for x in summarize(open('a.wig'), 'MT', 1, 20, bins=2,
+        ...                    force_index=True):
+        ...     x
+        ...
+        (1, 10, {'count': 10, 'min': 520.0, 'max': 676.0, 'sum': 6002.0,
+                 'mean': 600.2})
+        (11, 20, {'count': 0, 'min': None, 'max': None, 'sum': 0,
+                  'mean': None})
+    """
+    idx, _ = index(track, force=force_index,
+                   zoom_levels=ZOOM_LEVELS if force_index else None)
+    if idx is None:
+        raise ReadError('Could not summarize track (needs index)')
+
+    bins = _bins(start, end, bins)
+    if not bins:
+        return []
+
+    zoom = idx.get(region, {}).get('zoom', {})
+    width = min(e - b + 1 for b, e in bins)
+    levels = [level for level in zoom if level <= width]
+
+    if levels:
+        level = max(levels)
+        summaries = _summarize_zoom(zoom[level], level, bins)
+    else:
+        walker = query(track, region, start, end, force_index=force_index,
+                       runs=True)
+        summaries = [summary for _, summary in summarize_intervals(
+                walker, [(region, b, e) for b, e in bins], runs=True)]
+        for summary in summaries:
+            del summary['covered']
+
+    return [(b, e, summary) for (b, e), summary in zip(bins, summaries)]
+
+
+def walk_bins(track, bins=1000, regions=None, force_index=False):
+    """
+    Walk over the track and yield the mean value per bin for every region.
+
+    This can be used to plot entire regions without walking every position
+    (see :func:`wiggelen.plot.plot`).
+
+    :arg track: Wiggle track.
+    :type track: file
+    :arg bins: Number of bins per region.
+    :type bins: int
+    :arg regions: Dictionary with regions as keys and (start, stop) tuples as
+        values. If not `None`, only summarize positions from start to stop
+        (both including) in these regions. If `None`, summarize positions in
+        all regions between the first and last bin of the smallest zoom
+        level.
+    :type regions: dict(str, (int, int))
+    :arg force_index: Force creating an index with the default zoom levels
+        (see :data:`wiggelen.index.ZOOM_LEVELS`) if it does not yet exist.
+    :type force_index: bool
+
+    :return: Tuples of (region, position, value) per bin with data, where
+        `position` is the middle of the bin.
+    :rtype: generator(str, int, float)
+    """
+    idx, _ = index(track, force=force_index,
+                   zoom_levels=ZOOM_LEVELS if force_index else None)
+    if idx is None:
+        raise ReadError('Could not summarize track (needs index)')
+
+    if regions is None:
+        regions = {}
+        for region in idx:
+            zoom = idx[region].get('zoom')
+            if region == '_all' or not zoom:
+                continue
+            level = min(zoom)
+            if zoom[level]:
+                regions[region] = (min(zoom[level]) * level + 1,
+                                   (max(zoom[level]) + 1) * level)
+
+    for region in sorted(regions):
+        start, stop = regions[region]
+        for begin, end, summary in summarize(track, region, start, stop,
+                                             bins=bins):
+            if summary['mean'] is not None:
+                yield region, (begin + end) // 2, summary['mean']